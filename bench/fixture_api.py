@@ -0,0 +1,127 @@
+"""
+Substitut local de l'API SNCF pour les mesures de performance.
+Un adaptateur de transport `requests`, monté sur la session partagée de
+sncf_api, répond aux requêtes de l'application (pages, /exports, agrégats)
+à partir d'enregistrements synthétiques ou d'un fichier JSON enregistré.
+"""
+import csv
+import json
+import os
+import random
+import re
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+import requests
+from requests.adapters import BaseAdapter
+import sncf_api
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HUB = 'PARIS (intramuros)'
+
+_DATE_FILTER = re.compile(r"date = date'(\d{4}-\d{2}-\d{2})'")
+
+def synthetic_records(days: int = 30, hub_trains: int = 500, other_trains: int = 500,
+                      n_stations: int = 60, seed: int = 1) -> List[Dict]:
+    """
+    Jeu de données synthétique : `hub_trains` départs par jour depuis Paris,
+    autant de retours vers Paris et `other_trains` trains entre autres gares.
+    Les gares sont celles de data/stations.csv, géocodées sans réseau.
+    """
+    rng = random.Random(seed)
+    with open(os.path.join(ROOT, 'data', 'stations.csv'), newline='', encoding='utf-8') as f:
+        stations = [row['name'] for row in csv.DictReader(f) if row['name'] != HUB][:n_stations]
+    
+    def train(day: str, number: int, origin: str, destination: str) -> Dict:
+        depart = rng.randrange(5 * 60, 22 * 60, 5)
+        arrivee = (depart + rng.randrange(55, 330, 5)) % (24 * 60)
+        return {
+            'date': day,
+            'train_no': str(number),
+            'origine': origin,
+            'destination': destination,
+            'heure_depart': f"{depart // 60:02d}:{depart % 60:02d}",
+            'heure_arrivee': f"{arrivee // 60:02d}:{arrivee % 60:02d}",
+            'od_happy_card': 'OUI'
+        }
+    
+    records = []
+    start = date.today()
+    for offset in range(days):
+        day = (start + timedelta(days=offset)).isoformat()
+        number = 6000
+        for _ in range(hub_trains):
+            records.append(train(day, number, HUB, rng.choice(stations)))
+            records.append(train(day, number + 1, rng.choice(stations), HUB))
+            number += 2
+        for _ in range(other_trains):
+            origin, destination = rng.sample(stations, 2)
+            records.append(train(day, number, origin, destination))
+            number += 1
+    return records
+
+def load_records(path: str) -> List[Dict]:
+    """Enregistrements au format de l'API, enregistrés dans un fichier JSON."""
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+class FixtureAdapter(BaseAdapter):
+    """
+    Répond aux requêtes de l'API tgvmax à partir d'une liste d'enregistrements.
+    `latency` (secondes) simule le temps de réponse du réseau.
+    """
+    def __init__(self, records: List[Dict], latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.requests = 0
+        self._days: Dict[str, List[Dict]] = defaultdict(list)
+        for record in records:
+            self._days[record['date'][:10]].append(record)
+        for trains in self._days.values():
+            trains.sort(key=lambda r: (r['heure_depart'], r['train_no']))
+    
+    def _select(self, where: Optional[str]) -> List[Dict]:
+        match = _DATE_FILTER.search(where or '')
+        if match:
+            return self._days.get(match.group(1), [])
+        return [record for day in sorted(self._days) for record in self._days[day]]
+    
+    def _payload(self, url: str, params: Dict[str, str]):
+        rows = self._select(params.get('where'))
+        if url.endswith('/exports/json'):
+            return rows
+        select = params.get('select', '')
+        if 'group_by' in params:
+            return {'results': [{'date': day, 'n': len(self._days[day])} for day in sorted(self._days)]}
+        if 'max(date)' in select:
+            return {'results': [{'max_date': max(self._days) if self._days else None}]}
+        if 'count(*)' in select:
+            return {'results': [{'n': len(rows)}]}
+        offset = int(params.get('offset', 0))
+        limit = int(params.get('limit', sncf_api.API_LIMIT))
+        return {'total_count': len(rows), 'results': rows[offset:offset + limit]}
+    
+    def send(self, request, **kwargs):
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        url = urlparse(request.url)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        response = requests.Response()
+        response.status_code = 200
+        response.headers['Content-Type'] = 'application/json'
+        response._content = json.dumps(self._payload(url.path, params)).encode('utf-8')
+        response.url = request.url
+        response.request = request
+        return response
+    
+    def close(self):
+        pass
+
+def install(adapter: FixtureAdapter) -> FixtureAdapter:
+    """Fait passer toutes les requêtes de sncf_api par l'adaptateur."""
+    sncf_api._session.mount('https://', adapter)
+    sncf_api._session.mount('http://', adapter)
+    return adapter
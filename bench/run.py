@@ -0,0 +1,162 @@
+"""
+Mesures de performance hors ligne : l'API SNCF est remplacée par
+bench/fixture_api.py, les résultats sont écrits en JSON pour comparer
+les versions entre elles.
+
+    python bench/run.py --repeat 5 --output bench-results.json
+    python bench/run.py --fixture records.json --latency-ms 80
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+from datetime import date, time, timedelta
+from time import perf_counter
+from typing import Callable, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+import fixture_api
+import sncf_api
+from search import LocalTripSource, SearchMode, find_trips
+from trips import filter_trains_by_time, format_trips_for_display
+
+def measure(name: str, func: Callable, repeat: int,
+            setup: Optional[Callable[[], None]] = None) -> Dict:
+    """
+    Exécute `func` `repeat` fois (après `setup`, non chronométré) et résume
+    les durées en secondes et le nombre de requêtes envoyées à l'API.
+    """
+    timings, calls, result = [], [], None
+    for _ in range(repeat):
+        if setup:
+            setup()
+        calls_before = sncf_api.get_upstream_call_count()
+        start = perf_counter()
+        result = func()
+        timings.append(perf_counter() - start)
+        calls.append(sncf_api.get_upstream_call_count() - calls_before)
+    entry = {
+        'name': name,
+        'repeat': repeat,
+        'min_s': min(timings),
+        'median_s': statistics.median(timings),
+        'mean_s': statistics.fmean(timings),
+        'max_s': max(timings),
+        'upstream_calls': max(calls)
+    }
+    if hasattr(result, '__len__'):
+        entry['rows'] = len(result)
+    print(f"{name:<45} {entry['median_s'] * 1000:10.1f} ms  (appels API : {entry['upstream_calls']})",
+          file=sys.stderr)
+    return entry
+
+def _searches(start: date, days: int) -> Dict[SearchMode, Dict]:
+    windows = dict(depart_start=time(6, 0), depart_end=time(23, 0),
+                   return_start=time(6, 0), return_end=time(23, 0))
+    return {
+        SearchMode.SINGLE: dict(depart_date=start, origin_city='PARIS', **windows),
+        SearchMode.ROUND_TRIP: dict(depart_date=start, return_date=start + timedelta(days=2),
+                                    origin_city='PARIS', **windows),
+        SearchMode.DATE_RANGE: dict(depart_date=start, origin_city='PARIS',
+                                    date_range_days=days, **windows),
+        SearchMode.FLEXIBLE_ROUND_TRIP: dict(depart_date=start, origin_city='PARIS',
+                                             date_range_days=min(days, 7), min_stay=1, max_stay=3,
+                                             **windows),
+        SearchMode.CONNECTIONS: dict(depart_date=start, origin_city='LYON', **windows)
+    }
+
+def run(repeat: int, days: int) -> List[Dict]:
+    results = []
+    start = date.today()
+    first_day = start.isoformat()
+    
+    results.append(measure('sncf_api.fetch_day_records', lambda: sncf_api.fetch_day_records(first_day), repeat))
+    
+    # Couche Streamlit : cache de l'application, sans copie locale ni cache partagé
+    import utils
+    utils.SNAPSHOT_ENABLED = False
+    utils.get_shared_cache = lambda: None
+    results.append(measure('utils.get_tgvmax_trains (froid)',
+                           lambda: utils.get_tgvmax_trains(first_day, 'PARIS'),
+                           repeat, setup=lambda: utils.get_day_cache().clear()))
+    results.append(measure('utils.get_tgvmax_trains (cache)',
+                           lambda: utils.get_tgvmax_trains(first_day, 'PARIS'), repeat))
+    
+    searches = _searches(start, days)
+    warm = LocalTripSource()
+    outputs = {}
+    for mode, search in searches.items():
+        results.append(measure(f'find_trips {mode.name} (froid)',
+                               lambda: find_trips(LocalTripSource(), mode, **search), repeat))
+        outputs[mode] = find_trips(warm, mode, **search)
+        results.append(measure(f'find_trips {mode.name} (cache)',
+                               lambda: find_trips(warm, mode, **search), repeat))
+    
+    range_trips = outputs[SearchMode.DATE_RANGE]
+    results.append(measure('filter_trains_by_time (plage)',
+                           lambda: filter_trains_by_time(range_trips, time(8, 0), time(12, 0),
+                                                         is_round_trip=False), repeat))
+    results.append(measure('format_trips_for_display (plage)',
+                           lambda: format_trips_for_display(range_trips, False), repeat))
+    flexible = outputs[SearchMode.FLEXIBLE_ROUND_TRIP]
+    results.append(measure('format_trips_for_display (flexible)',
+                           lambda: format_trips_for_display(flexible, True), repeat))
+    
+    import tgvmax_app
+    display = format_trips_for_display(range_trips, False)
+    entry = measure('create_route_map (plage)',
+                    lambda: tgvmax_app.create_route_map(display, SearchMode.DATE_RANGE), repeat)
+    entry['html_bytes'] = len(tgvmax_app.create_route_map(display, SearchMode.DATE_RANGE).get_root().render())
+    results.append(entry)
+    return results
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=fixture_api.ROOT, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Mesures de performance hors ligne")
+    parser.add_argument('--days', type=int, default=30, help="jours de données synthétiques")
+    parser.add_argument('--hub-trains', type=int, default=500, help="départs quotidiens depuis Paris")
+    parser.add_argument('--other-trains', type=int, default=500, help="trains quotidiens hors Paris")
+    parser.add_argument('--fixture', help="enregistrements de l'API au format JSON, à la place des données synthétiques")
+    parser.add_argument('--latency-ms', type=float, default=0, help="latence simulée par requête")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('-o', '--output', help="fichier JSON des résultats (défaut : sortie standard)")
+    args = parser.parse_args(argv)
+    
+    logging.basicConfig(level=logging.ERROR)
+    logging.getLogger('streamlit').setLevel(logging.ERROR)
+    
+    records = (fixture_api.load_records(args.fixture) if args.fixture
+               else fixture_api.synthetic_records(args.days, args.hub_trains, args.other_trains))
+    adapter = fixture_api.install(fixture_api.FixtureAdapter(records, latency=args.latency_ms / 1000))
+    
+    report = {
+        'revision': _git_revision(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'parameters': {**vars(args), 'records': len(records)},
+        'results': run(args.repeat, args.days)
+    }
+    report['parameters']['fixture_requests'] = adapter.requests
+    
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,219 @@
+"""
+Caches clé -> octets partagés entre processus et réplicas de l'application :
+mémoire (LRU), disque (SQLite) ou serveur compatible Redis. Les valeurs sont
+encodées par l'appelant (Arrow IPC pour les trains, voir snapshot.encode_records).
+Une panne du cache n'interrompt jamais une recherche : elle est journalisée
+et traitée comme une absence de valeur.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, Optional, Tuple, TypeVar
+from config import (
+    SHARED_CACHE_BACKEND, SHARED_CACHE_PATH, SHARED_CACHE_REDIS_URL, SHARED_CACHE_MAX_ENTRIES
+)
+from metrics import count_cache
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+class CacheBackend:
+    """
+    Interface commune : les sous-classes fournissent `_get_many`, qui renvoie
+    pour chaque clé présente sa valeur et son expiration (horodatage), et `_set`.
+    """
+    name = 'cache'
+    
+    def get(self, key: str) -> Optional[bytes]:
+        return self.get_many([key]).get(key)
+    
+    def get_entry(self, key: str) -> Optional[Tuple[bytes, float]]:
+        """Valeur non expirée de la clé et horodatage de son expiration."""
+        return self.get_entries([key]).get(key)
+    
+    def get_with_ttl(self, key: str) -> Optional[Tuple[bytes, float]]:
+        """Valeur non expirée de la clé et sa durée de vie restante, en secondes."""
+        entry = self.get_entry(key)
+        return None if entry is None else (entry[0], entry[1] - time.time())
+    
+    def get_many(self, keys: Iterable[str]) -> Dict[str, bytes]:
+        """Valeurs non expirées des clés présentes dans le cache."""
+        return {key: value for key, (value, _) in self.get_entries(keys).items()}
+    
+    def get_entries(self, keys: Iterable[str]) -> Dict[str, Tuple[bytes, float]]:
+        keys = list(keys)
+        if not keys:
+            return {}
+        try:
+            return self._get_many(keys)
+        except Exception as e:
+            logger.warning("Lecture impossible dans le cache %s : %s", self.name, e)
+            return {}
+    
+    def set(self, key: str, value: bytes, ttl: int):
+        self.set_many({key: value}, ttl)
+    
+    def set_many(self, values: Dict[str, bytes], ttl: int):
+        if not values:
+            return
+        try:
+            self._set(values, ttl)
+        except Exception as e:
+            logger.warning("Écriture impossible dans le cache %s : %s", self.name, e)
+    
+    def _get_many(self, keys) -> Dict[str, Tuple[bytes, float]]:
+        raise NotImplementedError
+    
+    def _set(self, values: Dict[str, bytes], ttl: int):
+        raise NotImplementedError
+
+class MemoryCache(CacheBackend):
+    """Cache LRU en mémoire, propre au processus."""
+    name = 'memory'
+    
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[str, Tuple[float, bytes]]' = OrderedDict()
+    
+    def _get_many(self, keys) -> Dict[str, Tuple[bytes, float]]:
+        now = time.time()
+        found = {}
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                if entry[0] <= now:
+                    del self._entries[key]
+                    continue
+                self._entries.move_to_end(key)
+                found[key] = (entry[1], entry[0])
+        return found
+    
+    def _set(self, values: Dict[str, bytes], ttl: int):
+        expires_at = time.time() + ttl
+        with self._lock:
+            for key, value in values.items():
+                self._entries[key] = (expires_at, value)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+class SQLiteCache(CacheBackend):
+    """
+    Cache sur disque, partagé par les processus d'une même machine.
+    Les entrées expirées sont purgées lors des écritures.
+    """
+    name = 'sqlite'
+    
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)"
+            )
+    
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=10)
+    
+    def _get_many(self, keys) -> Dict[str, Tuple[bytes, float]]:
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT key, value, expires_at FROM cache WHERE expires_at > ? AND key IN ({','.join('?' * len(keys))})",
+                [time.time(), *keys]
+            ).fetchall()
+        return {key: (bytes(value), expires_at) for key, value, expires_at in rows}
+    
+    def _set(self, values: Dict[str, bytes], ttl: int):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("DELETE FROM cache WHERE expires_at <= ?", (now,))
+            conn.executemany(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                [(key, value, now + ttl) for key, value in values.items()]
+            )
+
+class RedisCache(CacheBackend):
+    """
+    Cache partagé entre réplicas, sur un serveur compatible Redis.
+    Nécessite le paquet optionnel `redis` ; `client` permet d'en fournir un autre.
+    """
+    name = 'redis'
+    
+    def __init__(self, url: str = None, prefix: str = 'tgvmax:', client=None):
+        if client is None:
+            try:
+                import redis
+            except ImportError as e:
+                raise ImportError("Le cache Redis nécessite le paquet 'redis' (pip install redis)") from e
+            client = redis.Redis.from_url(url, socket_timeout=2, socket_connect_timeout=2)
+        self.client = client
+        self.prefix = prefix
+    
+    def _get_many(self, keys) -> Dict[str, Tuple[bytes, float]]:
+        pipeline = self.client.pipeline()
+        for key in keys:
+            pipeline.get(self.prefix + key)
+            pipeline.pttl(self.prefix + key)
+        replies = pipeline.execute()
+        now = time.time()
+        # PTTL : durée restante en millisecondes (négative si la clé n'expire pas ou n'existe plus)
+        return {
+            key: (value, now + remaining / 1000 if remaining >= 0 else float('inf'))
+            for key, value, remaining in zip(keys, replies[::2], replies[1::2]) if value is not None
+        }
+    
+    def _set(self, values: Dict[str, bytes], ttl: int):
+        pipeline = self.client.pipeline()
+        for key, value in values.items():
+            pipeline.set(self.prefix + key, value, ex=ttl)
+        pipeline.execute()
+
+def create_backend(kind: str, path: str = None, url: str = None,
+                   max_entries: int = 256) -> CacheBackend:
+    """Construit le cache configuré : 'memory', 'sqlite' ou 'redis'."""
+    if kind == 'memory':
+        return MemoryCache(max_entries)
+    if kind == 'sqlite':
+        return SQLiteCache(path)
+    if kind == 'redis':
+        return RedisCache(url)
+    raise ValueError(f"Cache inconnu : {kind}")
+
+def open_shared_cache() -> Optional[CacheBackend]:
+    """
+    Cache partagé décrit dans config.py, ou None s'il est inaccessible
+    (les données sont alors redemandées à l'API).
+    """
+    try:
+        return create_backend(SHARED_CACHE_BACKEND, path=SHARED_CACHE_PATH,
+                              url=SHARED_CACHE_REDIS_URL, max_entries=SHARED_CACHE_MAX_ENTRIES)
+    except Exception as e:
+        logger.warning("Cache partagé %s indisponible : %s", SHARED_CACHE_BACKEND, e)
+        return None
+
+def read_through(cache: Optional[CacheBackend], key: str, ttl: int,
+                 compute: Callable[[], T], encode: Callable[[T], bytes],
+                 decode: Callable[[bytes], T]) -> Tuple[T, float]:
+    """
+    Valeur lue dans le cache, ou calculée puis stockée pour `ttl` secondes,
+    et sa durée de vie restante en secondes : une copie locale de la valeur
+    ne doit pas survivre à l'entrée partagée.
+    """
+    if cache is None:
+        return compute(), ttl
+    entry = cache.get_entry(key)
+    count_cache(cache.name, entry is not None)
+    if entry is not None:
+        return decode(entry[0]), entry[1] - time.time()
+    value = compute()
+    cache.set(key, encode(value), ttl)
+    return value, ttl
@@ -2,7 +2,16 @@ from datetime import datetime, time, timedelta
 
 # API Configuration
 SNCF_API_URL = "https://ressources.data.sncf.com/api/explore/v2.1/catalog/datasets/tgvmax/records"
-API_LIMIT = 100
+SNCF_EXPORT_URL = "https://ressources.data.sncf.com/api/explore/v2.1/catalog/datasets/tgvmax/exports/json"
+API_LIMIT = 100  # Taille maximale d'une page
+API_MAX_OFFSET = 10000  # Limite offset + limit de l'API, au-delà on passe par /exports
+API_TIMEOUT = 10  # secondes
+EXPORT_TIMEOUT = 60  # secondes
+MAX_CONCURRENT_REQUESTS = 8  # Requêtes simultanées maximum vers l'API
+API_MAX_RETRIES = 3  # Nouvelles tentatives sur 429 / 5xx / erreurs réseau
+API_BACKOFF_FACTOR = 0.5  # Attente de base entre tentatives (exponentielle)
+API_BACKOFF_JITTER = 0.5  # Part aléatoire ajoutée à chaque attente (secondes)
+API_MAX_RATE_LIMIT_WAIT = 30  # Attente maximum quand le quota est épuisé (secondes)
 
 # Date Configuration
 MIN_DATE = datetime.now().date()
@@ -16,6 +25,76 @@ DEFAULT_END_TIME = time(23, 0)
 DEFAULT_ORIGIN = "PARIS"
 MAX_RANGE_DAYS = 30  # Maximum de 30 jours
 DEFAULT_RANGE_DAYS = 7  # Une semaine par défaut
+MAX_STAY_DAYS = 14  # Séjour maximum en aller-retour flexible
+DEFAULT_MIN_STAY = 1
+DEFAULT_MAX_STAY = 3
+
+# Connection Configuration
+MAX_CHANGES = 2  # Correspondances maximum d'un trajet
+MIN_TRANSFER_MINUTES = 15  # Temps minimum pour changer de train dans une même gare
+MAX_TRANSFER_MINUTES = 240  # Attente maximum en gare entre deux trains
 
 # Cache Configuration
-CACHE_TTL = 3600  # 1 hour in seconds 
\ No newline at end of file
+CACHE_TTL = 3600  # 1 hour in seconds
+LATEST_DATE_TTL = 3 * 3600  # Le jeu de données n'est mis à jour qu'une fois par jour
+SEARCH_CACHE_MAX_ENTRIES = 64  # Résultats de recherche partagés entre les sessions
+
+# Shared Cache Configuration
+SHARED_CACHE_BACKEND = "sqlite"  # "memory", "sqlite" (processus d'une machine) ou "redis" (réplicas)
+SHARED_CACHE_PATH = ".cache/tgvmax_cache.sqlite"
+SHARED_CACHE_REDIS_URL = "redis://localhost:6379/0"
+SHARED_CACHE_MAX_ENTRIES = 256  # Entrées du cache "memory"
+
+# Prewarm Configuration
+PREWARM_ENABLED = True  # Recharge en arrière-plan les journées recherchées avant leur expiration
+PREWARM_ORIGINS = ["PARIS", "LYON", "MARSEILLE"]  # Origines toujours considérées populaires
+PREWARM_MAX_ORIGINS = 5  # Origines les plus recherchées ajoutées depuis le journal
+PREWARM_MIN_QUERIES = 3  # Recherches minimum pour qu'une origine soit populaire
+PREWARM_LOG_PATH = ".cache/tgvmax_queries.jsonl"  # Journal des recherches
+PREWARM_LOG_DAYS = 7  # Historique du journal pris en compte
+PREWARM_REFRESH_AHEAD = 300  # Secondes avant expiration où une journée est rechargée
+PREWARM_INTERVAL = 60  # Secondes entre deux passages
+PREWARM_START_DELAY = 10  # Premier passage après le premier rendu
+PREWARM_MAX_REQUESTS_PER_HOUR = 120  # Plafond du budget de requêtes à l'API
+
+# Startup Configuration
+STARTUP_BUDGET_SECONDS = 1.5  # Délai maximum avant le premier rendu
+STARTUP_MAX_UPSTREAM_CALLS = 1  # Appels à l'API autorisés avant le premier rendu
+
+# Snapshot Configuration
+SNAPSHOT_ENABLED = True  # Copie locale du jeu de données complet
+SNAPSHOT_PATH = ".cache/tgvmax_snapshot.arrow"
+SNAPSHOT_REFRESH_INTERVAL = 900  # 15 minutes en secondes
+SNAPSHOT_FULL_RELOAD_INTERVAL = 3600  # Rechargement complet : détecte les trains remplacés à nombre égal
+
+# Watch Configuration
+WATCH_ENABLED = True  # Alertes de nouvelles places sur les favoris (nécessite la copie locale)
+WATCH_NOTIFIER = "file"  # "file", "webhook" ou "queue"
+WATCH_EVENTS_PATH = ".cache/tgvmax_alerts.jsonl"  # Alertes du notificateur "file"
+WATCH_WEBHOOK_URL = ""  # Destination du notificateur "webhook"
+
+# Favorites Configuration
+FAVORITES_DB_PATH = ".cache/tgvmax_favorites.sqlite"
+FAVORITES_USER_PARAM = "user"  # Paramètre d'URL identifiant l'utilisateur
+
+# Geocoding Configuration
+STATIONS_PATH = "data/stations.csv"  # Coordonnées des gares livrées avec l'application
+GEOCODE_TTL = 30 * 24 * 3600  # Les gares ne bougent pas : 30 jours
+GEOCODE_CACHE_PATH = ".cache/tgvmax_geocode.sqlite"  # Géocodages conservés quel que soit le cache partagé
+NOMINATIM_USER_AGENT = "tgvmax_finder"
+NOMINATIM_MIN_DELAY = 1.0  # Politique d'usage Nominatim : 1 requête par seconde
+
+# Map Configuration
+MAP_FAST_RENDER_THRESHOLD = 150  # Au-delà de ce nombre de liaisons, rendu GeoJSON groupé
+MAP_POPUP_MAX_TIMES = 12  # Heures de départ listées au maximum par liaison
+
+# Display Configuration
+RESULTS_PAGE_SIZE = 10  # Destinations ou liaisons affichées par page
+DETAIL_PAGE_ROWS = 500  # Trajets par page de la vue détaillée
+STREAM_RENDER_INTERVAL = 0.3  # Secondes minimum entre deux affichages de résultats partiels
+STREAM_PREVIEW_ROWS = 200  # Trajets affichés pendant la recherche
+
+# Metrics Configuration
+METRICS_ENABLED = True  # Sert /metrics au format Prometheus
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9108
@@ -0,0 +1,171 @@
+"""
+Trajets avec correspondances : algorithme de balayage des connexions
+(connection scan) sur les trains d'une ou plusieurs journées.
+Les trains sont parcourus une seule fois, par heure de départ absolue ; pour
+chaque gare et chaque nombre de trains déjà empruntés, une file glissante
+garde les arrivées encore utilisables (entre `min_transfer` et `max_transfer`
+minutes avant le départ), la meilleure en tête.
+"""
+import heapq
+import itertools
+from collections import deque
+from datetime import date, time
+from typing import Deque, Dict, List, NamedTuple, Optional, Tuple
+import numpy as np
+import pandas as pd
+from config import MAX_CHANGES, MIN_TRANSFER_MINUTES, MAX_TRANSFER_MINUTES
+from trips import MINUTES_PER_DAY, minute_of_day
+
+JOURNEY_COLUMNS = [
+    'origine', 'destination', 'date', 'depart_min', 'arrivee_min', 'duree_min',
+    'correspondances', 'via', 'train_no', 'attente_min'
+]
+
+class _Label(NamedTuple):
+    # Meilleure façon connue d'être dans un train : départ de la gare d'origine,
+    # arrivée du train, ligne du train dans la table et étiquette précédente
+    depart: int
+    arrivee: int
+    row: int
+    parent: Optional['_Label']
+
+def _station_codes(trains: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+    # Codes communs aux colonnes origine et destination
+    stations = sorted(set(trains['origine'].cat.categories) | set(trains['destination'].cat.categories))
+    return (
+        trains['origine'].cat.set_categories(stations).cat.codes.to_numpy(),
+        trains['destination'].cat.set_categories(stations).cat.codes.to_numpy(),
+        stations
+    )
+
+def _prefix_mask(stations: List[str], prefix: Optional[str]) -> np.ndarray:
+    prefix = (prefix or '').strip().upper()
+    return np.array([name.upper().startswith(prefix) for name in stations], dtype=bool)
+
+def scan_connections(trains: pd.DataFrame, origin: str, destination: str = None,
+                     depart_date: date = None, depart_start: time = None, depart_end: time = None,
+                     min_transfer: int = MIN_TRANSFER_MINUTES, max_transfer: int = MAX_TRANSFER_MINUTES,
+                     max_changes: int = MAX_CHANGES) -> pd.DataFrame:
+    """
+    Trajets depuis les gares commençant par `origin` (vers celles commençant
+    par `destination`, ou vers toutes), avec au plus `max_changes`
+    correspondances. Seuls les trajets Pareto-optimaux sont conservés : aucun
+    autre ne part plus tard, n'arrive plus tôt et ne change moins souvent.
+    `trains` est une table typée (voir trips.normalize_trains) ; la date et
+    les plages horaires de départ s'appliquent au premier train.
+    """
+    if trains.empty or not origin:
+        return pd.DataFrame(columns=JOURNEY_COLUMNS)
+    
+    origins, destinations, stations = _station_codes(trains)
+    is_origin = _prefix_mask(stations, origin)
+    is_destination = _prefix_mask(stations, destination)
+    
+    # Temps absolus en minutes depuis le premier jour de la table
+    first_day = trains['date'].min()
+    day_offsets = ((trains['date'] - first_day).dt.days * MINUTES_PER_DAY).to_numpy()
+    departures = day_offsets + trains['depart_min'].to_numpy().astype(np.int64)
+    arrivals = departures + trains['duree_min'].to_numpy().astype(np.int64)
+    boardable = is_origin[origins]
+    if depart_date:
+        boardable &= (trains['date'] == pd.Timestamp(depart_date)).to_numpy()
+    if depart_start and depart_end:
+        boardable &= trains['depart_min'].between(minute_of_day(depart_start),
+                                                  minute_of_day(depart_end)).to_numpy()
+    
+    # Arrivées en attente du délai de correspondance : (utilisable à, ordre, gare, trains, étiquette)
+    pending: List[Tuple[int, int, int, int, _Label]] = []
+    # (gare, trains empruntés) -> arrivées utilisables, départs d'origine décroissants
+    windows: Dict[Tuple[int, int], Deque[_Label]] = {}
+    journeys: List[Tuple[int, _Label]] = []
+    order = itertools.count()
+    
+    for row in np.argsort(departures, kind='stable'):
+        station, departure = origins[row], departures[row]
+        while pending and pending[0][0] <= departure:
+            _, _, at, legs, label = heapq.heappop(pending)
+            window = windows.setdefault((at, legs), deque())
+            # Une arrivée antérieure partie moins tard de l'origine ne sera plus jamais la meilleure
+            while window and window[-1].depart <= label.depart:
+                window.pop()
+            window.append(label)
+        
+        boarded = []
+        if boardable[row]:
+            boarded.append((1, _Label(departure, arrivals[row], row, None)))
+        for legs in range(1, max_changes + 1):
+            window = windows.get((station, legs))
+            while window and window[0].arrivee < departure - max_transfer:
+                window.popleft()
+            if window:
+                boarded.append((legs + 1, _Label(window[0].depart, arrivals[row], row, window[0])))
+        
+        destination_station = destinations[row]
+        if is_origin[destination_station]:
+            continue
+        for legs, label in boarded:
+            if is_destination[destination_station]:
+                journeys.append((legs - 1, label))
+            if legs <= max_changes:
+                heapq.heappush(pending, (label.arrivee + min_transfer, next(order),
+                                         destination_station, legs, label))
+    
+    return _journeys_frame(trains, journeys, origins, destinations, stations, first_day)
+
+def _pareto(journeys: pd.DataFrame) -> pd.DataFrame:
+    """
+    Trajets non dominés, par destination : trié par départ décroissant, un
+    trajet est dominé si un trajet déjà vu arrive au plus tard à la même
+    heure avec au plus autant de correspondances.
+    """
+    journeys = journeys.sort_values(['destination', 'depart_abs', 'arrivee_abs', 'correspondances'],
+                                    ascending=[True, False, True, True], kind='stable')
+    journeys = journeys.drop_duplicates(['destination', 'depart_abs', 'arrivee_abs', 'correspondances'])
+    dominated = np.zeros(len(journeys), dtype=bool)
+    by_destination = journeys['destination']
+    for changes in range(int(journeys['correspondances'].max()) + 1):
+        arrivals = journeys['arrivee_abs'].where(journeys['correspondances'] <= changes, np.inf)
+        best_before = arrivals.groupby(by_destination, sort=False).cummin().groupby(
+            by_destination, sort=False).shift(fill_value=np.inf)
+        dominated |= ((journeys['correspondances'] == changes) & (best_before <= journeys['arrivee_abs'])).to_numpy()
+    return journeys[~dominated].sort_values(['depart_abs', 'arrivee_abs'], kind='stable')
+
+def _journeys_frame(trains: pd.DataFrame, journeys: List[Tuple[int, _Label]], origins: np.ndarray,
+                    destinations: np.ndarray, stations: List[str], first_day) -> pd.DataFrame:
+    if not journeys:
+        return pd.DataFrame(columns=JOURNEY_COLUMNS)
+    
+    train_numbers = trains['train_no'].to_numpy()
+    durations = trains['duree_min'].to_numpy()
+    records = []
+    for changes, label in journeys:
+        legs = []
+        while label is not None:
+            legs.append(label)
+            label = label.parent
+        legs.reverse()
+        first, last = legs[0], legs[-1]
+        records.append({
+            'origine': stations[origins[first.row]],
+            'destination': stations[destinations[last.row]],
+            'depart_abs': int(first.depart),
+            'arrivee_abs': int(last.arrivee),
+            'correspondances': changes,
+            'via': ', '.join(stations[origins[leg.row]] for leg in legs[1:]),
+            'train_no': ' + '.join(train_numbers[leg.row] for leg in legs),
+            # Temps passé en gare entre deux trains
+            'attente_min': int(last.arrivee - first.depart) - sum(int(durations[leg.row]) for leg in legs)
+        })
+    df = _pareto(pd.DataFrame(records))
+    return pd.DataFrame({
+        'origine': df['origine'].astype('category'),
+        'destination': df['destination'].astype('category'),
+        'date': first_day + pd.to_timedelta(df['depart_abs'] // MINUTES_PER_DAY, unit='D'),
+        'depart_min': (df['depart_abs'] % MINUTES_PER_DAY).astype('int16'),
+        'arrivee_min': (df['arrivee_abs'] % MINUTES_PER_DAY).astype('int16'),
+        'duree_min': (df['arrivee_abs'] - df['depart_abs']).astype('int16'),
+        'correspondances': df['correspondances'].astype('int8'),
+        'via': df['via'],
+        'train_no': df['train_no'],
+        'attente_min': df['attente_min'].astype('int16')
+    }).reset_index(drop=True)
@@ -0,0 +1,61 @@
+"""
+Index en mémoire des trains d'une journée, par préfixe d'origine et de
+destination. Une journée est récupérée une seule fois, sans filtre, puis
+toutes les combinaisons origine / destination sont résolues localement.
+"""
+from bisect import bisect_left
+from typing import Dict, List, Optional, Union
+import numpy as np
+import pandas as pd
+from trips import normalize_trains, trips_to_records
+
+class _StationPrefixIndex:
+    """
+    Noms de gares (en majuscules) triés, associés à leur code de catégorie :
+    les gares partageant un préfixe sont contiguës dans la liste triée.
+    """
+    def __init__(self, stations: pd.Series):
+        pairs = sorted((name.upper(), code) for code, name in enumerate(stations.cat.categories))
+        self._names = [name for name, _ in pairs]
+        self._codes = [code for _, code in pairs]
+        self._values = stations.cat.codes.to_numpy()
+    
+    def mask(self, prefix: str) -> np.ndarray:
+        prefix = prefix.strip().upper()
+        codes = []
+        for i in range(bisect_left(self._names, prefix), len(self._names)):
+            if not self._names[i].startswith(prefix):
+                break
+            codes.append(self._codes[i])
+        return np.isin(self._values, codes)
+
+class DayIndex:
+    """
+    Trains d'une journée au format typé (voir trips.normalize_trains), dans
+    l'ordre de départ, avec un index par préfixe sur l'origine et la destination.
+    Les tables renvoyées sont partagées : elles ne doivent pas être modifiées.
+    """
+    def __init__(self, trains: Union[List[Dict], pd.DataFrame]):
+        self.frame = normalize_trains(trains)
+        self._origins = _StationPrefixIndex(self.frame['origine'])
+        self._destinations = _StationPrefixIndex(self.frame['destination'])
+    
+    def query_frame(self, origin: Optional[str] = None, destination: Optional[str] = None) -> pd.DataFrame:
+        """
+        Trains dont l'origine et la destination commencent par les préfixes
+        donnés (sans tenir compte de la casse).
+        """
+        if not origin and not destination:
+            return self.frame
+        mask = np.ones(len(self.frame), dtype=bool)
+        if origin:
+            mask &= self._origins.mask(origin)
+        if destination:
+            mask &= self._destinations.mask(destination)
+        return self.frame[mask]
+    
+    def query(self, origin: Optional[str] = None, destination: Optional[str] = None) -> List[Dict]:
+        """
+        Même sélection que query_frame, au format des enregistrements de l'API.
+        """
+        return trips_to_records(self.query_frame(origin, destination))
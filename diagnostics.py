@@ -0,0 +1,59 @@
+"""
+Mesures de démarrage de l'application et contrôle du budget de latence.
+Ce module ne dépend pas de Streamlit : il est importé une seule fois par
+processus, ce qui permet de conserver le rapport du démarrage à froid.
+"""
+import logging
+import threading
+from typing import Dict, List, Optional
+from config import STARTUP_BUDGET_SECONDS, STARTUP_MAX_UPSTREAM_CALLS
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_cold_start: Optional[Dict] = None
+_last_render: Optional[Dict] = None
+
+def check_startup_budget(report: Dict) -> List[str]:
+    """
+    Liste les dépassements du budget de démarrage pour un rapport donné.
+    """
+    violations = []
+    if report['first_paint_seconds'] > STARTUP_BUDGET_SECONDS:
+        violations.append(
+            f"Premier rendu en {report['first_paint_seconds']:.2f}s "
+            f"(budget : {STARTUP_BUDGET_SECONDS:.2f}s)"
+        )
+    if report['upstream_calls'] > STARTUP_MAX_UPSTREAM_CALLS:
+        violations.append(
+            f"{report['upstream_calls']} appel(s) à l'API avant le premier rendu "
+            f"(budget : {STARTUP_MAX_UPSTREAM_CALLS})"
+        )
+    return violations
+
+def record_render(import_seconds: float, first_paint_seconds: float, upstream_calls: int) -> Dict:
+    """
+    Enregistre les temps d'une exécution du script. La première exécution
+    du processus est conservée comme rapport de démarrage à froid.
+    """
+    global _cold_start, _last_render
+    report = {
+        'import_seconds': import_seconds,
+        'first_paint_seconds': first_paint_seconds,
+        'upstream_calls': upstream_calls,
+    }
+    with _lock:
+        report['cold'] = _cold_start is None
+        if report['cold']:
+            _cold_start = report
+        _last_render = report
+    
+    for violation in check_startup_budget(report):
+        logger.warning("Budget de démarrage dépassé : %s", violation)
+    return report
+
+def get_cold_start_report() -> Optional[Dict]:
+    return _cold_start
+
+def get_last_render_report() -> Optional[Dict]:
+    return _last_render
@@ -0,0 +1,140 @@
+"""
+Favoris des utilisateurs, conservés côté serveur dans une base SQLite,
+avec les trains disponibles de chaque liaison favorite. Ces disponibilités
+sont recalculées en une passe à chaque rafraîchissement de la copie locale :
+afficher les favoris n'est qu'une lecture indexée, sans recherche.
+"""
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Iterable, List, Optional, Tuple
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from sncf_api import TRAIN_FIELDS
+
+Route = Tuple[str, str]
+
+FAVORITE_COLUMNS = ['origine', 'destination', 'trains', 'jours', 'prochain_depart']
+
+class FavoritesStore:
+    """
+    Liaisons favorites par utilisateur et trains disponibles par liaison.
+    Les noms de gares sont ceux du jeu de données, sans normalisation.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._snapshot = None
+        self._refresh_lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS favorites ("
+                " user_id TEXT NOT NULL, origine TEXT NOT NULL, destination TEXT NOT NULL,"
+                " added_at REAL NOT NULL, PRIMARY KEY (user_id, origine, destination))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS favorites_route ON favorites (origine, destination)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS availability ("
+                " origine TEXT NOT NULL, destination TEXT NOT NULL, date TEXT NOT NULL,"
+                " train_no TEXT NOT NULL, heure_depart TEXT NOT NULL, heure_arrivee TEXT,"
+                " PRIMARY KEY (origine, destination, date, heure_depart, train_no))"
+            )
+    
+    @property
+    def tracks_availability(self) -> bool:
+        """Faux sans copie locale : les disponibilités ne sont alors pas calculées."""
+        return self._snapshot is not None
+    
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=10)
+    
+    def add(self, user_id: str, origin: str, destination: str):
+        """Ajoute une liaison aux favoris et calcule aussitôt ses disponibilités."""
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO favorites (user_id, origine, destination, added_at) VALUES (?, ?, ?, ?)",
+                (user_id, origin, destination, time.time())
+            )
+        if self._snapshot is not None:
+            self.refresh_availability(self._snapshot.table, routes=[(origin, destination)])
+    
+    def remove(self, user_id: str, origin: str, destination: str):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM favorites WHERE user_id = ? AND origine = ? AND destination = ?",
+                         (user_id, origin, destination))
+    
+    def routes(self, user_id: str) -> List[Route]:
+        """Liaisons favorites d'un utilisateur, par ordre d'ajout."""
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT origine, destination FROM favorites WHERE user_id = ? ORDER BY added_at",
+                (user_id,)
+            ).fetchall()
+    
+    def subscriptions(self) -> List[Tuple[str, str, str]]:
+        """Tous les favoris, (utilisateur, origine, destination)."""
+        with self._connect() as conn:
+            return conn.execute("SELECT user_id, origine, destination FROM favorites").fetchall()
+    
+    def favorites(self, user_id: str, now: Optional[datetime] = None) -> pd.DataFrame:
+        """
+        Favoris d'un utilisateur avec leurs disponibilités précalculées :
+        nombre de trains et de jours, prochain départ ('AAAA-MM-JJ HH:MM').
+        """
+        now = (now or datetime.now()).strftime('%Y-%m-%d %H:%M')
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT f.origine, f.destination, COUNT(a.train_no), COUNT(DISTINCT a.date),"
+                " MIN(CASE WHEN a.date || ' ' || a.heure_depart >= ? THEN a.date || ' ' || a.heure_depart END)"
+                " FROM favorites f LEFT JOIN availability a"
+                " ON a.origine = f.origine AND a.destination = f.destination"
+                " WHERE f.user_id = ?"
+                " GROUP BY f.origine, f.destination ORDER BY MIN(f.added_at)",
+                (now, user_id)
+            ).fetchall()
+        return pd.DataFrame(rows, columns=FAVORITE_COLUMNS)
+    
+    def refresh_availability(self, trains: pa.Table, routes: Optional[Iterable[Route]] = None) -> int:
+        """
+        Recalcule les disponibilités des liaisons favorites (ou de `routes`
+        seulement) à partir de la table des trains de la copie locale.
+        Renvoie le nombre de trains retenus.
+        """
+        with self._refresh_lock, self._connect() as conn:
+            if routes is None:
+                routes = conn.execute("SELECT DISTINCT origine, destination FROM favorites").fetchall()
+                conn.execute("DELETE FROM availability")
+            else:
+                routes = list(routes)
+                conn.executemany("DELETE FROM availability WHERE origine = ? AND destination = ?", routes)
+            if not routes or trains.num_rows == 0:
+                return 0
+            
+            # Présélection dans Arrow des gares concernées, puis une seule jointure avec les liaisons
+            origins = pa.array(sorted({origin for origin, _ in routes}), pa.string())
+            destinations = pa.array(sorted({destination for _, destination in routes}), pa.string())
+            candidates = trains.filter(pc.and_(pc.is_in(trains['origine'], value_set=origins),
+                                               pc.is_in(trains['destination'], value_set=destinations)))
+            wanted = pd.DataFrame(routes, columns=['origine', 'destination'])
+            matched = candidates.select(TRAIN_FIELDS).to_pandas().merge(wanted, on=['origine', 'destination'])
+            conn.executemany(
+                "INSERT OR REPLACE INTO availability"
+                " (origine, destination, date, train_no, heure_depart, heure_arrivee) VALUES (?, ?, ?, ?, ?, ?)",
+                matched[['origine', 'destination', 'date', 'train_no', 'heure_depart', 'heure_arrivee']]
+                .itertuples(index=False, name=None)
+            )
+            return len(matched)
+    
+    def attach(self, snapshot):
+        """
+        Recalcule les disponibilités maintenant puis à chaque rafraîchissement
+        de `snapshot` (voir TrainSnapshot).
+        """
+        self._snapshot = snapshot
+        snapshot.add_listener(lambda previous, current, days: self.refresh_availability(current))
+        if snapshot.table.num_rows:
+            self.refresh_availability(snapshot.table)
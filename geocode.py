@@ -0,0 +1,134 @@
+"""
+Coordonnées des gares du jeu de données tgvmax.
+Les gares connues sont lues dans une table livrée avec l'application
+(data/stations.csv) ; les autres sont géocodées via Nominatim et mémorisées
+dans un fichier SQLite local, qui survit aux redémarrages, et dans le cache
+partagé entre réplicas (voir cache_backends).
+"""
+import csv
+import logging
+import os
+import re
+import struct
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+from geopy.exc import GeopyError
+from geopy.extra.rate_limiter import RateLimiter
+from geopy.geocoders import Nominatim
+from metrics import registry, span
+from cache_backends import CacheBackend, SQLiteCache
+
+logger = logging.getLogger(__name__)
+
+Coordinates = Tuple[float, float]
+
+_PARENTHESES = re.compile(r'\(.*?\)')
+# Latitude et longitude en deux doubles ; une valeur vide mémorise un échec
+_COORDINATES = struct.Struct('<dd')
+
+def normalize_station(name: str) -> str:
+    """Clé de recherche d'une gare : majuscules, espaces simplifiés."""
+    return ' '.join(name.upper().split())
+
+def geocoding_query(name: str) -> str:
+    """Requête Nominatim pour une gare : sans les mentions entre parenthèses."""
+    return f"{_PARENTHESES.sub('', name).strip()}, France"
+
+def load_station_table(path: str) -> Dict[str, Coordinates]:
+    """Lit la table des gares livrée avec l'application."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, newline='', encoding='utf-8') as f:
+        return {
+            normalize_station(row['name']): (float(row['latitude']), float(row['longitude']))
+            for row in csv.DictReader(f)
+        }
+
+class GeocodeStore:
+    """
+    Résout des noms de gares en coordonnées, par lots : table livrée, puis
+    fichier local (`path`), puis cache partagé, puis Nominatim (1 requête par
+    seconde) pour les inconnues. Le fichier local garde les résultats quand
+    le cache partagé est en mémoire ou indisponible.
+    Les coordonnées sont conservées `ttl` secondes ; les échecs de géocodage
+    sont aussi mémorisés pour ne pas être retentés avant `miss_ttl` secondes.
+    """
+    def __init__(self, cache: Optional[CacheBackend], stations_path: str, user_agent: str,
+                 min_delay: float = 1.0, ttl: int = 30 * 24 * 3600, miss_ttl: int = 7 * 24 * 3600,
+                 path: Optional[str] = None):
+        self.ttl = ttl
+        self.miss_ttl = miss_ttl
+        local = None
+        if path:
+            try:
+                local = SQLiteCache(path)
+            except Exception as e:
+                logger.warning("Fichier des géocodages %s inaccessible : %s", path, e)
+        # Couches de cache, de la plus proche à la plus lointaine
+        self._layers = [layer for layer in (local, cache) if layer is not None]
+        self._stations = load_station_table(stations_path)
+        self._geocode = RateLimiter(
+            Nominatim(user_agent=user_agent).geocode,
+            min_delay_seconds=min_delay,
+            swallow_exceptions=False
+        )
+        # Nominatim impose des requêtes séquentielles
+        self._nominatim_lock = threading.Lock()
+    
+    def _read_cache(self, names) -> Dict[str, Optional[Coordinates]]:
+        found: Dict[str, Optional[Coordinates]] = {}
+        missing = set(names)
+        for i, layer in enumerate(self._layers):
+            if not missing:
+                break
+            payloads = layer.get_many(f"geocode:{name}" for name in missing)
+            results = {
+                key[len("geocode:"):]: _COORDINATES.unpack(payload) if payload else None
+                for key, payload in payloads.items()
+            }
+            # Recopiés dans les couches plus proches, pour les lectures suivantes
+            self._write_cache(results, self._layers[:i])
+            found.update(results)
+            missing -= set(results)
+        return found
+    
+    def _write_cache(self, results: Dict[str, Optional[Coordinates]], layers=None):
+        for layer in self._layers if layers is None else layers:
+            layer.set_many({f"geocode:{name}": _COORDINATES.pack(*coords)
+                            for name, coords in results.items() if coords}, self.ttl)
+            layer.set_many({f"geocode:{name}": b''
+                            for name, coords in results.items() if not coords}, self.miss_ttl)
+    
+    def _query_nominatim(self, names) -> Dict[str, Optional[Coordinates]]:
+        results = {}
+        with self._nominatim_lock:
+            for name in names:
+                try:
+                    location = self._geocode(geocoding_query(name))
+                except GeopyError:
+                    # Erreur passagère : ni résultat ni échec mémorisé
+                    logger.warning("Géocodage impossible pour %s", name)
+                    continue
+                results[name] = (location.latitude, location.longitude) if location else None
+        return results
+    
+    def lookup(self, cities: Iterable[str]) -> Dict[str, Coordinates]:
+        """
+        Coordonnées d'un lot de gares, indexées par leur nom d'origine.
+        Les gares introuvables sont absentes du résultat.
+        """
+        with span('geocode'):
+            keys = {city: normalize_station(city) for city in cities}
+            found: Dict[str, Optional[Coordinates]] = {
+                key: self._stations[key] for key in set(keys.values()) if key in self._stations
+            }
+            missing = set(keys.values()) - set(found)
+            found.update(self._read_cache(missing))
+            missing -= set(found)
+            registry.inc('tgvmax_cache_requests_total', len(found), cache='geocode', result='hit')
+            if missing:
+                registry.inc('tgvmax_cache_requests_total', len(missing), cache='geocode', result='miss')
+                fetched = self._query_nominatim(sorted(missing))
+                self._write_cache(fetched)
+                found.update(fetched)
+            return {city: found[key] for city, key in keys.items() if found.get(key)}
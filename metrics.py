@@ -0,0 +1,218 @@
+"""
+Instrumentation des chemins critiques : compteurs et histogrammes au format
+texte Prometheus, servis sur /metrics par un thread dédié, et traces par
+recherche pour le panneau de diagnostic.
+"""
+import bisect
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter
+from typing import Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Bornes des histogrammes de durée, en secondes
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Durées récentes conservées par série pour les quantiles du panneau
+RECENT_SAMPLES = 1024
+
+Labels = Tuple[Tuple[str, str], ...]
+
+def _labels(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def _format_labels(labels: Labels, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in pairs) + '}'
+
+class _Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+    
+    def observe(self, value: float):
+        index = bisect.bisect_left(BUCKETS, value)
+        if index < len(BUCKETS):
+            self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+
+class Registry:
+    """
+    Compteurs et histogrammes étiquetés, partagés par tout le processus.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, _Histogram]] = {}
+        self._help: Dict[str, str] = {}
+    
+    def describe(self, name: str, help_text: str):
+        self._help[name] = help_text
+    
+    def inc(self, name: str, amount: float = 1, **labels):
+        key = _labels(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+    
+    def observe(self, name: str, seconds: float, **labels):
+        key = _labels(labels)
+        with self._lock:
+            self._histograms.setdefault(name, {}).setdefault(key, _Histogram()).observe(seconds)
+    
+    def counter_value(self, name: str, **labels) -> float:
+        """Somme des séries du compteur dont les étiquettes contiennent `labels`."""
+        wanted = set(_labels(labels))
+        with self._lock:
+            return sum(value for key, value in self._counters.get(name, {}).items() if wanted <= set(key))
+    
+    def quantile(self, name: str, q: float, **labels) -> Optional[float]:
+        """Quantile des durées récentes des séries correspondant à `labels`."""
+        wanted = set(_labels(labels))
+        with self._lock:
+            samples = sorted(
+                value
+                for key, histogram in self._histograms.get(name, {}).items() if wanted <= set(key)
+                for value in histogram.recent
+            )
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+    
+    def render(self) -> str:
+        """Exposition au format texte Prometheus."""
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} counter")
+                for key, value in sorted(series.items()):
+                    lines.append(f"{name}{_format_labels(key)} {value:g}")
+            for name, series in sorted(self._histograms.items()):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, histogram in sorted(series.items()):
+                    cumulative = 0
+                    for bound, count in zip(BUCKETS, histogram.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(key, (('le', f'{bound:g}'),))} {cumulative}")
+                    lines.append(f"{name}_bucket{_format_labels(key, (('le', '+Inf'),))} {histogram.count}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {histogram.sum:.6f}")
+                    lines.append(f"{name}_count{_format_labels(key)} {histogram.count}")
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+registry.describe('tgvmax_span_seconds', "Durée des étapes instrumentées")
+registry.describe('tgvmax_search_seconds', "Durée des recherches, caches compris")
+registry.describe('tgvmax_first_result_seconds', "Délai avant l'affichage des premiers résultats")
+registry.describe('tgvmax_cache_requests_total', "Accès aux caches, par résultat (hit, miss)")
+registry.describe('tgvmax_upstream_requests_total', "Requêtes HTTP envoyées à l'API SNCF")
+
+class Trace:
+    """
+    Étapes d'une recherche, pour le panneau de diagnostic. Une trace est
+    attachée au thread du script et transmise aux threads de récupération.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.spans: List[Tuple[str, Dict[str, str], float]] = []
+        # Requêtes à l'API envoyées pour cette exécution seulement
+        self.upstream_calls = 0
+    
+    def add(self, name: str, labels: Dict[str, str], seconds: float):
+        with self._lock:
+            self.spans.append((name, labels, seconds))
+    
+    def count_upstream_call(self):
+        with self._lock:
+            self.upstream_calls += 1
+    
+    def summary(self) -> List[Dict]:
+        """Étapes regroupées par nom et étiquettes : nombre d'appels et durée totale."""
+        grouped: Dict[Tuple[str, Labels], List[float]] = {}
+        with self._lock:
+            for name, labels, seconds in self.spans:
+                grouped.setdefault((name, _labels(labels)), []).append(seconds)
+        return [
+            {
+                'étape': name + _format_labels(key),
+                'appels': len(durations),
+                'total (ms)': round(sum(durations) * 1000, 1)
+            }
+            for (name, key), durations in grouped.items()
+        ]
+
+_local = threading.local()
+
+def current_trace() -> Optional[Trace]:
+    return getattr(_local, 'trace', None)
+
+def attach_trace(trace: Optional[Trace]):
+    """Rattache le thread courant à une trace (None pour l'en détacher)."""
+    _local.trace = trace
+
+@contextmanager
+def span(name: str, **labels) -> Iterator[Dict[str, str]]:
+    """
+    Mesure la durée d'un bloc dans tgvmax_span_seconds{span=name, ...}.
+    Les étiquettes peuvent être complétées dans le bloc (ex. cache="hit").
+    """
+    labels = dict(labels)
+    start = perf_counter()
+    try:
+        yield labels
+    finally:
+        seconds = perf_counter() - start
+        registry.observe('tgvmax_span_seconds', seconds, span=name, **labels)
+        trace = current_trace()
+        if trace is not None:
+            trace.add(name, labels, seconds)
+
+def count_cache(cache: str, hit: bool):
+    registry.inc('tgvmax_cache_requests_total', cache=cache, result='hit' if hit else 'miss')
+
+def cache_hit_ratio(cache: str) -> Optional[float]:
+    hits = registry.counter_value('tgvmax_cache_requests_total', cache=cache, result='hit')
+    total = registry.counter_value('tgvmax_cache_requests_total', cache=cache)
+    return hits / total if total else None
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        payload = registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+    
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(host: str, port: int) -> Optional[ThreadingHTTPServer]:
+    """
+    Sert /metrics dans un thread d'arrière-plan. Renvoie None si le port
+    est indisponible (autre processus de l'application, par exemple).
+    """
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        logger.warning("Serveur de métriques indisponible sur %s:%d : %s", host, port, e)
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    logger.info("Métriques servies sur http://%s:%d/metrics", host, port)
+    return server
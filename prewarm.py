@@ -0,0 +1,226 @@
+"""
+Préchauffage du cache des journées : un thread de fond recharge, peu avant
+leur expiration, les journées de la fenêtre de réservation recherchées depuis
+les origines populaires. Le premier utilisateur après un déploiement ou une
+expiration du cache ne paie plus la récupération à froid.
+Les origines populaires et le budget de requêtes sont déduits du journal des
+recherches ; la journée étant l'unité du cache (les origines sont filtrées
+localement), ce sont des journées qui sont préchauffées.
+"""
+import json
+import logging
+import math
+import os
+import threading
+from collections import Counter, deque
+from datetime import date, datetime, timedelta
+from time import monotonic
+from typing import Callable, Deque, Dict, Iterable, List, NamedTuple, Optional, Tuple
+from config import (
+    CACHE_TTL, PREWARM_ORIGINS, PREWARM_MAX_ORIGINS, PREWARM_MIN_QUERIES,
+    PREWARM_REFRESH_AHEAD, PREWARM_INTERVAL, PREWARM_MAX_REQUESTS_PER_HOUR
+)
+from sncf_api import get_upstream_call_count
+from search import DayCache
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+registry.describe('tgvmax_prewarm_days_total', "Journées rechargées par le préchauffage, par résultat")
+
+class QueryLog:
+    """
+    Journal des recherches, une ligne JSON par recherche : instant, mode,
+    origine et journées parcourues. Conservé sur disque pour survivre aux
+    redéploiements ; les recherches de plus de `max_age_days` jours sont
+    purgées à la lecture.
+    """
+    def __init__(self, path: str, max_age_days: int = 7):
+        self.path = path
+        self.max_age = timedelta(days=max_age_days)
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    
+    def record(self, mode: str, origin: Optional[str], days: Iterable[date], at: Optional[datetime] = None):
+        entry = {
+            'at': (at or datetime.now()).isoformat(timespec='seconds'),
+            'mode': mode,
+            'origin': (origin or '').strip().upper(),
+            'days': [day.isoformat() for day in days]
+        }
+        try:
+            with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry) + '\n')
+        except OSError as e:
+            logger.warning("Recherche non journalisée : %s", e)
+    
+    def entries(self, now: Optional[datetime] = None) -> List[Dict]:
+        """Recherches récentes, des plus anciennes aux plus récentes."""
+        since = ((now or datetime.now()) - self.max_age).isoformat(timespec='seconds')
+        with self._lock:
+            try:
+                with open(self.path, encoding='utf-8') as f:
+                    lines = f.readlines()
+            except FileNotFoundError:
+                return []
+            entries = []
+            for line in lines:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    continue
+            recent = [entry for entry in entries if entry.get('at', '') >= since]
+            if len(recent) < len(lines):
+                self._rewrite(recent)
+        return recent
+    
+    def _rewrite(self, entries: List[Dict]):
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.writelines(json.dumps(entry) + '\n' for entry in entries)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning("Journal des recherches non purgé : %s", e)
+
+class PrewarmPlan(NamedTuple):
+    origins: List[str]  # Origines populaires, les plus recherchées d'abord
+    days: List[str]  # Journées demandées de la fenêtre, les plus demandées d'abord
+    budget: int  # Requêtes à l'API autorisées par heure
+
+def plan_prewarm(entries: List[Dict], first_day: date, last_day: date,
+                 pinned_origins: Iterable[str] = PREWARM_ORIGINS,
+                 max_origins: int = PREWARM_MAX_ORIGINS, min_queries: int = PREWARM_MIN_QUERIES,
+                 reload_every: float = CACHE_TTL - PREWARM_REFRESH_AHEAD,
+                 requests_per_day: float = 1.0,
+                 max_budget: int = PREWARM_MAX_REQUESTS_PER_HOUR) -> PrewarmPlan:
+    """
+    Plan de préchauffage de la fenêtre `first_day` (aujourd'hui)..`last_day`,
+    tiré du journal des recherches (voir QueryLog).
+    Les origines populaires sont celles de `pinned_origins` puis les
+    `max_origins` plus recherchées (au moins `min_queries` fois). La demande
+    d'une journée est le nombre de recherches depuis ces origines portant sur
+    le même écart en jours (« demain », « dans 3 jours »...).
+    Seules les journées demandées sont retenues, ou toute la fenêtre sans
+    historique ; le budget suffit à les recharger toutes les `reload_every`
+    secondes, dans la limite de `max_budget`.
+    """
+    counts = Counter(entry['origin'] for entry in entries if entry.get('origin'))
+    origins = list(dict.fromkeys(
+        [origin.strip().upper() for origin in pinned_origins]
+        + [origin for origin, n in counts.most_common(max_origins) if n >= min_queries]
+    ))
+    
+    # Une recherche sans origine porte sur toutes les origines
+    demand: Counter = Counter()
+    for entry in entries:
+        if entry.get('origin') and entry['origin'] not in origins:
+            continue
+        searched_on = date.fromisoformat(entry['at'][:10])
+        for day in entry['days']:
+            demand[(date.fromisoformat(day) - searched_on).days] += 1
+    
+    window = [first_day + timedelta(days=i) for i in range((last_day - first_day).days + 1)]
+    if demand:
+        # Les journées que personne ne cherche ne consomment pas de budget
+        days = sorted((day for day in window if demand[(day - first_day).days]),
+                      key=lambda day: -demand[(day - first_day).days])
+    else:
+        days = window if origins else []
+    budget = min(max_budget, math.ceil(len(days) * requests_per_day * 3600 / max(reload_every, 1)))
+    return PrewarmPlan(origins, [day.isoformat() for day in days], budget)
+
+class Prewarmer:
+    """
+    Thread de fond gardant chaudes les journées de `days` : toutes les
+    `interval` secondes, les journées du plan qui expirent dans moins de
+    `refresh_ahead` secondes sont rechargées, par demande décroissante, tant
+    que les requêtes à l'API de l'heure écoulée restent dans le budget.
+    `skip` écarte les journées servies autrement (copie locale).
+    """
+    def __init__(self, days: DayCache, query_log: QueryLog,
+                 window: Callable[[], Tuple[date, date]],
+                 skip: Optional[Callable[[str], bool]] = None,
+                 refresh_ahead: float = PREWARM_REFRESH_AHEAD, interval: float = PREWARM_INTERVAL):
+        self.days = days
+        self.query_log = query_log
+        self.window = window
+        self.skip = skip
+        self.refresh_ahead = refresh_ahead
+        self.interval = interval
+        # Coût moyen du rechargement d'une journée, mesuré au fil des passages
+        self.requests_per_day = 1.0
+        self.plan: Optional[PrewarmPlan] = None
+        self._spent: Deque[Tuple[float, int]] = deque()
+        self._spent_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def spent_last_hour(self) -> int:
+        """Requêtes à l'API envoyées par le préchauffage depuis une heure."""
+        with self._spent_lock:
+            while self._spent and monotonic() - self._spent[0][0] >= 3600:
+                self._spent.popleft()
+            return sum(calls for _, calls in self._spent)
+    
+    def run_once(self) -> List[str]:
+        """Un passage du préchauffage ; renvoie les journées rechargées."""
+        first_day, last_day = self.window()
+        self.plan = plan = plan_prewarm(self.query_log.entries(), first_day, last_day,
+                                        reload_every=self.days.ttl - self.refresh_ahead,
+                                        requests_per_day=self.requests_per_day)
+        spent = self.spent_last_hour()
+        refreshed = []
+        for day in plan.days:
+            if self.skip is not None and self.skip(day):
+                continue
+            remaining = self.days.expires_in(day)
+            if remaining is not None and remaining > self.refresh_ahead:
+                continue
+            if self.days.adopt_shared(day, self.refresh_ahead):
+                # Déjà rechargée par un autre processus : rien à demander à l'API
+                registry.inc('tgvmax_prewarm_days_total', result='shared')
+                continue
+            if spent + self.requests_per_day > plan.budget:
+                registry.inc('tgvmax_prewarm_days_total', result='over_budget')
+                break
+            
+            # Compte aussi les requêtes des utilisateurs pendant le rechargement : le budget reste majoré
+            before = get_upstream_call_count()
+            try:
+                self.days.refresh(day)
+            except Exception as e:
+                # L'API est en difficulté : on attend le prochain passage
+                logger.warning("Préchauffage du %s interrompu : %s", day, e)
+                registry.inc('tgvmax_prewarm_days_total', result='error')
+                break
+            finally:
+                calls = get_upstream_call_count() - before
+                with self._spent_lock:
+                    self._spent.append((monotonic(), calls))
+                spent += calls
+            self.requests_per_day = 0.8 * self.requests_per_day + 0.2 * max(calls, 1)
+            registry.inc('tgvmax_prewarm_days_total', result='refreshed')
+            refreshed.append(day)
+        return refreshed
+    
+    def start(self, delay: float = 0):
+        """Lance les passages périodiques dans un thread de fond, après `delay` secondes."""
+        if self._thread is not None:
+            return
+        
+        def run():
+            self._stop.wait(delay)
+            while not self._stop.is_set():
+                try:
+                    self.run_once()
+                except Exception:
+                    logger.exception("Échec du préchauffage du cache des journées")
+                self._stop.wait(self.interval)
+        
+        self._thread = threading.Thread(target=run, name="tgvmax-prewarm", daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        """Arrête le thread de préchauffage."""
+        self._stop.set()
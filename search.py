@@ -0,0 +1,433 @@
+"""
+Cœur de la recherche de trajets TGV Max, utilisable hors de l'interface :
+sources de trains par journée, recherche selon le mode et empreinte canonique
+des recherches. Ce module ne dépend pas de Streamlit.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, time, timedelta
+from enum import Enum
+from time import monotonic
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
+import pandas as pd
+from config import (
+    CACHE_TTL, MAX_CONCURRENT_REQUESTS, MAX_DATE, DEFAULT_RANGE_DAYS, DEFAULT_MIN_STAY,
+    DEFAULT_MAX_STAY, SNAPSHOT_PATH, SNAPSHOT_REFRESH_INTERVAL, MAX_CHANGES, MIN_TRANSFER_MINUTES, MAX_TRANSFER_MINUTES
+)
+from sncf_api import UpstreamError, fetch_day_records
+from snapshot import TrainSnapshot, decode_records, encode_records
+from cache_backends import CacheBackend, open_shared_cache, read_through
+from day_index import DayIndex
+from connections import scan_connections
+from trips import concat_trips, filter_trains_by_time, match_round_trips
+from singleflight import SingleFlight
+from metrics import attach_trace, count_cache, current_trace, span
+
+logger = logging.getLogger(__name__)
+
+class SearchMode(str, Enum):
+    SINGLE = "Aller simple"
+    ROUND_TRIP = "Aller-retour"
+    DATE_RANGE = "Plage de dates"
+    FLEXIBLE_ROUND_TRIP = "Aller-retour flexible"
+    CONNECTIONS = "Avec correspondances"
+    
+    @property
+    def is_round_trip(self) -> bool:
+        return self in (SearchMode.ROUND_TRIP, SearchMode.FLEXIBLE_ROUND_TRIP)
+
+def day_cache_key(day: str) -> str:
+    return f"day:{day}"
+
+def load_day_records(cache: Optional[CacheBackend], day: str,
+                     ttl: int = CACHE_TTL) -> Tuple[Union[List[Dict], pd.DataFrame], float]:
+    """
+    Trains d'une journée depuis le cache partagé, sinon depuis l'API ;
+    les réponses de l'API y sont conservées `ttl` secondes (Arrow IPC).
+    Renvoie aussi la durée de vie restante de l'entrée partagée, en secondes.
+    """
+    return read_through(cache, day_cache_key(day), ttl,
+                        lambda: fetch_day_records(day), encode_records, decode_records)
+
+class DayCache:
+    """
+    Index des journées en mémoire, alimenté par le cache partagé (`cache`)
+    puis par l'API. Une journée expire avec son entrée partagée, au plus
+    `ttl` secondes après son chargement. Les chargements identiques
+    simultanés sont regroupés ; `refresh` remplace une entrée encore valide
+    sans l'invalider, pour la rafraîchir avant son expiration.
+    """
+    def __init__(self, ttl: int = CACHE_TTL, cache: Optional[CacheBackend] = None):
+        self.ttl = ttl
+        self.cache = cache
+        self._lock = threading.Lock()
+        # Journée -> (expiration en temps monotone, index)
+        self._days: Dict[str, Tuple[float, DayIndex]] = {}
+        self._flight = SingleFlight()
+    
+    def get(self, day: str) -> Tuple[DayIndex, bool]:
+        """Index de la journée et indicateur de présence dans le cache."""
+        with self._lock:
+            cached = self._days.get(day)
+        if cached is not None and monotonic() < cached[0]:
+            return cached[1], True
+        return self._flight.do(day, self._load, day, False), False
+    
+    def refresh(self, day: str) -> DayIndex:
+        """Recharge la journée depuis l'API et met à jour le cache partagé."""
+        return self._flight.do(day, self._load, day, True)
+    
+    def adopt_shared(self, day: str, min_remaining: float) -> bool:
+        """
+        Reprend l'entrée partagée de la journée si elle expire dans plus de
+        `min_remaining` secondes (rechargée par un autre processus), sans
+        appeler l'API. Renvoie vrai si elle a été reprise.
+        """
+        if self.cache is None:
+            return False
+        entry = self.cache.get_with_ttl(day_cache_key(day))
+        if entry is None or entry[1] <= min_remaining:
+            return False
+        self._store(day, DayIndex(decode_records(entry[0])), min(self.ttl, entry[1]))
+        return True
+    
+    def expires_in(self, day: str) -> Optional[float]:
+        """Secondes avant l'expiration de la journée, None si elle est absente ou expirée."""
+        with self._lock:
+            cached = self._days.get(day)
+        if cached is None:
+            return None
+        remaining = cached[0] - monotonic()
+        return remaining if remaining > 0 else None
+    
+    def clear(self):
+        with self._lock:
+            self._days.clear()
+    
+    def stats(self) -> Dict[str, int]:
+        """Chargements exécutés et chargements identiques regroupés."""
+        return self._flight.stats()
+    
+    def _load(self, day: str, fresh: bool) -> DayIndex:
+        if fresh:
+            records = fetch_day_records(day)
+            if self.cache is not None:
+                self.cache.set(day_cache_key(day), encode_records(records), self.ttl)
+            remaining = self.ttl
+        else:
+            records, remaining = load_day_records(self.cache, day, self.ttl)
+            remaining = min(self.ttl, remaining)
+        index = DayIndex(records)
+        self._store(day, index, remaining)
+        return index
+    
+    def _store(self, day: str, index: DayIndex, remaining: float):
+        now = monotonic()
+        with self._lock:
+            # Les journées expirées sont retirées à chaque chargement
+            for expired in [d for d, (expires, _) in self._days.items() if expires <= now]:
+                del self._days[expired]
+            self._days[day] = (now + remaining, index)
+
+class TripSource:
+    """
+    Accès aux trains par journée. Les sous-classes fournissent `day_index`.
+    À créer dans le thread de l'appelant, dont la trace est transmise aux
+    threads de récupération.
+    """
+    def __init__(self, max_workers: int = MAX_CONCURRENT_REQUESTS):
+        self.max_workers = max_workers
+        self._trace = current_trace()
+    
+    def day_index(self, day: str) -> DayIndex:
+        raise NotImplementedError
+    
+    def init_worker(self):
+        """Appelé au démarrage de chaque thread de récupération."""
+        attach_trace(self._trace)
+    
+    def trips(self, day: str, origin: str = None, destination: str = None) -> pd.DataFrame:
+        """
+        Table typée des trains d'une journée (voir trips.normalize_trains),
+        filtrée par préfixes. La table ne doit pas être modifiée.
+        """
+        return self.day_index(day).query_frame(origin, destination)
+    
+    def iter_trips_for_dates(self, dates: List[date], origin: str = None,
+                             destination: str = None) -> Iterator[Tuple[int, pd.DataFrame]]:
+        """
+        Récupère en parallèle les trains de plusieurs dates et les renvoie au
+        fil des réponses : (position de la date dans `dates`, table typée).
+        Au plus `max_workers` requêtes sont en cours simultanément, les dates
+        étant demandées dans l'ordre ; fermer l'itérateur annule celles qui
+        n'ont pas commencé.
+        """
+        if not dates:
+            return
+        executor = ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(dates))),
+                                      initializer=self.init_worker)
+        try:
+            futures = {
+                executor.submit(self.trips, day.strftime("%Y-%m-%d"), origin, destination): i
+                for i, day in enumerate(dates)
+            }
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    def trips_for_dates(self, dates: List[date], origin: str = None, destination: str = None,
+                        on_progress: Optional[Callable[[int, int], None]] = None) -> pd.DataFrame:
+        """
+        Récupère en parallèle les trains de plusieurs dates (voir
+        iter_trips_for_dates) ; `on_progress` est appelé (nb terminées, total)
+        à chaque date reçue. Les trajets sont renvoyés dans une table typée,
+        dans l'ordre des dates.
+        """
+        results = [None] * len(dates)
+        for done, (i, trips) in enumerate(self.iter_trips_for_dates(dates, origin, destination), start=1):
+            results[i] = trips
+            if on_progress:
+                on_progress(done, len(dates))
+        return concat_trips(results)
+
+class LocalTripSource(TripSource):
+    """
+    Source autonome pour les scripts et le serveur HTTP : copie locale si
+    elle couvre la date, sinon cache partagé (`cache`) puis API, avec un cache
+    mémoire expirant après `ttl` secondes et des requêtes identiques regroupées.
+    `days` remplace ce cache mémoire par un cache existant (application).
+    """
+    def __init__(self, snapshot: Optional[TrainSnapshot] = None, ttl: int = CACHE_TTL,
+                 max_workers: int = MAX_CONCURRENT_REQUESTS, cache: Optional[CacheBackend] = None,
+                 days: Optional[DayCache] = None):
+        super().__init__(max_workers)
+        self.snapshot = snapshot
+        self.days = days if days is not None else DayCache(ttl, cache)
+    
+    @classmethod
+    def from_config(cls, use_snapshot: bool = True,
+                    refresh_interval: Optional[int] = None) -> 'LocalTripSource':
+        """
+        Source par défaut, partageant le cache de l'application. La copie
+        locale est relue si elle existe ; plus vieille que
+        SNAPSHOT_REFRESH_INTERVAL, elle est d'abord rafraîchie, ou ignorée si
+        l'API ne répond pas. Avec `refresh_interval`, elle est tenue à jour
+        par un thread de fond, à arrêter par `snapshot.stop()`.
+        """
+        snapshot = None
+        if use_snapshot and refresh_interval is not None:
+            snapshot = TrainSnapshot(SNAPSHOT_PATH)
+            snapshot.load()
+            snapshot.start(refresh_interval)
+        elif use_snapshot and os.path.exists(SNAPSHOT_PATH):
+            snapshot = TrainSnapshot(SNAPSHOT_PATH)
+            snapshot.load()
+            if snapshot.age() > SNAPSHOT_REFRESH_INTERVAL:
+                try:
+                    snapshot.refresh()
+                except UpstreamError as e:
+                    logger.warning("Copie locale périmée ignorée : %s", e)
+                    snapshot = None
+        return cls(snapshot, cache=open_shared_cache())
+    
+    def day_index(self, day: str) -> DayIndex:
+        with span('day_index') as labels:
+            if self.snapshot is not None:
+                index = self.snapshot.day_index(day)
+                if index is not None:
+                    labels['cache'] = 'snapshot'
+                    count_cache('day_index', True)
+                    return index
+            
+            index, hit = self.days.get(day)
+            labels['cache'] = 'hit' if hit else 'miss'
+            count_cache('day_index', hit)
+            return index
+
+def find_trips(source: TripSource,
+               mode: SearchMode,
+               depart_date: date,
+               return_date: date = None,
+               origin_city: str = None,
+               destination_city: str = None,
+               depart_start: time = None,
+               depart_end: time = None,
+               return_start: time = None,
+               return_end: time = None,
+               date_range_days: int = DEFAULT_RANGE_DAYS,
+               min_stay: int = DEFAULT_MIN_STAY,
+               max_stay: int = DEFAULT_MAX_STAY,
+               max_changes: int = MAX_CHANGES,
+               min_transfer: int = MIN_TRANSFER_MINUTES,
+               max_transfer: int = MAX_TRANSFER_MINUTES,
+               on_progress: Optional[Callable[[int, int], None]] = None) -> pd.DataFrame:
+    """
+    Trouve les trajets disponibles en TGV Max selon le mode choisi.
+    `on_progress` suit les récupérations sur plusieurs jours ; les erreurs
+    de l'API lèvent UpstreamError.
+    """
+    def phase(name: str):
+        return span('find_trips', phase=name, mode=mode.name)
+    
+    if mode == SearchMode.DATE_RANGE:
+        with phase('fetch'):
+            df = source.trips_for_dates(
+                [depart_date + timedelta(days=i) for i in range(date_range_days)],
+                origin=origin_city,
+                destination=destination_city,
+                on_progress=on_progress
+            )
+        if not df.empty and depart_start and depart_end:
+            with phase('filter'):
+                return filter_trains_by_time(df, depart_start, depart_end, is_round_trip=False)
+        return df
+    
+    elif mode == SearchMode.FLEXIBLE_ROUND_TRIP:
+        outbound_dates = [depart_date + timedelta(days=i) for i in range(date_range_days)]
+        return_dates = {
+            day + timedelta(days=stay)
+            for day in outbound_dates for stay in range(min_stay, max_stay + 1)
+        }
+        # Chaque jour n'est récupéré qu'une fois, qu'il serve à l'aller, au retour ou aux deux
+        days = sorted(set(outbound_dates) | {day for day in return_dates if day <= MAX_DATE})
+        with phase('fetch'):
+            trips = source.trips_for_dates(days, on_progress=on_progress)
+        
+        with phase('join'):
+            outbound_trips = trips[
+                trips['date'].isin(pd.to_datetime(outbound_dates))
+                & trips['origine'].str.upper().str.startswith((origin_city or '').upper())
+            ]
+            df = match_round_trips(
+                outbound_trips, trips,
+                depart_start, depart_end, return_start, return_end,
+                stay_days=range(min_stay, max_stay + 1)
+            )
+            if not df.empty:
+                df = df.sort_values('Duree_Totale_Min', kind='stable')
+        return df
+    
+    elif mode == SearchMode.CONNECTIONS:
+        # Le lendemain permet les correspondances après minuit
+        days = [day for day in (depart_date, depart_date + timedelta(days=1)) if day <= MAX_DATE]
+        with phase('fetch'):
+            trips = source.trips_for_dates(days, on_progress=on_progress)
+        with phase('scan'):
+            return scan_connections(
+                trips, origin_city, destination_city, depart_date, depart_start, depart_end,
+                min_transfer, max_transfer, max_changes
+            )
+    
+    elif mode == SearchMode.SINGLE:
+        with phase('fetch'):
+            df = source.trips(depart_date.strftime("%Y-%m-%d"), origin=origin_city)
+        if not df.empty and depart_start and depart_end:
+            with phase('filter'):
+                return filter_trains_by_time(df, depart_start, depart_end, is_round_trip=False)
+        return df
+    
+    else:  # mode == SearchMode.ROUND_TRIP
+        with phase('fetch'):
+            outbound_trips = source.trips(depart_date.strftime("%Y-%m-%d"), origin=origin_city)
+            inbound_trips = source.trips(return_date.strftime("%Y-%m-%d"))
+        
+        with phase('join'):
+            df = match_round_trips(
+                outbound_trips, inbound_trips,
+                depart_start, depart_end, return_start, return_end
+            )
+            if not df.empty:
+                df = df.sort_values('Aller_Depart_Min', kind='stable')
+        return df
+
+def stream_date_range(source: TripSource,
+                      depart_date: date,
+                      date_range_days: int = DEFAULT_RANGE_DAYS,
+                      origin_city: str = None,
+                      destination_city: str = None,
+                      depart_start: time = None,
+                      depart_end: time = None) -> Iterator[Tuple[date, pd.DataFrame]]:
+    """
+    Mode plage de dates au fil des réponses : (date, trains du jour filtrés
+    par plage horaire), dans l'ordre d'arrivée. Concaténées dans l'ordre des
+    dates, ces tables donnent le résultat de find_trips. Fermer l'itérateur
+    arrête la recherche.
+    """
+    dates = [depart_date + timedelta(days=i) for i in range(date_range_days)]
+    for i, trips in source.iter_trips_for_dates(dates, origin_city, destination_city):
+        if not trips.empty and depart_start and depart_end:
+            trips = filter_trains_by_time(trips, depart_start, depart_end, is_round_trip=False)
+        yield dates[i], trips
+
+def search_days(search: Dict) -> int:
+    """Nombre de journées parcourues par une recherche."""
+    if search['mode'] in (SearchMode.DATE_RANGE, SearchMode.FLEXIBLE_ROUND_TRIP):
+        return search.get('date_range_days', DEFAULT_RANGE_DAYS)
+    return 2 if search['mode'] in (SearchMode.ROUND_TRIP, SearchMode.CONNECTIONS) else 1
+
+def search_dates(search: Dict) -> List[date]:
+    """Journées dont les trains sont récupérés par une recherche."""
+    mode, start = search['mode'], search['depart_date']
+    if mode == SearchMode.DATE_RANGE:
+        days = [start + timedelta(days=i) for i in range(search.get('date_range_days', DEFAULT_RANGE_DAYS))]
+    elif mode == SearchMode.FLEXIBLE_ROUND_TRIP:
+        last = search.get('date_range_days', DEFAULT_RANGE_DAYS) - 1 + search.get('max_stay', DEFAULT_MAX_STAY)
+        days = [start + timedelta(days=i) for i in range(last + 1)]
+    elif mode == SearchMode.ROUND_TRIP:
+        days = [start, search['return_date']]
+    elif mode == SearchMode.CONNECTIONS:
+        days = [start, start + timedelta(days=1)]
+    else:
+        days = [start]
+    return [day for day in days if day <= MAX_DATE]
+
+def normalize_city(name: Optional[str]) -> Optional[str]:
+    """Préfixe de gare comparable : sans espaces superflus ni casse, None si vide."""
+    return (name or '').strip().upper() or None
+
+def normalize_search(search: Dict) -> Dict:
+    """
+    Recherche aux villes normalisées (voir normalize_city), à passer telle
+    quelle à search_key et à find_trips : même empreinte, mêmes résultats.
+    """
+    return {**search,
+            'origin_city': normalize_city(search.get('origin_city')),
+            'destination_city': normalize_city(search.get('destination_city'))}
+
+def search_key(search: Dict) -> str:
+    """
+    Empreinte canonique d'une recherche : seuls les paramètres utilisés par
+    le mode comptent, et les villes sont comparées sans casse ni espaces.
+    """
+    def clock(value):
+        return value.strftime('%H:%M') if value else None
+    
+    mode = search['mode']
+    canonical = {
+        'mode': mode.value,
+        'depart_date': search['depart_date'].isoformat(),
+        'origin_city': normalize_city(search.get('origin_city')),
+        'depart': [clock(search.get('depart_start')), clock(search.get('depart_end'))]
+    }
+    if mode.is_round_trip:
+        canonical['return'] = [clock(search.get('return_start')), clock(search.get('return_end'))]
+    if mode == SearchMode.ROUND_TRIP:
+        canonical['return_date'] = search['return_date'].isoformat()
+    if mode in (SearchMode.DATE_RANGE, SearchMode.CONNECTIONS):
+        canonical['destination_city'] = normalize_city(search.get('destination_city'))
+    if mode == SearchMode.CONNECTIONS:
+        canonical['connections'] = [
+            search.get('max_changes', MAX_CHANGES),
+            search.get('min_transfer', MIN_TRANSFER_MINUTES),
+            search.get('max_transfer', MAX_TRANSFER_MINUTES)
+        ]
+    if mode in (SearchMode.DATE_RANGE, SearchMode.FLEXIBLE_ROUND_TRIP):
+        canonical['date_range_days'] = search['date_range_days']
+    if mode == SearchMode.FLEXIBLE_ROUND_TRIP:
+        canonical['stay'] = [search['min_stay'], search['max_stay']]
+    return hashlib.sha256(json.dumps(canonical, sort_keys=True).encode()).hexdigest()
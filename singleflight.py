@@ -0,0 +1,48 @@
+"""
+Regroupement des appels concurrents identiques (« single-flight ») :
+tant qu'un appel est en cours pour une clé, les appelants suivants
+attendent son résultat au lieu de relancer le même travail.
+"""
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable
+
+class SingleFlight:
+    """
+    Exécute au plus un appel à la fois par clé et partage son résultat
+    (ou son exception) avec tous les appelants arrivés pendant l'appel.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, Future] = {}
+        self.executed = 0
+        self.coalesced = 0
+    
+    def do(self, key: Hashable, func: Callable[..., Any], *args, **kwargs) -> Any:
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+                self.executed += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result()
+        
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+    
+    def stats(self) -> Dict[str, int]:
+        """Nombre d'appels exécutés et d'appels regroupés depuis le démarrage."""
+        with self._lock:
+            return {'executed': self.executed, 'coalesced': self.coalesced}
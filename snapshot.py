@@ -0,0 +1,227 @@
+"""
+Copie locale du jeu de données tgvmax.
+Le jeu complet est téléchargé une fois, stocké dans un fichier Arrow
+(relu en mémoire mappée), puis seuls les jours modifiés sont rafraîchis
+en arrière-plan.
+"""
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+import pandas as pd
+import pyarrow as pa
+from config import SNAPSHOT_FULL_RELOAD_INTERVAL
+from day_index import DayIndex
+from sncf_api import TRAIN_FIELDS, export_records, fetch_day_records, fetch_page
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = pa.schema([(field, pa.string()) for field in TRAIN_FIELDS])
+SORT_KEYS = [('date', 'ascending'), ('heure_depart', 'ascending'), ('train_no', 'ascending'),
+             ('origine', 'ascending'), ('destination', 'ascending')]
+
+def fetch_day_counts() -> Dict[str, int]:
+    """
+    Nombre de trains TGV Max par jour, en une seule requête agrégée.
+    """
+    page = fetch_page({
+        'select': 'date, count(*) as n',
+        'where': "od_happy_card = 'OUI'",
+        'group_by': 'date'
+    })
+    return {row['date']: row['n'] for row in page.get('results', [])}
+
+def fetch_all_days() -> List[Dict]:
+    """
+    Le jeu de données complet en une requête /exports.
+    """
+    return export_records({
+        'select': ', '.join(TRAIN_FIELDS),
+        'where': "od_happy_card = 'OUI'"
+    })
+
+def _day_slices(table: pa.Table) -> Dict[str, Tuple[int, int]]:
+    # Table triée par date : date -> (début, longueur)
+    slices = {}
+    dates = table['date'].to_pylist()
+    start = 0
+    for i in range(1, len(dates) + 1):
+        if i == len(dates) or dates[i] != dates[start]:
+            slices[dates[start]] = (start, i - start)
+            start = i
+    return slices
+
+def _to_table(records: List[Dict]) -> pa.Table:
+    # Tous les champs sont stockés en texte, quel que soit le typage de l'API
+    columns = {field: [None if r.get(field) is None else str(r[field]) for r in records]
+               for field in TRAIN_FIELDS}
+    return pa.table(columns, schema=SCHEMA)
+
+# Compression des valeurs du cache partagé, si pyarrow la propose
+_IPC_OPTIONS = pa.ipc.IpcWriteOptions(compression='zstd' if pa.Codec.is_available('zstd') else None)
+
+def encode_records(records: List[Dict]) -> bytes:
+    """
+    Trains d'une journée au format Arrow IPC compressé, pour les caches partagés.
+    """
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, SCHEMA, options=_IPC_OPTIONS) as writer:
+        writer.write_table(_to_table(records))
+    return sink.getvalue().to_pybytes()
+
+def decode_records(payload: bytes) -> pd.DataFrame:
+    """Inverse de encode_records, sous forme de table des champs de l'API."""
+    return pa.ipc.open_stream(payload).read_all().to_pandas()
+
+class TrainSnapshot:
+    """
+    Table Arrow des trains triée par date, avec un index date -> tranche.
+    Le nombre de trains par jour ne voit pas un train remplacé par un autre :
+    le jeu complet est donc aussi rechargé toutes les `full_reload_interval`
+    secondes, et comparé jour par jour.
+    """
+    def __init__(self, path: str, full_reload_interval: int = SNAPSHOT_FULL_RELOAD_INTERVAL):
+        self.path = path
+        self.full_reload_interval = full_reload_interval
+        self._next_full_reload = 0.0
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._listeners: List[Callable[[pa.Table, pa.Table, List[str]], None]] = []
+        # Table, tranches par jour et index par jour (construits à la demande)
+        # sont remplacés ensemble pour des lectures sans verrou
+        self._state: Tuple[pa.Table, Dict[str, Tuple[int, int]], Dict[str, DayIndex]] = (
+            SCHEMA.empty_table(), {}, {}
+        )
+    
+    @property
+    def days(self) -> List[str]:
+        return sorted(self._state[1])
+    
+    @property
+    def table(self) -> pa.Table:
+        """Table complète courante (à ne pas modifier)."""
+        return self._state[0]
+    
+    def load(self) -> bool:
+        """Charge le fichier local s'il existe (mémoire mappée)."""
+        if not os.path.exists(self.path):
+            return False
+        with pa.memory_map(self.path) as source:
+            table = pa.ipc.open_file(source).read_all()
+        self._swap(table)
+        # Le fichier a été écrit par un rechargement ; le suivant est dû à partir de cette date
+        age = time.time() - os.path.getmtime(self.path)
+        self._next_full_reload = time.monotonic() + max(0.0, self.full_reload_interval - age)
+        return True
+    
+    def age(self) -> Optional[float]:
+        """Secondes écoulées depuis l'écriture du fichier local, None s'il n'existe pas."""
+        try:
+            return time.time() - os.path.getmtime(self.path)
+        except OSError:
+            return None
+    
+    def add_listener(self, listener: Callable[[pa.Table, pa.Table, List[str]], None]):
+        """
+        Appelle `listener(avant, après, jours rechargés)` après chaque
+        rafraîchissement ayant modifié la table.
+        """
+        self._listeners.append(listener)
+    
+    def covers(self, date: str) -> bool:
+        """Vrai si la copie locale contient les trains de la date."""
+        return date in self._state[1]
+    
+    def day_index(self, date: str) -> Optional[DayIndex]:
+        """
+        Index des trains d'une date, ou None si la date n'est pas couverte
+        par la copie locale.
+        """
+        table, slices, indexes = self._state
+        if date not in slices:
+            return None
+        index = indexes.get(date)
+        if index is None:
+            index = indexes[date] = DayIndex(table.slice(*slices[date]).to_pandas())
+        return index
+    
+    def refresh(self) -> List[str]:
+        """
+        Met à jour les jours dont le nombre de trains a changé, ou tous les
+        jours modifiés lors d'un rechargement complet, et retire les jours
+        sortis de la fenêtre. Renvoie les jours rechargés.
+        """
+        with self._refresh_lock:
+            return self._refresh()
+    
+    def _refresh(self) -> List[str]:
+        counts = fetch_day_counts()
+        previous, slices, _ = self._state
+        current = {date: length for date, (_, length) in slices.items()}
+        changed = sorted(date for date, n in counts.items() if current.get(date) != n)
+        removed = set(current) - set(counts)
+        full_reload = time.monotonic() >= self._next_full_reload or len(changed) > len(counts) // 2
+        if not changed and not removed and not full_reload:
+            return []
+        
+        if full_reload:
+            # Premier chargement, grosse mise à jour ou rechargement périodique : un seul téléchargement
+            table = _to_table(fetch_all_days()).sort_by(SORT_KEYS)
+            self._next_full_reload = time.monotonic() + self.full_reload_interval
+            fresh_slices = _day_slices(table)
+            changed = sorted(
+                date for date, (start, length) in fresh_slices.items()
+                if date not in slices or not table.slice(start, length).equals(previous.slice(*slices[date]))
+            )
+            removed = set(current) - set(fresh_slices)
+            if not changed and not removed:
+                return []
+        else:
+            kept = [previous.slice(*slices[date]) for date in current
+                    if date in counts and date not in changed]
+            fresh = [_to_table(fetch_day_records(date)) for date in changed]
+            table = pa.concat_tables(kept + fresh) if kept + fresh else SCHEMA.empty_table()
+        
+        table = table.sort_by(SORT_KEYS)
+        self._save(table)
+        self._swap(table)
+        logger.info("Snapshot tgvmax : %d jour(s) rechargé(s), %d retiré(s)", len(changed), len(removed))
+        for listener in self._listeners:
+            try:
+                listener(previous, table, changed)
+            except Exception:
+                logger.exception("Échec d'un abonné au snapshot tgvmax")
+        return changed
+    
+    def start(self, interval: int):
+        """Lance le rafraîchissement périodique dans un thread de fond."""
+        if self._thread is not None:
+            return
+        
+        def run():
+            while not self._stop.is_set():
+                try:
+                    self.refresh()
+                except Exception:
+                    logger.exception("Échec du rafraîchissement du snapshot tgvmax")
+                self._stop.wait(interval)
+        
+        self._thread = threading.Thread(target=run, name="tgvmax-snapshot", daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        """Arrête le thread de rafraîchissement."""
+        self._stop.set()
+    
+    def _save(self, table: pa.Table):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with pa.OSFile(tmp_path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, self.path)
+    
+    def _swap(self, table: pa.Table):
+        self._state = (table, _day_slices(table), {})
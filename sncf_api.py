@@ -0,0 +1,204 @@
+"""
+Accès bas niveau à l'API Opendatasoft du jeu de données tgvmax.
+Ce module ne dépend pas de Streamlit.
+"""
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from typing import Dict, Iterator, List, Optional
+import requests
+from requests.adapters import HTTPAdapter
+from metrics import current_trace, registry
+from config import (
+    SNCF_API_URL, SNCF_EXPORT_URL, API_LIMIT, API_MAX_OFFSET, API_TIMEOUT,
+    EXPORT_TIMEOUT, MAX_CONCURRENT_REQUESTS, API_MAX_RETRIES, API_BACKOFF_FACTOR,
+    API_BACKOFF_JITTER, API_MAX_RATE_LIMIT_WAIT
+)
+
+# Champs utiles à l'application
+TRAIN_FIELDS = ['date', 'train_no', 'origine', 'destination', 'heure_depart', 'heure_arrivee']
+
+# Limite globale du nombre de requêtes HTTP en cours, tous appelants confondus
+_in_flight = threading.BoundedSemaphore(MAX_CONCURRENT_REQUESTS)
+
+_calls_lock = threading.Lock()
+_upstream_calls = 0
+_paused_until = 0.0
+
+# Statuts pour lesquels la requête est retentée
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+class UpstreamError(Exception):
+    """Échec d'un appel à l'API SNCF, après les nouvelles tentatives."""
+
+def _create_session() -> requests.Session:
+    """
+    Session HTTP partagée : connexions persistantes (keep-alive) réutilisées
+    entre appels et réponses compressées (gzip, par défaut dans requests).
+    Les nouvelles tentatives sont faites par _get_json, hors du sémaphore.
+    """
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=MAX_CONCURRENT_REQUESTS, max_retries=0)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers['User-Agent'] = 'tgvmax_finder'
+    return session
+
+_session = _create_session()
+
+def get_upstream_call_count() -> int:
+    """
+    Nombre total de requêtes envoyées à l'API depuis le démarrage du processus.
+    """
+    return _upstream_calls
+
+def _parse_rate_limit_reset(value: Optional[str]) -> Optional[float]:
+    # L'API renvoie une date ISO ; on accepte aussi un nombre de secondes
+    # et la date HTTP de l'en-tête Retry-After
+    if not value:
+        return None
+    try:
+        return time.time() + float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        pass
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+def _wait_for_rate_limit():
+    wait = _paused_until - time.time()
+    if wait <= 0:
+        return
+    if wait > API_MAX_RATE_LIMIT_WAIT:
+        raise UpstreamError("Quota de l'API SNCF atteint, réessayez plus tard")
+    time.sleep(wait)
+
+def _update_rate_limit(response: requests.Response):
+    global _paused_until
+    if response.status_code == 429:
+        # Retry-After s'applique à tous les appelants : l'attente passe par _wait_for_rate_limit
+        reset = _parse_rate_limit_reset(response.headers.get('Retry-After'))
+        _paused_until = max(_paused_until, reset or time.time() + API_MAX_RATE_LIMIT_WAIT)
+    elif response.headers.get('X-RateLimit-Remaining') == '0':
+        reset = _parse_rate_limit_reset(response.headers.get('X-RateLimit-Reset'))
+        _paused_until = reset or time.time() + API_MAX_RATE_LIMIT_WAIT
+
+def _backoff(attempt: int):
+    # Attente exponentielle aléatoire, sans occuper de place dans _in_flight
+    time.sleep(API_BACKOFF_FACTOR * 2 ** attempt + random.uniform(0, API_BACKOFF_JITTER))
+
+def _send(url: str, params: Dict, timeout: int) -> requests.Response:
+    global _upstream_calls
+    _wait_for_rate_limit()
+    with _calls_lock:
+        _upstream_calls += 1
+    trace = current_trace()
+    if trace is not None:
+        trace.count_upstream_call()
+    registry.inc('tgvmax_upstream_requests_total', endpoint='exports' if url == SNCF_EXPORT_URL else 'records')
+    with _in_flight:
+        response = _session.get(url, params=params, timeout=timeout)
+    _update_rate_limit(response)
+    return response
+
+def _get_json(url: str, params: Dict, timeout: int):
+    """
+    Requête GET retentée jusqu'à API_MAX_RETRIES fois sur 429/5xx et erreurs
+    réseau. Chaque tentative compte comme un appel à l'API ; un Retry-After
+    au-delà de API_MAX_RATE_LIMIT_WAIT fait échouer l'appel sans attendre.
+    """
+    for attempt in range(API_MAX_RETRIES + 1):
+        last_attempt = attempt == API_MAX_RETRIES
+        try:
+            response = _send(url, params, timeout)
+            if response.status_code in RETRY_STATUSES and not last_attempt:
+                if response.status_code != 429:
+                    _backoff(attempt)
+                continue
+            response.raise_for_status()
+            return response.json()
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            if last_attempt:
+                raise UpstreamError(f"Erreur lors de la requête API : {e}") from e
+            _backoff(attempt)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            raise UpstreamError(f"Erreur lors de la requête API : {e}") from e
+
+def fetch_page(params: Dict, offset: int = 0) -> Dict:
+    """
+    Récupère une page de résultats (au plus API_LIMIT enregistrements).
+    """
+    return _get_json(SNCF_API_URL, {**params, 'limit': API_LIMIT, 'offset': offset}, API_TIMEOUT)
+
+def export_records(params: Dict) -> List[Dict]:
+    """
+    Récupère tous les enregistrements en une requête via l'endpoint /exports.
+    """
+    return _get_json(SNCF_EXPORT_URL, params, EXPORT_TIMEOUT)
+
+def iter_record_pages(params: Dict) -> Iterator[List[Dict]]:
+    """
+    Parcourt toutes les pages de résultats d'une requête, dans l'ordre.
+    La première page donne `total_count` ; les suivantes sont ensuite
+    récupérées en parallèle. Au-delà de API_MAX_OFFSET enregistrements
+    (limite de pagination de l'API), bascule sur l'endpoint /exports.
+    """
+    first_page = fetch_page(params)
+    total_count = first_page.get('total_count', 0)
+    
+    if total_count > API_MAX_OFFSET:
+        yield export_records(params)
+        return
+    
+    yield first_page.get('results', [])
+    offsets = range(API_LIMIT, total_count, API_LIMIT)
+    if not offsets:
+        return
+    
+    with ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT_REQUESTS, len(offsets))) as executor:
+        for page in executor.map(lambda offset: fetch_page(params, offset), offsets):
+            yield page.get('results', [])
+
+def fetch_all_records(params: Dict) -> List[Dict]:
+    """
+    Récupère la liste complète des enregistrements d'une requête.
+    """
+    return [record for page in iter_record_pages(params) for record in page]
+
+def fetch_latest_date() -> Optional[str]:
+    """
+    Date du dernier train TGV Max publié, en une seule requête agrégée.
+    """
+    page = fetch_page({'select': 'max(date) as max_date', 'where': "od_happy_card = 'OUI'"})
+    results = page.get('results', [])
+    return results[0].get('max_date') if results else None
+
+def count_trains(date: str) -> int:
+    """
+    Nombre de trains TGV Max d'une journée, sans télécharger les trains.
+    """
+    page = fetch_page({
+        'select': 'count(*) as n',
+        'where': f"date = date'{date}' AND od_happy_card = 'OUI'"
+    })
+    results = page.get('results', [])
+    return results[0].get('n', 0) if results else 0
+
+def fetch_day_records(date: str) -> List[Dict]:
+    """
+    Tous les trains TGV Max d'une journée, toutes origines et destinations confondues.
+    """
+    return fetch_all_records({
+        'select': ', '.join(TRAIN_FIELDS),
+        'where': f"date = date'{date}' AND od_happy_card = 'OUI'",
+        # train_no départage les trains de même heure pour une pagination stable
+        'order_by': 'heure_depart, train_no'
+    })
@@ -0,0 +1,25 @@
+"""
+Les modules de l'application sont à la racine du dépôt ; le substitut de
+l'API des mesures de performance (bench/fixture_api.py) sert aussi aux tests.
+"""
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'bench'))
+
+import fixture_api
+import sncf_api
+
+@pytest.fixture
+def serve_records():
+    """
+    Fait répondre l'API par les enregistrements donnés : `serve_records(records)`
+    remplace les réponses précédentes. La session réelle est rétablie après le test.
+    """
+    adapters = dict(sncf_api._session.adapters)
+    yield lambda records: fixture_api.install(fixture_api.FixtureAdapter(records))
+    for prefix, adapter in adapters.items():
+        sncf_api._session.mount(prefix, adapter)
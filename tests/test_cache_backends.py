@@ -0,0 +1,109 @@
+"""
+Caches partagés : mémoire, SQLite et Redis (client factice en mémoire).
+"""
+import time
+import pytest
+from cache_backends import MemoryCache, RedisCache, SQLiteCache, read_through
+
+class FakeRedis:
+    """Sous-ensemble du client redis utilisé par RedisCache, expirations comprises."""
+    def __init__(self):
+        self.values = {}
+        self.down = False
+    
+    def _alive(self, key):
+        entry = self.values.get(key)
+        if entry is not None and entry[1] <= time.time():
+            del self.values[key]
+            entry = None
+        return entry
+    
+    def get(self, key):
+        entry = self._alive(key)
+        return entry[0] if entry else None
+    
+    def pttl(self, key):
+        entry = self._alive(key)
+        return int((entry[1] - time.time()) * 1000) if entry else -2
+    
+    def set(self, key, value, ex=None):
+        self.values[key] = (value, time.time() + ex)
+    
+    def pipeline(self):
+        return FakePipeline(self)
+
+class FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+    
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.calls.append((name, args, kwargs))
+    
+    def execute(self):
+        if self.client.down:
+            raise ConnectionError("serveur injoignable")
+        return [getattr(self.client, name)(*args, **kwargs) for name, args, kwargs in self.calls]
+
+@pytest.fixture(params=['memory', 'sqlite', 'redis'])
+def cache(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryCache(max_entries=8)
+    if request.param == 'sqlite':
+        return SQLiteCache(str(tmp_path / 'cache.sqlite'))
+    return RedisCache(client=FakeRedis())
+
+def test_set_then_get(cache):
+    cache.set('a', b'1', ttl=60)
+    cache.set_many({'b': b'2', 'c': b'3'}, ttl=60)
+    assert cache.get('a') == b'1'
+    assert cache.get_many(['a', 'b', 'missing']) == {'a': b'1', 'b': b'2'}
+    assert cache.get('missing') is None
+
+def test_entries_expire(cache):
+    cache.set('short', b'x', ttl=1)
+    cache.set('long', b'y', ttl=60)
+    value, expires_at = cache.get_entry('long')
+    assert value == b'y'
+    assert 55 < expires_at - time.time() <= 60
+    time.sleep(1.1)
+    assert cache.get('short') is None
+    assert cache.get('long') == b'y'
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = MemoryCache(max_entries=2)
+    cache.set('a', b'1', 60)
+    cache.set('b', b'2', 60)
+    cache.get('a')
+    cache.set('c', b'3', 60)
+    assert cache.get_many(['a', 'b', 'c']) == {'a': b'1', 'c': b'3'}
+
+def test_sqlite_cache_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    SQLiteCache(path).set('a', b'1', 60)
+    assert SQLiteCache(path).get('a') == b'1'
+
+def test_backend_failure_is_a_miss():
+    client = FakeRedis()
+    cache = RedisCache(client=client)
+    cache.set('a', b'1', 60)
+    client.down = True
+    assert cache.get('a') is None
+    cache.set('b', b'2', 60)
+
+def test_read_through_computes_once(cache):
+    calls = []
+    
+    def compute():
+        calls.append(1)
+        return 'valeur'
+    
+    first = read_through(cache, 'k', 60, compute, str.encode, bytes.decode)
+    second = read_through(cache, 'k', 60, compute, str.encode, bytes.decode)
+    assert first[0] == second[0] == 'valeur'
+    assert len(calls) == 1
+    assert first[1] == 60
+    assert 55 < second[1] <= 60
+
+def test_read_through_without_cache():
+    assert read_through(None, 'k', 60, lambda: 'v', str.encode, bytes.decode) == ('v', 60)
@@ -0,0 +1,103 @@
+"""
+Balayage des connexions : comparaison avec une énumération exhaustive des
+trajets sur des réseaux aléatoires, puis filtre de Pareto.
+"""
+import random
+from collections import defaultdict
+import pandas as pd
+import pytest
+from connections import _pareto, scan_connections
+from trips import MINUTES_PER_DAY, normalize_trains
+
+STATIONS = ['LYON PART DIEU', 'LYON ST EXUPERY', 'PARIS (intramuros)', 'MARSEILLE ST CHARLES',
+            'DIJON VILLE', 'VALENCE TGV', 'AVIGNON TGV', 'NICE VILLE']
+
+def random_trains(seed: int, days: int = 2, per_day: int = 120) -> pd.DataFrame:
+    rng = random.Random(seed)
+    records = []
+    for day in range(days):
+        for n in range(per_day):
+            origin, destination = rng.sample(STATIONS, 2)
+            depart = rng.randrange(5 * 60, 23 * 60, 5)
+            arrival = (depart + rng.randrange(30, 300, 5)) % MINUTES_PER_DAY
+            records.append({
+                'date': f'2030-01-{day + 1:02d}', 'train_no': str(6000 + n),
+                'origine': origin, 'destination': destination,
+                'heure_depart': f'{depart // 60:02d}:{depart % 60:02d}',
+                'heure_arrivee': f'{arrival // 60:02d}:{arrival % 60:02d}'
+            })
+    return normalize_trains(records)
+
+def brute_force(trains: pd.DataFrame, origin: str, min_transfer: int, max_transfer: int, max_changes: int):
+    """Tous les trajets par parcours en profondeur, puis les non dominés par destination."""
+    offsets = (trains['date'] - trains['date'].min()).dt.days.to_numpy() * MINUTES_PER_DAY
+    departures = offsets + trains['depart_min'].to_numpy().astype(int)
+    arrivals = departures + trains['duree_min'].to_numpy().astype(int)
+    origins = trains['origine'].astype(str).to_numpy()
+    destinations = trains['destination'].astype(str).to_numpy()
+    by_station = defaultdict(list)
+    for row, station in enumerate(origins):
+        by_station[station].append(row)
+    
+    journeys = set()
+    
+    def extend(first, last, changes):
+        if destinations[last].startswith(origin):
+            return
+        journeys.add((departures[first], arrivals[last], changes, destinations[last]))
+        if changes == max_changes:
+            return
+        for row in by_station[destinations[last]]:
+            if arrivals[last] + min_transfer <= departures[row] <= arrivals[last] + max_transfer:
+                extend(first, row, changes + 1)
+    
+    for row, station in enumerate(origins):
+        if station.startswith(origin):
+            extend(row, row, 0)
+    return {
+        journey for journey in journeys
+        if not any(other[3] == journey[3] and other[0] >= journey[0] and other[1] <= journey[1]
+                   and other[2] <= journey[2] and other[:3] != journey[:3] for other in journeys)
+    }
+
+def as_set(journeys: pd.DataFrame, first_day) -> set:
+    departures = (journeys['date'] - first_day).dt.days * MINUTES_PER_DAY + journeys['depart_min'].astype(int)
+    return set(zip(departures, departures + journeys['duree_min'].astype(int),
+                   journeys['correspondances'].astype(int), journeys['destination'].astype(str)))
+
+@pytest.mark.parametrize('seed', range(6))
+@pytest.mark.parametrize('max_changes', [1, 2])
+def test_scan_matches_brute_force(seed, max_changes):
+    trains = random_trains(seed)
+    journeys = scan_connections(trains, 'LYON', min_transfer=15, max_transfer=120, max_changes=max_changes)
+    expected = brute_force(trains, 'LYON', 15, 120, max_changes)
+    assert expected
+    assert as_set(journeys, trains['date'].min()) == expected
+
+def test_scan_filters_destination_and_rebuilds_legs():
+    trains = normalize_trains([
+        {'date': '2030-01-01', 'train_no': '1', 'origine': 'LYON PART DIEU', 'destination': 'DIJON VILLE',
+         'heure_depart': '08:00', 'heure_arrivee': '10:00'},
+        {'date': '2030-01-01', 'train_no': '2', 'origine': 'DIJON VILLE', 'destination': 'PARIS (intramuros)',
+         'heure_depart': '10:30', 'heure_arrivee': '12:00'},
+        {'date': '2030-01-01', 'train_no': '3', 'origine': 'DIJON VILLE', 'destination': 'NICE VILLE',
+         'heure_depart': '10:05', 'heure_arrivee': '18:00'},
+    ])
+    journeys = scan_connections(trains, 'lyon', 'paris', min_transfer=15, max_transfer=120)
+    assert journeys[['via', 'train_no', 'duree_min', 'attente_min']].values.tolist() == [
+        ['DIJON VILLE', '1 + 2', 240, 30]
+    ]
+
+def test_pareto_keeps_non_dominated_journeys():
+    journeys = pd.DataFrame({
+        # (590, 910, 1) est dominé par (600, 900, 0) ; les doublons sont retirés
+        'destination': ['NICE'] * 6 + ['PARIS'],
+        'depart_abs': [600, 600, 620, 500, 590, 600, 500],
+        'arrivee_abs': [900, 880, 900, 800, 910, 900, 700],
+        'correspondances': [0, 1, 2, 0, 1, 0, 1],
+    })
+    kept = _pareto(journeys)
+    assert sorted(map(tuple, kept.values.tolist())) == [
+        ('NICE', 500, 800, 0), ('NICE', 600, 880, 1), ('NICE', 600, 900, 0),
+        ('NICE', 620, 900, 2), ('PARIS', 500, 700, 1)
+    ]
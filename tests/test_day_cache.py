@@ -0,0 +1,30 @@
+"""
+Cache des journées : une journée lue dans le cache partagé expire avec lui.
+"""
+import search
+from cache_backends import MemoryCache
+from search import DayCache
+
+RECORD = {'date': '2030-01-01', 'train_no': '6001', 'origine': 'PARIS (intramuros)',
+          'destination': 'LYON (intramuros)', 'heure_depart': '08:00', 'heure_arrivee': '10:00'}
+
+def test_local_entry_keeps_shared_remaining_ttl(monkeypatch):
+    calls = []
+    monkeypatch.setattr(search, 'fetch_day_records', lambda day: calls.append(day) or [RECORD])
+    shared = MemoryCache()
+    DayCache(ttl=3600, cache=shared).get('2030-01-01')
+    shared.set('day:2030-01-01', shared.get('day:2030-01-01'), ttl=100)
+    
+    replica = DayCache(ttl=3600, cache=shared)
+    index, hit = replica.get('2030-01-01')
+    assert not hit and len(index.query('PARIS')) == 1
+    assert calls == ['2030-01-01']
+    assert 95 < replica.expires_in('2030-01-01') <= 100
+
+def test_refresh_replaces_entry_without_invalidating(monkeypatch):
+    monkeypatch.setattr(search, 'fetch_day_records', lambda day: [RECORD])
+    cache = DayCache(ttl=3600)
+    cache.get('2030-01-01')
+    cache.refresh('2030-01-01')
+    assert cache.get('2030-01-01')[1]
+    assert cache.stats()['executed'] == 2
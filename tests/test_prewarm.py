@@ -0,0 +1,38 @@
+"""
+Préchauffage : une journée déjà rechargée par un autre processus n'est pas
+redemandée à l'API.
+"""
+from datetime import date
+import search
+from cache_backends import MemoryCache
+from prewarm import Prewarmer, QueryLog
+from search import DayCache
+
+DAY = date(2030, 1, 1)
+RECORD = {'date': '2030-01-01', 'train_no': '6001', 'origine': 'PARIS (intramuros)',
+          'destination': 'LYON (intramuros)', 'heure_depart': '08:00', 'heure_arrivee': '10:00'}
+
+def make_prewarmer(cache: DayCache, tmp_path) -> Prewarmer:
+    return Prewarmer(cache, QueryLog(str(tmp_path / 'queries.jsonl')), lambda: (DAY, DAY), refresh_ahead=300)
+
+def test_fresh_shared_entry_is_adopted_without_api_call(monkeypatch, tmp_path):
+    calls = []
+    monkeypatch.setattr(search, 'fetch_day_records', lambda day: calls.append(day) or [RECORD])
+    shared = MemoryCache()
+    DayCache(ttl=3600, cache=shared).refresh('2030-01-01')
+    
+    replica = DayCache(ttl=3600, cache=shared)
+    assert make_prewarmer(replica, tmp_path).run_once() == []
+    assert calls == ['2030-01-01']
+    assert replica.get('2030-01-01')[1]
+
+def test_expiring_shared_entry_is_refreshed(monkeypatch, tmp_path):
+    calls = []
+    monkeypatch.setattr(search, 'fetch_day_records', lambda day: calls.append(day) or [RECORD])
+    shared = MemoryCache()
+    DayCache(ttl=100, cache=shared).refresh('2030-01-01')
+    
+    replica = DayCache(ttl=3600, cache=shared)
+    assert make_prewarmer(replica, tmp_path).run_once() == ['2030-01-01']
+    assert calls == ['2030-01-01', '2030-01-01']
+    assert replica.expires_in('2030-01-01') > 3500
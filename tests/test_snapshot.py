@@ -0,0 +1,54 @@
+"""
+Copie locale du jeu de données, servie par le substitut de l'API : mise à
+jour des jours dont le nombre de trains change, et train remplacé vu
+seulement au rechargement complet.
+"""
+import os
+import time
+from fixture_api import synthetic_records
+from snapshot import TrainSnapshot
+
+def numbers(snapshot: TrainSnapshot, day: str) -> set:
+    return {train['train_no'] for train in snapshot.day_index(day).query()}
+
+def test_refresh_adds_trains_of_changed_day(serve_records, tmp_path):
+    records = synthetic_records(days=4, hub_trains=10, other_trains=5)
+    serve_records(records)
+    snapshot = TrainSnapshot(str(tmp_path / 'snapshot.arrow'))
+    days = snapshot.refresh()
+    assert len(days) == 4 and snapshot.refresh() == []
+    
+    day = days[1]
+    added = [dict(records[0], date=day, train_no='9001'), dict(records[0], date=day, train_no='9002')]
+    served = serve_records(records + added)
+    assert snapshot.refresh() == [day]
+    assert {'9001', '9002'} <= numbers(snapshot, day)
+    assert snapshot.table.num_rows == len(records) + 2
+    # Une requête de comptage et une pour la journée modifiée
+    assert served.requests == 2
+    
+    reloaded = TrainSnapshot(snapshot.path)
+    reloaded.load()
+    assert reloaded.table.equals(snapshot.table)
+
+def test_replaced_train_is_caught_by_full_reload(serve_records, tmp_path):
+    records = synthetic_records(days=4, hub_trains=10, other_trains=5)
+    serve_records(records)
+    path = str(tmp_path / 'snapshot.arrow')
+    snapshot = TrainSnapshot(path, full_reload_interval=3600)
+    day = snapshot.refresh()[2]
+    
+    replaced = next(i for i, record in enumerate(records) if record['date'] == day)
+    old_number = records[replaced]['train_no']
+    records[replaced] = dict(records[replaced], train_no='9003')
+    serve_records(records)
+    # Même nombre de trains : le rafraîchissement par comptage ne voit rien
+    assert snapshot.refresh() == []
+    assert old_number in numbers(snapshot, day)
+    
+    # Fichier écrit il y a plus d'une heure : le rechargement complet est dû
+    os.utime(path, (time.time() - 7200,) * 2)
+    stale = TrainSnapshot(path, full_reload_interval=3600)
+    stale.load()
+    assert stale.refresh() == [day]
+    assert '9003' in numbers(stale, day) and old_number not in numbers(stale, day)
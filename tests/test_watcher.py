@@ -0,0 +1,43 @@
+"""
+Alertes de places : à chaque rafraîchissement de la copie locale, chaque
+abonné d'une liaison reçoit une alerte listant une fois chaque nouveau train.
+"""
+from fixture_api import HUB, synthetic_records
+from snapshot import TrainSnapshot
+from watcher import AvailabilityWatcher, QueueNotifier
+
+def drain(notifier: QueueNotifier) -> list:
+    alerts = []
+    while not notifier.alerts.empty():
+        alerts.append(notifier.alerts.get())
+    return alerts
+
+def test_one_alert_per_subscriber_with_each_new_train(serve_records, tmp_path):
+    records = synthetic_records(days=4, hub_trains=10, other_trains=5)
+    serve_records(records)
+    snapshot = TrainSnapshot(str(tmp_path / 'snapshot.arrow'))
+    notifier = QueueNotifier()
+    watcher = AvailabilityWatcher(notifier)
+    watcher.attach(snapshot)
+    destination = next(r['destination'] for r in records if r['origine'] == HUB)
+    watcher.subscribe('alice', HUB, destination)
+    watcher.subscribe('bob', HUB.lower(), f" {destination.lower()}")
+    watcher.subscribe('carol', destination, HUB)
+    
+    # Le premier chargement sert de référence
+    day = snapshot.refresh()[1]
+    assert drain(notifier) == []
+    
+    added = [dict(records[0], date=day, destination=destination, train_no=number, heure_depart='06:00')
+             for number in ('9001', '9002')]
+    serve_records(records + added)
+    assert snapshot.refresh() == [day]
+    alerts = drain(notifier)
+    assert sorted(alert['subscriber'] for alert in alerts) == ['alice', 'bob']
+    for alert in alerts:
+        assert (alert['origine'], alert['destination']) == (HUB, destination)
+        assert sorted(train['train_no'] for train in alert['trains']) == ['9001', '9002']
+    
+    # Rien de nouveau : pas de nouvelle alerte
+    assert snapshot.refresh() == []
+    assert drain(notifier) == []
@@ -1,23 +1,43 @@
+from time import perf_counter
+_SCRIPT_START = perf_counter()
+
 import streamlit as st
 import pandas as pd
-from datetime import datetime, timedelta, time
+import threading
+import uuid
+from datetime import datetime, timedelta
 import requests
 from typing import List, Dict
-from enum import Enum
 import folium
 from folium import plugins
-from geopy.geocoders import Nominatim
-from geopy.exc import GeocoderTimedOut
 from streamlit_folium import folium_static
 import json
 from config import (
     MIN_DATE, MAX_DATE, DEFAULT_START_TIME, DEFAULT_END_TIME,
-    DEFAULT_ORIGIN, MAX_RANGE_DAYS, DEFAULT_RANGE_DAYS
+    DEFAULT_ORIGIN, MAX_RANGE_DAYS, DEFAULT_RANGE_DAYS, MAX_STAY_DAYS,
+    DEFAULT_MIN_STAY, DEFAULT_MAX_STAY, LATEST_DATE_TTL, MAP_FAST_RENDER_THRESHOLD,
+    MAP_POPUP_MAX_TIMES, RESULTS_PAGE_SIZE, DETAIL_PAGE_ROWS, CACHE_TTL, SEARCH_CACHE_MAX_ENTRIES, MAX_CHANGES,
+    MIN_TRANSFER_MINUTES, MAX_TRANSFER_MINUTES, FAVORITES_USER_PARAM, STREAM_RENDER_INTERVAL,
+    STREAM_PREVIEW_ROWS
 )
 from utils import (
-    get_tgvmax_trains, filter_trains_by_time, format_single_trips,
-    calculate_duration, handle_error
+    get_snapshot, get_geocoder, get_metrics_server, get_coalescing_stats, get_watcher,
+    get_favorites_store, get_query_log, get_prewarmer, fetch_trips_for_dates, handle_error,
+    StreamlitTripSource
+)
+from trips import (
+    format_trips_for_display, format_clock, format_duration, aggregate_routes, concat_trips
+)
+from search import (
+    SearchMode, find_trips, normalize_search, search_dates, search_days, search_key, stream_date_range
 )
+from sncf_api import UpstreamError, get_upstream_call_count, fetch_latest_date, count_trains
+from metrics import Trace, attach_trace, cache_hit_ratio, count_cache, registry, span
+from diagnostics import (
+    record_render, check_startup_budget, get_cold_start_report, get_last_render_report
+)
+
+_IMPORT_SECONDS = perf_counter() - _SCRIPT_START
 
 # Configuration de la page
 st.set_page_config(
@@ -31,11 +51,6 @@ st.set_page_config(
     }
 )
 
-class SearchMode(str, Enum):
-    SINGLE = "Aller simple"
-    ROUND_TRIP = "Aller-retour"
-    DATE_RANGE = "Plage de dates"
-
 # Configuration des styles CSS personnalisés
 st.markdown("""
     <style>
@@ -175,7 +190,7 @@ st.markdown("""
         background-color: #0071e3;
         color: white;
     }
-
+    
     /* Destinations disponibles */
     .destinations-chip {
         display: inline-block;
@@ -186,7 +201,7 @@ st.markdown("""
         font-size: 0.9rem;
         color: #1d1d1f;
     }
-
+    
     .destinations-container {
         background-color: #fff;
         border-radius: 14px;
@@ -195,7 +210,7 @@ st.markdown("""
         border: 1px solid #e5e5e5;
         font-size: 0.9rem;
     }
-
+    
     .destinations-title {
         color: #86868b;
         font-size: 0.9rem;
@@ -208,280 +223,374 @@ st.markdown("""
     </div>
     """, unsafe_allow_html=True)
 
-@handle_error
-def find_trips(mode: SearchMode,
-               depart_date: datetime.date,
-               return_date: datetime.date = None,
-               origin_city: str = None,
-               destination_city: str = None,
-               depart_start: time = None,
-               depart_end: time = None,
-               return_start: time = None,
-               return_end: time = None,
-               date_range_days: int = DEFAULT_RANGE_DAYS) -> pd.DataFrame:
+# Positionné par _shared_search quand le cache Streamlit l'exécute (recherche calculée)
+_search_loads = threading.local()
+
+@st.cache_resource(ttl=CACHE_TTL, max_entries=SEARCH_CACHE_MAX_ENTRIES, show_spinner=False)
+def _shared_search(key: str, _search: Dict) -> pd.DataFrame:
     """
-    Trouve les trajets disponibles en TGV Max selon le mode choisi.
+    Résultats partagés par toutes les sessions pour une même empreinte.
+    La table ne doit pas être modifiée ; une erreur n'est jamais mise en cache.
     """
-    if mode == SearchMode.DATE_RANGE:
-        all_trains = []
-        with st.spinner(f'Recherche des trains sur {date_range_days} jours...'):
-            progress_bar = st.progress(0)
-            for i in range(date_range_days):
-                current_date = depart_date + timedelta(days=i)
-                trains = get_tgvmax_trains(
-                    current_date.strftime("%Y-%m-%d"),
-                    origin=origin_city,
-                    destination=destination_city
-                )
-                all_trains.extend(trains)
-                progress_bar.progress((i + 1) / date_range_days)
-            progress_bar.empty()
-        
-        df = format_single_trips(all_trains)
-        if not df.empty and depart_start and depart_end:
-            return filter_trains_by_time(df, depart_start, depart_end, is_round_trip=False)
+    _search_loads.computed = True
+    n_days = search_days(_search)
+    with st.spinner(f"Recherche des trains sur {n_days} jours..." if n_days > 1 else "Recherche des trains..."):
+        if n_days <= 2:
+            return find_trips(StreamlitTripSource(), **_search)
+        progress_bar = st.progress(0)
+        df = find_trips(
+            StreamlitTripSource(), **_search,
+            on_progress=lambda done, total: progress_bar.progress(done / total)
+        )
+        progress_bar.empty()
         return df
-    
-    elif mode == SearchMode.SINGLE:
-        with st.spinner('Recherche des trains...'):
-            trains = get_tgvmax_trains(
-                depart_date.strftime("%Y-%m-%d"),
-                origin=origin_city
-            )
-            
-        if trains:
-            with st.expander("🎯 Voir les destinations disponibles", expanded=False):
-                st.markdown(
-                    f"""<div class="destinations-container">
-                        <div class="destinations-title">Destinations disponibles :</div>
-                        {''.join(f'<span class="destinations-chip">{dest}</span>' for dest in sorted(set(t['destination'] for t in trains)))}
-                    </div>""",
-                    unsafe_allow_html=True
+
+def _stop_search(key: str):
+    st.session_state.search_stopped = key
+
+def _range_result(days: Dict) -> pd.DataFrame:
+    # Même ordre que find_trips : par date, puis par heure de départ
+    return concat_trips([days[day] for day in sorted(days)])
+
+def stream_range_search(key: str, search: Dict) -> pd.DataFrame:
+    """
+    Plage de dates : les trajets s'affichent au fur et à mesure des jours
+    reçus. Les jours déjà reçus sont conservés dans la session, pour
+    « Arrêter » ; une nouvelle recherche réutilise les jours déjà récupérés.
+    """
+    start = perf_counter()
+    total = search['date_range_days']
+    days: Dict = {}
+    st.session_state.partial_result = (key, days)
+    stop_slot, status, preview = st.empty(), st.empty(), st.empty()
+    stop_slot.button("⏹ Arrêter la recherche", key="stop_search", on_click=_stop_search, args=(key,))
+    last_render = start
+    stream = stream_date_range(
+        StreamlitTripSource(), search['depart_date'], total, search['origin_city'],
+        search['destination_city'], search['depart_start'], search['depart_end']
+    )
+    try:
+        for day, trips in stream:
+            days[day] = trips
+            if len(days) == 1:
+                registry.observe('tgvmax_first_result_seconds', perf_counter() - start, mode=search['mode'].name)
+            # Réponses en cache : aucun affichage intermédiaire
+            if len(days) < total and perf_counter() - last_render >= STREAM_RENDER_INTERVAL:
+                partial = _range_result(days)
+                status.markdown(f"🔎 {len(partial)} trajet{'s' if len(partial) > 1 else ''} sur {len(days)}/{total} jours...")
+                preview.dataframe(
+                    format_trips_for_display(partial.head(STREAM_PREVIEW_ROWS), False)[
+                        ['origine', 'destination', 'date', 'heure_depart', 'heure_arrivee', 'duree']],
+                    hide_index=True
                 )
-            
-        df = format_single_trips(trains)
-        if not df.empty and depart_start and depart_end:
-            return filter_trains_by_time(df, depart_start, depart_end, is_round_trip=False)
-        return df
-    
-    else:  # mode == SearchMode.ROUND_TRIP
-        with st.spinner('Recherche des trains aller...'):
-            outbound_trains = get_tgvmax_trains(
-                depart_date.strftime("%Y-%m-%d"),
-                origin=origin_city
-            )
-            
-        if outbound_trains:
-            destinations = sorted(set(t['destination'] for t in outbound_trains))
-            st.markdown(
-                f"""<div class="destinations-container">
-                    <div class="destinations-title">Destinations possibles en aller-retour :</div>
-                    {''.join(f'<span class="destinations-chip">{dest}</span>' for dest in destinations)}
-                </div>""",
-                unsafe_allow_html=True
-            )
-        
-        with st.spinner('Recherche des trains retour...'):
-            inbound_trains = get_tgvmax_trains(return_date.strftime("%Y-%m-%d"))
-        
-        if not outbound_trains or not inbound_trains:
-            return pd.DataFrame()
-        
-        round_trips = []
-        for outbound in outbound_trains:
-            destination = outbound['destination']
-            origin = outbound['origine']
-            
-            matching_returns = [
-                train for train in inbound_trains
-                if train['origine'] == destination and train['destination'] == origin
-            ]
-            
-            for return_train in matching_returns:
-                round_trips.append({
-                    'Aller_Origine': outbound['origine'],
-                    'Aller_Destination': outbound['destination'],
-                    'Aller_Date': outbound['date'],
-                    'Aller_Heure': outbound['heure_depart'],
-                    'Aller_Arrivee': outbound['heure_arrivee'],
-                    'Retour_Origine': return_train['origine'],
-                    'Retour_Destination': return_train['destination'],
-                    'Retour_Date': return_train['date'],
-                    'Retour_Heure': return_train['heure_depart'],
-                    'Retour_Arrivee': return_train['heure_arrivee']
-                })
-        
-        if round_trips:
-            df = pd.DataFrame(round_trips)
-            for prefix in ['Aller_', 'Retour_']:
-                df[f'{prefix}Date'] = pd.to_datetime(df[f'{prefix}Date']).dt.strftime('%d/%m/%Y')
-            
-            df = df.sort_values('Aller_Heure')
-            
-            if depart_start and depart_end:
-                df = filter_trains_by_time(df, depart_start, depart_end, return_start, return_end)
-            
-            if not df.empty:
-                df['Duree_Aller'] = df.apply(lambda x: calculate_duration(x['Aller_Heure'], x['Aller_Arrivee']), axis=1)
-                df['Duree_Retour'] = df.apply(lambda x: calculate_duration(x['Retour_Heure'], x['Retour_Arrivee']), axis=1)
-            
-            return df
-        return pd.DataFrame()
+                last_render = perf_counter()
+    finally:
+        stream.close()
+    stop_slot.empty()
+    status.empty()
+    preview.empty()
+    return _range_result(days)
 
-@st.cache_data(ttl=3600)  # Cache pour 1 heure
-def find_latest_train_date():
+@handle_error
+def search_trips(search: Dict) -> pd.DataFrame:
+    """
+    Résultats d'une recherche, conservés dans la session : les réexécutions
+    (tri, filtres, onglets) ne font que redécouper la table en cache.
+    """
+    start = perf_counter()
+    key = search_key(search)
+    cached = st.session_state.get('search_result')
+    partial = st.session_state.get('partial_result')
+    if cached is not None and cached[0] == key:
+        cache, df = 'session', cached[1]
+    elif search['mode'] == SearchMode.DATE_RANGE and st.session_state.get('search_stopped') == key \
+            and partial is not None and partial[0] == key:
+        cache, df = 'session', _range_result(partial[1])
+        st.warning(f"Recherche arrêtée : {len(partial[1])} jour{'s' if len(partial[1]) > 1 else ''} "
+                   f"sur {search['date_range_days']} parcouru{'s' if len(partial[1]) > 1 else ''}.")
+    elif search['mode'] == SearchMode.DATE_RANGE:
+        # Le cache partagé des journées tient lieu de cache de recherche
+        cache, df = 'stream', stream_range_search(key, search)
+        st.session_state.search_result = (key, df)
+    else:
+        _search_loads.computed = False
+        df = _shared_search(key, search)
+        cache = 'miss' if _search_loads.computed else 'shared'
+        st.session_state.search_result = (key, df)
+    if cache != 'session':
+        # Les recherches journalisées orientent le préchauffage du cache
+        get_query_log().record(search['mode'].name, search.get('origin_city'), search_dates(search))
+    count_cache('search', cache not in ('miss', 'stream'))
+    registry.observe('tgvmax_search_seconds', perf_counter() - start,
+                     mode=search['mode'].name, cache=cache)
+    return df
+
+@st.cache_data(ttl=LATEST_DATE_TTL)
+def find_latest_train_date() -> datetime.date:
     """Trouve la date du dernier train disponible dans l'API."""
-    # On part de la date maximale possible
-    current_date = MAX_DATE
-    
-    # On teste chaque jour en reculant jusqu'à trouver des trains
-    while current_date >= MIN_DATE:
-        try:
-            # On teste avec Paris qui a toujours des trains
-            trains = get_tgvmax_trains(
-                current_date.strftime("%Y-%m-%d"),
-                origin="PARIS"
-            )
-            if trains:
-                return current_date
-        except:
-            pass
-        current_date -= timedelta(days=1)
+    # La copie locale connaît déjà tous les jours publiés
+    snapshot = get_snapshot()
+    if snapshot is not None and snapshot.days:
+        return datetime.strptime(snapshot.days[-1], "%Y-%m-%d").date()
     
-    return MIN_DATE
+    try:
+        latest = fetch_latest_date()
+        if latest:
+            return datetime.strptime(latest[:10], "%Y-%m-%d").date()
+    except UpstreamError:
+        pass
+    
+    # Repli : recherche dichotomique du dernier jour ayant des trains.
+    # Invariant : des trains circulent le jour `low` (ou low est avant la fenêtre),
+    # aucun après `high`.
+    low, high = MIN_DATE - timedelta(days=1), MAX_DATE
+    while low < high:
+        mid = high - timedelta(days=(high - low).days // 2)
+        if count_trains(mid.strftime("%Y-%m-%d")) > 0:
+            low = mid
+        else:
+            high = mid - timedelta(days=1)
+    return max(low, MIN_DATE)
 
 def init_session_state():
     """Initialise les variables de session."""
-    if 'favorites' not in st.session_state:
-        st.session_state.favorites = []
     if 'theme' not in st.session_state:
         st.session_state.theme = 'light'
+    if 'last_search' not in st.session_state:
+        st.session_state.last_search = None
+    if 'search_stopped' not in st.session_state:
+        st.session_state.search_stopped = None
+
+def current_user_id() -> str:
+    """
+    Identifiant des favoris, porté par l'URL (?user=...) pour survivre
+    aux rafraîchissements du navigateur ; créé à la première visite.
+    """
+    user_id = st.query_params.get(FAVORITES_USER_PARAM)
+    if not user_id:
+        user_id = st.query_params[FAVORITES_USER_PARAM] = uuid.uuid4().hex
+    return user_id
+
+def render_favorites(user_id: str, show_empty: bool = True):
+    """Favoris et disponibilités précalculées : une lecture, sans recherche."""
+    store = get_favorites_store()
+    favorites = store.favorites(user_id)
+    if favorites.empty:
+        if show_empty:
+            st.info("Aucun favori pour l'instant : ajoutez des liaisons depuis vos résultats.")
+        return
+    if not show_empty:
+        st.markdown("### ⭐ Mes favoris")
+    for fav in favorites.itertuples(index=False):
+        col1, col2 = st.columns([4, 1])
+        with col1:
+            if not store.tracks_availability:
+                availability = "disponibilités inconnues (copie locale désactivée)"
+            elif fav.prochain_depart:
+                next_day, next_time = fav.prochain_depart.split(' ')
+                availability = (f"{fav.trains} train{'s' if fav.trains > 1 else ''} sur {fav.jours} jour{'s' if fav.jours > 1 else ''}"
+                                f", prochain départ le {datetime.strptime(next_day, '%Y-%m-%d').strftime('%d/%m')} à {next_time}")
+            else:
+                availability = "aucune place TGV Max pour le moment"
+            st.write(f"⭐ {fav.origine} → {fav.destination} : {availability}")
+        with col2:
+            if st.button("Retirer", key=f"remove_{fav.origine}_{fav.destination}"):
+                store.remove(user_id, fav.origine, fav.destination)
+                watcher = get_watcher()
+                if watcher is not None:
+                    watcher.unsubscribe(user_id, fav.origine, fav.destination)
+                st.rerun()
 
 def toggle_theme():
     """Bascule entre le mode clair et sombre."""
     st.session_state.theme = 'dark' if st.session_state.theme == 'light' else 'light'
 
-# Cache pour les coordonnées des villes
-@st.cache_data
-def get_city_coordinates(city: str) -> tuple:
-    """Récupère les coordonnées d'une ville."""
-    try:
-        geolocator = Nominatim(user_agent="tgvmax_finder")
-        location = geolocator.geocode(f"{city}, France")
-        if location:
-            return (location.latitude, location.longitude)
-    except GeocoderTimedOut:
-        pass
-    return None
+def paginate(total: int, key: str, page_size: int = RESULTS_PAGE_SIZE) -> slice:
+    """
+    Affiche un sélecteur de page si nécessaire et renvoie la tranche
+    des éléments de la page courante.
+    """
+    n_pages = max(1, -(-total // page_size))
+    page = 1
+    if n_pages > 1:
+        page = st.selectbox(
+            "Page",
+            options=range(1, n_pages + 1),
+            format_func=lambda p: f"Page {p} / {n_pages}",
+            key=key
+        )
+    start = (page - 1) * page_size
+    return slice(start, start + page_size)
+
+def _route_times(route) -> str:
+    """Heures de départ d'une liaison, tronquées pour le popup."""
+    times = [format_clock(minutes) for minutes in route.departs[:MAP_POPUP_MAX_TIMES]]
+    if len(route.departs) > MAP_POPUP_MAX_TIMES:
+        times.append("…")
+    return ', '.join(times)
 
 def create_route_map(df: pd.DataFrame, search_mode: SearchMode) -> folium.Map:
-    """Crée une carte avec les trajets."""
+    """
+    Crée une carte des liaisons : un marqueur par gare et une ligne par couple
+    (origine, destination), d'autant plus épaisse que les trains sont nombreux.
+    La taille de la carte dépend du nombre de liaisons, pas du nombre de trains.
+    """
     # Centrer la carte sur la France
     france_center = [46.603354, 1.888334]
     m = folium.Map(location=france_center, zoom_start=6)
     
+    routes = aggregate_routes(df, search_mode.is_round_trip)
+    origins = set(routes['origine'].astype(str))
+    destinations = set(routes['destination'].astype(str))
+    
+    # Récupérer les coordonnées de toutes les villes en un seul lot
+    city_coords = get_geocoder().lookup(origins | destinations)
+    routes = routes[routes['origine'].astype(str).isin(city_coords)
+                    & routes['destination'].astype(str).isin(city_coords)]
+    if routes.empty:
+        return m
+    max_trains = routes['trains'].max()
+    
+    if len(routes) > MAP_FAST_RENDER_THRESHOLD:
+        # Beaucoup de liaisons : marqueurs groupés côté navigateur et lignes en un seul GeoJSON
+        stations = sorted(set(routes['origine'].astype(str)) | set(routes['destination'].astype(str)))
+        plugins.FastMarkerCluster([list(city_coords[station]) for station in stations]).add_to(m)
+        features = [
+            {
+                'type': 'Feature',
+                'geometry': {
+                    'type': 'LineString',
+                    # GeoJSON attend (longitude, latitude)
+                    'coordinates': [city_coords[route.origine][::-1], city_coords[route.destination][::-1]]
+                },
+                'properties': {
+                    'liaison': f"{route.origine} → {route.destination}",
+                    'trains': int(route.trains),
+                    'departs': _route_times(route),
+                    'weight': 1 + 5 * route.trains / max_trains
+                }
+            }
+            for route in routes.itertuples(index=False)
+        ]
+        folium.GeoJson(
+            {'type': 'FeatureCollection', 'features': features},
+            style_function=lambda feature: {
+                'color': '#0071e3',
+                'weight': feature['properties']['weight'],
+                'opacity': 0.6
+            },
+            popup=folium.GeoJsonPopup(fields=['liaison', 'trains', 'departs'],
+                                        aliases=['Liaison', 'Trains', 'Départs'])
+        ).add_to(m)
+        return m
+    
     # Créer un groupe de marqueurs pour le clustering
     marker_cluster = plugins.MarkerCluster().add_to(m)
     
-    # Dictionnaire pour stocker les coordonnées des villes
-    city_coords = {}
+    # Un marqueur par gare : bleu pour les départs, vert pour les arrivées
+    for station in sorted(origins | destinations):
+        if station not in city_coords:
+            continue
+        is_origin = station in origins
+        folium.CircleMarker(
+            location=city_coords[station],
+            radius=8,
+            color='#0071e3' if is_origin else '#2ecc71',
+            fill=True,
+            popup=f"{'🚉' if is_origin else '🏁'} {station}",
+        ).add_to(marker_cluster)
     
-    if search_mode == SearchMode.ROUND_TRIP:
-        origins = df['Aller_Origine'].unique()
-        destinations = df['Aller_Destination'].unique()
-    else:
-        origins = df['origine'].unique()
-        destinations = df['destination'].unique()
-    
-    # Récupérer les coordonnées de toutes les villes
-    all_cities = set(list(origins) + list(destinations))
-    for city in all_cities:
-        coords = get_city_coordinates(city)
-        if coords:
-            city_coords[city] = coords
-    
-    # Ajouter les marqueurs et les lignes
-    for _, row in df.iterrows():
-        if search_mode == SearchMode.ROUND_TRIP:
-            origin = row['Aller_Origine']
-            destination = row['Aller_Destination']
-            depart_time = row['Aller_Heure']
-            arrival_time = row['Aller_Arrivee']
-        else:
-            origin = row['origine']
-            destination = row['destination']
-            depart_time = row['heure_depart']
-            arrival_time = row['heure_arrivee']
-        
-        if origin in city_coords and destination in city_coords:
-            # Ajouter les marqueurs
-            origin_coords = city_coords[origin]
-            dest_coords = city_coords[destination]
-            
-            # Marqueur de départ
-            folium.CircleMarker(
-                location=origin_coords,
-                radius=8,
-                color='#0071e3',
-                fill=True,
-                popup=f"🚉 {origin}",
-            ).add_to(marker_cluster)
-            
-            # Marqueur d'arrivée
-            folium.CircleMarker(
-                location=dest_coords,
-                radius=8,
-                color='#2ecc71',
-                fill=True,
-                popup=f"🏁 {destination}",
-            ).add_to(marker_cluster)
-            
-            # Ligne du trajet
-            folium.PolyLine(
-                locations=[origin_coords, dest_coords],
-                color='#0071e3',
-                weight=2,
-                opacity=0.8,
-                popup=f"{origin} → {destination}<br>{depart_time} - {arrival_time}",
-            ).add_to(m)
+    # Une ligne par liaison, épaisseur proportionnelle au nombre de trains
+    for route in routes.itertuples(index=False):
+        folium.PolyLine(
+            locations=[city_coords[route.origine], city_coords[route.destination]],
+            color='#0071e3',
+            weight=2 + 6 * route.trains / max_trains,
+            opacity=0.8,
+            popup=(f"{route.origine} → {route.destination}<br>"
+                   f"{route.trains} train{'s' if route.trains > 1 else ''} : {_route_times(route)}"),
+        ).add_to(m)
     
     return m
 
-def convert_duration_to_timedelta(duration_str: str) -> pd.Timedelta:
-    """Convertit une chaîne de durée (ex: '2h15') en Timedelta."""
-    if 'h' in duration_str:
-        parts = duration_str.split('h')
-        hours = int(parts[0])
-        minutes = int(parts[1]) if parts[1] else 0
-        return pd.Timedelta(hours=hours, minutes=minutes)
-    return pd.Timedelta(minutes=int(duration_str))
+def render_diagnostics():
+    """Panneau de diagnostic, affiché uniquement avec ?diagnostics=1 dans l'URL."""
+    with st.sidebar.expander("🩺 Diagnostics", expanded=True):
+        for title, report in [("Démarrage à froid", get_cold_start_report()),
+                              ("Dernier rendu", get_last_render_report())]:
+            if not report:
+                continue
+            st.markdown(f"**{title}**")
+            st.write({
+                "Imports (s)": round(report['import_seconds'], 3),
+                "Premier rendu (s)": round(report['first_paint_seconds'], 3),
+                "Appels API avant rendu": report['upstream_calls'],
+            })
+            for violation in check_startup_budget(report):
+                st.warning(violation)
+        st.metric("Appels API depuis le démarrage", get_upstream_call_count())
+        coalescing = get_coalescing_stats()
+        st.metric("Requêtes identiques regroupées", coalescing['coalesced'],
+                  help=f"{coalescing['executed']} requête(s) de trains exécutée(s)")
+        prewarmer = get_prewarmer()
+        if prewarmer is not None and prewarmer.plan is not None:
+            st.metric("Appels API du préchauffage (dernière heure)", prewarmer.spent_last_hour(),
+                      help=f"Budget : {prewarmer.plan.budget} par heure ; origines populaires : "
+                           f"{', '.join(prewarmer.plan.origins) or 'aucune'}")
+        
+        # Sonde manuelle de la fenêtre de réservation (coûte un appel par jour)
+        probe_origin = st.text_input("Origine à sonder", DEFAULT_ORIGIN)
+        if st.button("Sonder la fenêtre de réservation"):
+            days = [MIN_DATE + timedelta(days=i) for i in range((MAX_DATE - MIN_DATE).days + 1)]
+            try:
+                trips = fetch_trips_for_dates(days, origin=probe_origin)
+            except UpstreamError as e:
+                st.error(str(e))
+                return
+            counts = trips['date'].value_counts()
+            st.dataframe(
+                pd.DataFrame({
+                    'date': [day.strftime("%d/%m/%Y") for day in days],
+                    'trains': [int(counts.get(pd.Timestamp(day), 0)) for day in days]
+                }),
+                hide_index=True
+            )
 
-def test_june_dates():
-    """Fonction temporaire pour tester les dates de juin."""
-    june_dates = []
-    for day in range(1, 31):
-        date = datetime(2024, 6, day).date()
-        try:
-            trains = get_tgvmax_trains(date.strftime("%Y-%m-%d"), origin="PARIS")
-            if trains:
-                june_dates.append(date)
-        except:
-            continue
-    return june_dates
+def render_search_trace(trace: Trace):
+    """Étapes de cette exécution et indicateurs de dimensionnement (?diagnostics=1)."""
+    with st.sidebar.expander("⏱️ Dernière exécution", expanded=True):
+        st.metric("Appels API pendant cette exécution", trace.upstream_calls)
+        col1, col2 = st.columns(2)
+        for col, cache, label in [(col1, 'day_index', "Cache des journées"),
+                                  (col2, 'search', "Cache des recherches")]:
+            ratio = cache_hit_ratio(cache)
+            col.metric(label, f"{ratio:.0%}" if ratio is not None else "N/A")
+        p95 = registry.quantile('tgvmax_search_seconds', 0.95)
+        st.metric("Recherche p95", f"{p95 * 1000:.0f} ms" if p95 is not None else "N/A")
+        first_result = registry.quantile('tgvmax_first_result_seconds', 0.95)
+        if first_result is not None:
+            st.metric("Premiers résultats p95 (plage de dates)", f"{first_result * 1000:.0f} ms")
+        spans = trace.summary()
+        if spans:
+            st.dataframe(pd.DataFrame(spans), hide_index=True)
 
 def main():
+    trace = Trace()
+    attach_trace(trace)
+    get_metrics_server()
+    get_prewarmer()
+    # Réabonne les favoris enregistrés dès le démarrage, avant toute visite de l'onglet Favoris
+    get_watcher()
     init_session_state()
     
     # En-tête stylisé
     st.markdown('<h1 class="main-header">TGV Max Finder</h1>', unsafe_allow_html=True)
     
-    # Calcul simple de la date limite (aujourd'hui + 30 jours)
-    latest_date = datetime.now().date() + timedelta(days=30)
-    
-    # Test temporaire des dates de juin
-    june_dates = test_june_dates()
-    if june_dates:
-        st.sidebar.write("Dates trouvées en juin:", june_dates)
+    # Date limite réelle des réservations (requête agrégée mise en cache)
+    try:
+        latest_date = find_latest_train_date()
+    except UpstreamError:
+        latest_date = MAX_DATE
     
     # Affichage de la date limite en haut de page
     st.markdown(
@@ -507,7 +616,16 @@ def main():
         """,
         unsafe_allow_html=True
     )
-
+    
+    record_render(
+        import_seconds=_IMPORT_SECONDS,
+        first_paint_seconds=perf_counter() - _SCRIPT_START,
+        # Seuls les appels de cette exécution comptent, pas ceux des threads de fond ou des autres sessions
+        upstream_calls=trace.upstream_calls
+    )
+    if st.query_params.get("diagnostics") == "1":
+        render_diagnostics()
+    
     # Sidebar pour les filtres
     with st.sidebar:
         st.markdown('<h2 style="color: #1d1d1f; font-size: 24px; margin-bottom: 1.5rem;">Paramètres de recherche</h2>', unsafe_allow_html=True)
@@ -540,12 +658,47 @@ def main():
                 value=DEFAULT_RANGE_DAYS,
                 help="Choisissez sur combien de jours vous souhaitez rechercher"
             )
+        elif search_mode == SearchMode.CONNECTIONS:
+            col1, col2 = st.columns(2)
+            with col1:
+                origin_city = st.text_input("Ville de départ", DEFAULT_ORIGIN, help="Exemple: PARIS, LYON, MARSEILLE...")
+            with col2:
+                destination_city = st.text_input("Ville d'arrivée", help="Vide : toutes les destinations")
+            date_range_days = DEFAULT_RANGE_DAYS
         else:
             origin_city = st.text_input("Ville de départ", DEFAULT_ORIGIN, help="Exemple: PARIS, LYON, MARSEILLE...")
             destination_city = None
             date_range_days = DEFAULT_RANGE_DAYS
         
-        if search_mode == SearchMode.ROUND_TRIP:
+        min_stay, max_stay = DEFAULT_MIN_STAY, DEFAULT_MAX_STAY
+        max_changes, min_transfer, max_transfer = MAX_CHANGES, MIN_TRANSFER_MINUTES, MAX_TRANSFER_MINUTES
+        if search_mode == SearchMode.FLEXIBLE_ROUND_TRIP:
+            st.markdown(
+                '<div class="info-box">🔀 Comparez tous les allers-retours sur plusieurs jours de départ</div>',
+                unsafe_allow_html=True
+            )
+            depart_date = st.date_input(
+                "Premier jour de départ",
+                min_value=MIN_DATE,
+                max_value=MAX_DATE,
+                value=MIN_DATE + timedelta(days=1)
+            )
+            date_range_days = st.slider(
+                "Nombre de jours de départ possibles",
+                min_value=1,
+                max_value=MAX_RANGE_DAYS,
+                value=DEFAULT_RANGE_DAYS,
+                help="Les départs sont cherchés à partir du premier jour, sur ce nombre de jours"
+            )
+            min_stay, max_stay = st.slider(
+                "Durée du séjour (jours)",
+                min_value=0,
+                max_value=MAX_STAY_DAYS,
+                value=(DEFAULT_MIN_STAY, DEFAULT_MAX_STAY),
+                help="Nombre de jours entre l'aller et le retour"
+            )
+            return_date = None
+        elif search_mode == SearchMode.ROUND_TRIP:
             st.markdown(
                 '<div class="info-box">🔄 Trouvez des trajets aller-retour depuis votre ville</div>',
                 unsafe_allow_html=True
@@ -571,6 +724,11 @@ def main():
                     '<div class="info-box">🎯 Explorez toutes les destinations accessibles</div>',
                     unsafe_allow_html=True
                 )
+            elif search_mode == SearchMode.CONNECTIONS:
+                st.markdown(
+                    '<div class="info-box">🔗 Trouvez les trajets avec un ou deux changements</div>',
+                    unsafe_allow_html=True
+                )
             depart_date = st.date_input(
                 "Date de départ",
                 min_value=MIN_DATE,
@@ -578,12 +736,27 @@ def main():
                 value=MIN_DATE + timedelta(days=1)
             )
             return_date = None
+            if search_mode == SearchMode.CONNECTIONS:
+                max_changes = st.slider(
+                    "Correspondances maximum",
+                    min_value=1,
+                    max_value=MAX_CHANGES,
+                    value=MAX_CHANGES
+                )
+                min_transfer, max_transfer = st.slider(
+                    "Temps de correspondance (minutes)",
+                    min_value=5,
+                    max_value=12 * 60,
+                    value=(MIN_TRANSFER_MINUTES, MAX_TRANSFER_MINUTES),
+                    step=5,
+                    help="Attente minimum et maximum en gare entre deux trains"
+                )
         
         # Plages horaires
         st.markdown("### ⏰ Plages horaires")
         
         # Aller
-        st.write("Horaires de départ" + (" (Aller)" if search_mode == SearchMode.ROUND_TRIP else ""))
+        st.write("Horaires de départ" + (" (Aller)" if search_mode.is_round_trip else ""))
         col3, col4 = st.columns(2)
         with col3:
             depart_start = st.time_input("Début", DEFAULT_START_TIME)
@@ -591,7 +764,7 @@ def main():
             depart_end = st.time_input("Fin", DEFAULT_END_TIME)
         
         # Retour (uniquement pour aller-retour)
-        if search_mode == SearchMode.ROUND_TRIP:
+        if search_mode.is_round_trip:
             st.write("Horaires de départ (Retour)")
             col5, col6 = st.columns(2)
             with col5:
@@ -618,6 +791,7 @@ def main():
             sort_by = st.selectbox(
                 "Trier par",
                 options=["Heure de départ", "Durée", "Destination"],
+                index=1 if search_mode == SearchMode.FLEXIBLE_ROUND_TRIP else 0,
                 help="Choisir le critère de tri des résultats"
             )
             
@@ -629,10 +803,12 @@ def main():
             )
         
         search_button = st.button("Rechercher les trains", type="primary", use_container_width=True)
-
-    # Affichage des résultats
+    
+    # La dernière recherche lancée reste affichée lors des réexécutions (pages, favoris)
     if search_button:
-        df = find_trips(
+        st.session_state.search_stopped = None
+        # Villes normalisées une fois : l'empreinte et les résultats partagés concordent
+        st.session_state.last_search = normalize_search(dict(
             mode=search_mode,
             depart_date=depart_date,
             return_date=return_date,
@@ -642,41 +818,62 @@ def main():
             depart_end=depart_end,
             return_start=return_start,
             return_end=return_end,
-            date_range_days=date_range_days
-        )
+            date_range_days=date_range_days,
+            min_stay=min_stay,
+            max_stay=max_stay,
+            max_changes=max_changes,
+            min_transfer=min_transfer,
+            max_transfer=max_transfer
+        ))
+    
+    # Affichage des résultats
+    if st.session_state.last_search:
+        search_mode = st.session_state.last_search['mode']
+        df = search_trips(st.session_state.last_search)
         
         if not df.empty:
+            if search_mode == SearchMode.SINGLE:
+                with st.expander("🎯 Voir les destinations disponibles", expanded=False):
+                    st.markdown(
+                        f"""<div class="destinations-container">
+                            <div class="destinations-title">Destinations disponibles :</div>
+                            {''.join(f'<span class="destinations-chip">{dest}</span>' for dest in sorted(df['destination'].unique()))}
+                        </div>""",
+                        unsafe_allow_html=True
+                    )
+            elif search_mode == SearchMode.ROUND_TRIP:
+                st.markdown(
+                    f"""<div class="destinations-container">
+                        <div class="destinations-title">Destinations possibles en aller-retour :</div>
+                        {''.join(f'<span class="destinations-chip">{dest}</span>' for dest in sorted(df['Aller_Destination'].unique()))}
+                    </div>""",
+                    unsafe_allow_html=True
+                )
+            
             # Appliquer les filtres avancés
-            if search_mode == SearchMode.ROUND_TRIP:
-                # Conversion des durées en timedelta
-                df['Duree_Aller_Timedelta'] = df['Duree_Aller'].apply(convert_duration_to_timedelta)
-                df['Duree_Retour_Timedelta'] = df['Duree_Retour'].apply(convert_duration_to_timedelta)
-                df['Duree_Totale'] = df['Duree_Aller_Timedelta'] + df['Duree_Retour_Timedelta']
-                
-                # Filtre par durée
-                df = df[df['Duree_Totale'] <= pd.Timedelta(hours=max_duration)]
-                
-                # Tri des résultats
-                if sort_by == "Heure de départ":
-                    df = df.sort_values('Aller_Heure', ascending=(sort_order == "Croissant"))
-                elif sort_by == "Durée":
-                    df = df.sort_values('Duree_Totale', ascending=(sort_order == "Croissant"))
-                else:  # Destination
-                    df = df.sort_values('Aller_Destination', ascending=(sort_order == "Croissant"))
-            else:
-                # Conversion des durées en timedelta
-                df['Duree_Timedelta'] = df['duree'].apply(convert_duration_to_timedelta)
-                
-                # Filtre par durée
-                df = df[df['Duree_Timedelta'] <= pd.Timedelta(hours=max_duration)]
-                
-                # Tri des résultats
-                if sort_by == "Heure de départ":
-                    df = df.sort_values('heure_depart', ascending=(sort_order == "Croissant"))
-                elif sort_by == "Durée":
-                    df = df.sort_values('Duree_Timedelta', ascending=(sort_order == "Croissant"))
-                else:  # Destination
-                    df = df.sort_values('destination', ascending=(sort_order == "Croissant"))
+            with span('find_trips', phase='filter', mode=search_mode.name):
+                if search_mode.is_round_trip:
+                    # Filtre par durée (en minutes)
+                    df = df[df['Duree_Totale_Min'] <= max_duration * 60]
+                    
+                    # Tri des résultats
+                    if sort_by == "Heure de départ":
+                        df = df.sort_values('Aller_Depart_Min', ascending=(sort_order == "Croissant"))
+                    elif sort_by == "Durée":
+                        df = df.sort_values('Duree_Totale_Min', ascending=(sort_order == "Croissant"))
+                    else:  # Destination
+                        df = df.sort_values('Aller_Destination', ascending=(sort_order == "Croissant"))
+                else:
+                    # Filtre par durée (en minutes)
+                    df = df[df['duree_min'] <= max_duration * 60]
+                    
+                    # Tri des résultats
+                    if sort_by == "Heure de départ":
+                        df = df.sort_values('depart_min', ascending=(sort_order == "Croissant"))
+                    elif sort_by == "Durée":
+                        df = df.sort_values('duree_min', ascending=(sort_order == "Croissant"))
+                    else:  # Destination
+                        df = df.sort_values('destination', ascending=(sort_order == "Croissant"))
             
             st.markdown(
                 f'<div style="text-align: center; padding: 2rem;"><h2 style="color: #1d1d1f; font-size: 32px;">✨ {len(df)} trajet{"s" if len(df) > 1 else ""} trouvé{"s" if len(df) > 1 else ""} !</h2></div>',
@@ -687,14 +884,19 @@ def main():
             tab1, tab2, tab3, tab4, tab5 = st.tabs(["📊 Vue détaillée", "📈 Résumé par destination", "📈 Statistiques", "⭐ Favoris", "🗺️ Carte"])
             
             with tab1:
-                # Vue détaillée
-                if search_mode == SearchMode.ROUND_TRIP:
+                # Vue détaillée : dates, heures et durées ne sont mises en forme que pour la page affichée
+                rows = df.iloc[paginate(len(df), "detail_page", DETAIL_PAGE_ROWS)]
+                with span('find_trips', phase='format', mode=search_mode.name):
+                    rows = format_trips_for_display(rows, search_mode.is_round_trip)
+                if search_mode.is_round_trip:
                     st.dataframe(
-                        df[['Aller_Destination', 'Aller_Heure', 'Aller_Arrivee', 'Duree_Aller',
-                            'Retour_Heure', 'Retour_Arrivee', 'Duree_Retour']],
+                        rows[['Aller_Destination', 'Aller_Date', 'Aller_Heure', 'Aller_Arrivee', 'Duree_Aller',
+                            'Retour_Date', 'Retour_Heure', 'Retour_Arrivee', 'Duree_Retour']],
                         hide_index=True,
                         column_config={
                             'Aller_Destination': 'Destination',
+                            'Aller_Date': 'Date Aller',
+                            'Retour_Date': 'Date Retour',
                             'Aller_Heure': 'Départ Aller',
                             'Aller_Arrivee': 'Arrivée Aller',
                             'Duree_Aller': 'Durée Aller',
@@ -704,48 +906,60 @@ def main():
                         }
                     )
                 else:
+                    detail_columns = {
+                        'origine': 'Départ',
+                        'destination': 'Arrivée',
+                        'date': 'Date',
+                        'heure_depart': 'Heure départ',
+                        'heure_arrivee': 'Heure arrivée',
+                        'duree': 'Durée'
+                    }
+                    if search_mode == SearchMode.CONNECTIONS:
+                        detail_columns.update(correspondances='Correspondances', via='Via', train_no='Trains')
                     st.dataframe(
-                        df,
+                        rows[list(detail_columns)],
                         hide_index=True,
-                        column_config={
-                            'origine': 'Départ',
-                            'destination': 'Arrivée',
-                            'date': 'Date',
-                            'heure_depart': 'Heure départ',
-                            'heure_arrivee': 'Heure arrivée',
-                            'duree': 'Durée'
-                        }
+                        column_config=detail_columns
                     )
             
             with tab2:
                 # Résumé par destination
                 st.markdown('<h3 style="color: #1d1d1f; font-size: 24px; margin-bottom: 1.5rem;">Résumé par destination</h3>', unsafe_allow_html=True)
-                if search_mode == SearchMode.ROUND_TRIP:
-                    destinations = df['Aller_Destination'].unique()
-                    for dest in sorted(destinations):
-                        dest_trips = df[df['Aller_Destination'] == dest]
-                        with st.expander(f"🎯 {dest} ({len(dest_trips)} trajets)"):
-                            for _, trip in dest_trips.iterrows():
-                                st.markdown(
-                                    f"""<div class="trip-card">
-                                        <p><strong>Aller :</strong> {trip['Aller_Heure']} → {trip['Aller_Arrivee']} ({trip['Duree_Aller']})</p>
-                                        <p><strong>Retour :</strong> {trip['Retour_Heure']} → {trip['Retour_Arrivee']} ({trip['Duree_Retour']})</p>
-                                    </div>""",
-                                    unsafe_allow_html=True
-                                )
+                if search_mode.is_round_trip:
+                    dest_column = 'Aller_Destination'
+                    trip_columns = {
+                        'Aller_Date': 'Date Aller',
+                        'Aller_Heure': 'Départ Aller',
+                        'Aller_Arrivee': 'Arrivée Aller',
+                        'Duree_Aller': 'Durée Aller',
+                        'Retour_Date': 'Date Retour',
+                        'Retour_Heure': 'Départ Retour',
+                        'Retour_Arrivee': 'Arrivée Retour',
+                        'Duree_Retour': 'Durée Retour'
+                    }
                 else:
-                    destinations = df['destination'].unique()
-                    for dest in sorted(destinations):
-                        dest_trips = df[df['destination'] == dest]
-                        with st.expander(f"🎯 {dest} ({len(dest_trips)} trajets)"):
-                            for _, trip in dest_trips.iterrows():
-                                st.markdown(
-                                    f"""<div class="trip-card">
-                                        <p><strong>{trip['heure_depart']} → {trip['heure_arrivee']}</strong> ({trip['duree']})</p>
-                                        <p class="small-text">Date : {trip['date']}</p>
-                                    </div>""",
-                                    unsafe_allow_html=True
-                                )
+                    dest_column = 'destination'
+                    trip_columns = {
+                        'origine': 'Départ',
+                        'date': 'Date',
+                        'heure_depart': 'Heure départ',
+                        'heure_arrivee': 'Heure arrivée',
+                        'duree': 'Durée'
+                    }
+                    if search_mode == SearchMode.CONNECTIONS:
+                        trip_columns.update(correspondances='Correspondances', via='Via')
+                
+                # Un seul regroupement ; seules les destinations de la page courante sont affichées
+                by_destination = df.groupby(dest_column, observed=True, sort=True)
+                trip_counts = by_destination.size()
+                for dest, n_trips in trip_counts.iloc[paginate(len(trip_counts), "summary_page")].items():
+                    with st.expander(f"🎯 {dest} ({n_trips} trajet{'s' if n_trips > 1 else ''})"):
+                        st.dataframe(
+                            format_trips_for_display(by_destination.get_group(dest),
+                                                     search_mode.is_round_trip)[list(trip_columns)],
+                            hide_index=True,
+                            column_config=trip_columns
+                        )
             
             with tab3:
                 st.markdown('<h3 style="color: #1d1d1f; font-size: 24px; margin-bottom: 1.5rem;">Statistiques des trajets</h3>', unsafe_allow_html=True)
@@ -753,82 +967,72 @@ def main():
                 col1, col2, col3 = st.columns(3)
                 
                 with col1:
-                    if search_mode == SearchMode.ROUND_TRIP:
-                        avg_duration_aller = df['Duree_Aller'].mean() if not df.empty else "N/A"
-                        avg_duration_retour = df['Duree_Retour'].mean() if not df.empty else "N/A"
+                    if search_mode.is_round_trip:
+                        avg_duration_aller = format_duration(df['Duree_Aller_Min'].mean()) if not df.empty else "N/A"
+                        avg_duration_retour = format_duration(df['Duree_Retour_Min'].mean()) if not df.empty else "N/A"
                         st.metric("Durée moyenne aller", avg_duration_aller)
                         st.metric("Durée moyenne retour", avg_duration_retour)
                     else:
-                        avg_duration = df['duree'].mean() if not df.empty else "N/A"
+                        avg_duration = format_duration(df['duree_min'].mean()) if not df.empty else "N/A"
                         st.metric("Durée moyenne", avg_duration)
-
+                
                 with col2:
-                    if search_mode == SearchMode.ROUND_TRIP:
+                    if search_mode.is_round_trip:
                         n_destinations = len(df['Aller_Destination'].unique()) if not df.empty else 0
                     else:
                         n_destinations = len(df['destination'].unique()) if not df.empty else 0
                     st.metric("Nombre de destinations", n_destinations)
                     
-                    earliest_departure = df['Aller_Heure'].min() if search_mode == SearchMode.ROUND_TRIP else df['heure_depart'].min() if not df.empty else "N/A"
-                    latest_departure = df['Aller_Heure'].max() if search_mode == SearchMode.ROUND_TRIP else df['heure_depart'].max() if not df.empty else "N/A"
+                    departures = df['Aller_Depart_Min'] if search_mode.is_round_trip else df['depart_min']
+                    earliest_departure = format_clock(departures.min()) if not df.empty else "N/A"
+                    latest_departure = format_clock(departures.max()) if not df.empty else "N/A"
                     st.metric("Premier départ", earliest_departure)
                     st.metric("Dernier départ", latest_departure)
-
+                
                 with col3:
-                    if search_mode == SearchMode.ROUND_TRIP:
-                        trips_per_dest = df.groupby('Aller_Destination').size()
+                    if search_mode.is_round_trip:
+                        trips_per_dest = df.groupby('Aller_Destination', observed=True).size()
                     else:
-                        trips_per_dest = df.groupby('destination').size() if not df.empty else pd.Series()
+                        trips_per_dest = df.groupby('destination', observed=True).size() if not df.empty else pd.Series()
                     
                     if not trips_per_dest.empty:
                         most_frequent_dest = trips_per_dest.idxmax()
                         n_trips_most_frequent = trips_per_dest.max()
                         st.metric("Destination la plus desservie", f"{most_frequent_dest} ({n_trips_most_frequent} trajets)")
-
+                
                 # Graphique des trajets par heure si pertinent
                 if not df.empty:
                     st.markdown("### 📈 Répartition des trajets par heure")
-                    if search_mode == SearchMode.ROUND_TRIP:
-                        hour_dist = pd.to_datetime(df['Aller_Heure']).dt.hour.value_counts().sort_index()
-                    else:
-                        hour_dist = pd.to_datetime(df['heure_depart']).dt.hour.value_counts().sort_index()
+                    hour_dist = (departures // 60).value_counts().sort_index()
                     st.bar_chart(hour_dist)
-
+            
             with tab4:
-                st.markdown("### ⭐ Gérer mes favoris")
-                if search_mode == SearchMode.ROUND_TRIP:
-                    for _, row in df.iterrows():
-                        col1, col2 = st.columns([4, 1])
-                        with col1:
-                            st.write(f"🚅 {row['Aller_Origine']} → {row['Aller_Destination']}")
-                        with col2:
-                            fav = {
-                                'origin': row['Aller_Origine'],
-                                'destination': row['Aller_Destination']
-                            }
-                            if fav not in st.session_state.favorites:
-                                if st.button("⭐", key=f"add_{row['Aller_Origine']}_{row['Aller_Destination']}"):
-                                    st.session_state.favorites.append(fav)
-                                    st.rerun()
-                else:
-                    for _, row in df.iterrows():
-                        col1, col2 = st.columns([4, 1])
-                        with col1:
-                            st.write(f"🚅 {row['origine']} → {row['destination']}")
-                        with col2:
-                            fav = {
-                                'origin': row['origine'],
-                                'destination': row['destination']
-                            }
-                            if fav not in st.session_state.favorites:
-                                if st.button("⭐", key=f"add_{row['origine']}_{row['destination']}"):
-                                    st.session_state.favorites.append(fav)
-                                    st.rerun()
-
+                st.markdown("### ⭐ Mes favoris")
+                user_id = current_user_id()
+                render_favorites(user_id)
+                
+                st.markdown("### ➕ Ajouter aux favoris")
+                favorite_routes = set(get_favorites_store().routes(user_id))
+                # Un bouton par liaison, quel que soit le nombre de trains qui la desservent
+                routes = aggregate_routes(df, search_mode.is_round_trip)
+                for route in routes.iloc[paginate(len(routes), "favorites_page")].itertuples(index=False):
+                    col1, col2 = st.columns([4, 1])
+                    with col1:
+                        st.write(f"🚅 {route.origine} → {route.destination} ({route.trains} train{'s' if route.trains > 1 else ''})")
+                    with col2:
+                        if (route.origine, route.destination) not in favorite_routes:
+                            if st.button("⭐", key=f"add_{route.origine}_{route.destination}"):
+                                get_favorites_store().add(user_id, route.origine, route.destination)
+                                watcher = get_watcher()
+                                if watcher is not None:
+                                    watcher.subscribe(user_id, route.origine, route.destination)
+                                st.rerun()
+            
             with tab5:
                 st.markdown("### 🗺️ Visualisation des trajets")
                 if not df.empty:
-                    m = create_route_map(df, search_mode)
+                    with span('create_route_map'):
+                        m = create_route_map(df, search_mode)
                     folium_static(m)
                     
                     st.markdown("""
@@ -836,13 +1040,13 @@ def main():
                         <h4>📍 Légende</h4>
                         <p>• 🔵 Gares de départ</p>
                         <p>• 🟢 Gares d'arrivée</p>
-                        <p>• Les lignes bleues représentent les trajets</p>
+                        <p>• Les lignes bleues représentent les liaisons, plus épaisses quand les trains sont nombreux</p>
                         <p>• Cliquez sur les marqueurs pour plus d'informations</p>
                     </div>
                     """, unsafe_allow_html=True)
         else:
-            # Trouver la date la plus éloignée disponible dans l'API
-            future_date = MAX_DATE
+            # Date la plus éloignée disponible dans l'API
+            future_date = latest_date
             st.markdown(
                 f'''<div class="info-box" style="text-align: center; padding: 2rem;">
                     <h3 style="color: #1d1d1f;">Aucun trajet trouvé pour ces critères</h3>
@@ -850,7 +1054,13 @@ def main():
                 </div>''',
                 unsafe_allow_html=True
             )
-
+    else:
+        # Avant toute recherche, les favoris restent consultables
+        render_favorites(current_user_id(), show_empty=False)
+    
+    if st.query_params.get("diagnostics") == "1":
+        render_search_trace(trace)
+    
     # Footer avec des informations supplémentaires
     st.markdown("---")
     st.markdown("""
@@ -860,6 +1070,7 @@ def main():
             <li style="margin-bottom: 0.5rem;">• Le mode "Aller simple" est parfait pour explorer toutes les destinations disponibles depuis votre ville</li>
             <li style="margin-bottom: 0.5rem;">• Le mode "Aller-retour" vous aide à trouver les meilleures correspondances</li>
             <li style="margin-bottom: 0.5rem;">• Le mode "Plage de dates" est idéal quand vous êtes flexible sur les dates</li>
+            <li style="margin-bottom: 0.5rem;">• Le mode "Avec correspondances" propose aussi les trajets avec un ou deux changements</li>
         </ul>
     </div>
     """, unsafe_allow_html=True)
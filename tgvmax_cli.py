@@ -0,0 +1,284 @@
+"""
+Recherche de trajets TGV Max en ligne de commande, sans l'interface Streamlit.
+
+    python tgvmax_cli.py search --from PARIS --range 30 --format parquet -o trajets.parquet
+    python tgvmax_cli.py serve --port 8000
+    curl 'http://localhost:8000/search?from=PARIS&range=7'
+    python tgvmax_cli.py watch 'PARIS (intramuros):LYON PART DIEU' --webhook https://exemple.fr/alertes
+"""
+import argparse
+import json
+import logging
+import sys
+import threading
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib.parse import parse_qs, urlparse
+import pandas as pd
+from config import (
+    MIN_DATE, DEFAULT_START_TIME, DEFAULT_END_TIME, DEFAULT_RANGE_DAYS, DEFAULT_MIN_STAY,
+    DEFAULT_MAX_STAY, MAX_CHANGES, MIN_TRANSFER_MINUTES, MAX_TRANSFER_MINUTES, SNAPSHOT_PATH,
+    SNAPSHOT_REFRESH_INTERVAL
+)
+from search import LocalTripSource, SearchMode, TripSource, find_trips, normalize_search
+from metrics import registry
+from sncf_api import UpstreamError
+from snapshot import TrainSnapshot
+from watcher import AvailabilityWatcher, FileNotifier, WebhookNotifier
+from trips import format_trips_for_display
+
+logger = logging.getLogger(__name__)
+
+MODES = {
+    'single': SearchMode.SINGLE,
+    'round-trip': SearchMode.ROUND_TRIP,
+    'range': SearchMode.DATE_RANGE,
+    'flexible': SearchMode.FLEXIBLE_ROUND_TRIP,
+    'connections': SearchMode.CONNECTIONS
+}
+FORMATS = ['csv', 'json', 'parquet']
+
+def _parse_window(value: Optional[str], default=(DEFAULT_START_TIME, DEFAULT_END_TIME)):
+    # Plage horaire 'HH:MM-HH:MM'
+    if not value:
+        return default
+    start, end = value.split('-')
+    return (datetime.strptime(start.strip(), '%H:%M').time(),
+            datetime.strptime(end.strip(), '%H:%M').time())
+
+def build_search(params: Dict[str, Optional[str]]) -> Dict:
+    """
+    Construit les paramètres de find_trips à partir d'options textuelles
+    (ligne de commande ou requête HTTP). Lève ValueError si elles sont invalides.
+    """
+    depart_date = date.fromisoformat(params['date']) if params.get('date') else MIN_DATE + timedelta(days=1)
+    return_date = date.fromisoformat(params['return_date']) if params.get('return_date') else None
+    
+    mode_name = params.get('mode')
+    if not mode_name:
+        mode_name = 'range' if params.get('range') else 'round-trip' if return_date else 'single'
+    if mode_name not in MODES:
+        raise ValueError(f"Mode inconnu : {mode_name} (choix : {', '.join(MODES)})")
+    mode = MODES[mode_name]
+    if mode == SearchMode.ROUND_TRIP and return_date is None:
+        raise ValueError("Une date de retour est nécessaire pour un aller-retour")
+    
+    depart_start, depart_end = _parse_window(params.get('depart'))
+    return_start, return_end = _parse_window(params.get('return'), default=(None, None))
+    if mode.is_round_trip and return_start is None:
+        return_start, return_end = DEFAULT_START_TIME, DEFAULT_END_TIME
+    min_stay, max_stay = (
+        (int(bound) for bound in params['stay'].split('-')) if params.get('stay')
+        else (DEFAULT_MIN_STAY, DEFAULT_MAX_STAY)
+    )
+    if not 0 <= min_stay <= max_stay:
+        raise ValueError(f"Durée de séjour invalide : {min_stay}-{max_stay}")
+    min_transfer, max_transfer = (
+        (int(bound) for bound in params['transfer'].split('-')) if params.get('transfer')
+        else (MIN_TRANSFER_MINUTES, MAX_TRANSFER_MINUTES)
+    )
+    if not 0 <= min_transfer <= max_transfer:
+        raise ValueError(f"Durée de correspondance invalide : {min_transfer}-{max_transfer}")
+    
+    return normalize_search(dict(
+        mode=mode,
+        depart_date=depart_date,
+        return_date=return_date,
+        origin_city=params.get('origin') or None,
+        destination_city=params.get('destination') or None,
+        depart_start=depart_start,
+        depart_end=depart_end,
+        return_start=return_start,
+        return_end=return_end,
+        date_range_days=int(params['range']) if params.get('range') else DEFAULT_RANGE_DAYS,
+        min_stay=min_stay,
+        max_stay=max_stay,
+        max_changes=int(params['changes']) if params.get('changes') else MAX_CHANGES,
+        min_transfer=min_transfer,
+        max_transfer=max_transfer
+    ))
+
+def export_frame(df: pd.DataFrame, mode: SearchMode, fmt: str) -> pd.DataFrame:
+    """
+    Table exportée : typée pour Parquet, avec en plus les colonnes
+    texte de l'interface (dates, heures, durées) pour CSV et JSON.
+    """
+    if df.empty or fmt == 'parquet':
+        return df
+    return format_trips_for_display(df, mode.is_round_trip)
+
+def to_json(df: pd.DataFrame) -> str:
+    return df.to_json(orient='records', date_format='iso', force_ascii=False)
+
+def run_search(args: argparse.Namespace) -> int:
+    try:
+        search = build_search(vars(args))
+    except ValueError as e:
+        logger.error(str(e))
+        return 2
+    
+    source = LocalTripSource.from_config(use_snapshot=not args.no_snapshot)
+    try:
+        df = find_trips(source, **search)
+    except UpstreamError as e:
+        logger.error(str(e))
+        return 1
+    
+    df = export_frame(df, search['mode'], args.format)
+    if args.format == 'parquet':
+        df.to_parquet(args.output, index=False)
+    elif args.format == 'json':
+        output = to_json(df)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                f.write(output)
+        else:
+            sys.stdout.write(output + '\n')
+    else:
+        df.to_csv(args.output or sys.stdout, index=False)
+    logger.info("%d trajets trouvés", len(df))
+    return 0
+
+def make_handler(source: TripSource):
+    """
+    Gestionnaire HTTP : GET /search avec les options de la commande search,
+    GET /metrics pour les métriques au format Prometheus.
+    """
+    class SearchHandler(BaseHTTPRequestHandler):
+        def _send(self, status: int, body: str, content_type: str = 'application/json'):
+            payload = body.encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', f'{content_type}; charset=utf-8')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+        
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == '/metrics':
+                self._send(200, registry.render(), 'text/plain; version=0.0.4')
+                return
+            if url.path != '/search':
+                self._send(404, json.dumps({'error': 'not found'}))
+                return
+            query = {key.replace('-', '_'): values[-1] for key, values in parse_qs(url.query).items()}
+            # Mêmes noms que la ligne de commande : from / to
+            query.setdefault('origin', query.pop('from', None))
+            query.setdefault('destination', query.pop('to', None))
+            try:
+                search = build_search(query)
+            except ValueError as e:
+                self._send(400, json.dumps({'error': str(e)}, ensure_ascii=False))
+                return
+            try:
+                df = find_trips(source, **search)
+            except UpstreamError as e:
+                self._send(502, json.dumps({'error': str(e)}, ensure_ascii=False))
+                return
+            self._send(200, to_json(export_frame(df, search['mode'], 'json')))
+        
+        def log_message(self, format, *args):
+            logger.info("%s - %s", self.address_string(), format % args)
+    
+    return SearchHandler
+
+def run_server(args: argparse.Namespace) -> int:
+    # Processus de longue durée : la copie locale est rafraîchie en arrière-plan, comme dans l'application
+    source = LocalTripSource.from_config(use_snapshot=not args.no_snapshot,
+                                         refresh_interval=SNAPSHOT_REFRESH_INTERVAL)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(source))
+    logger.info("Écoute sur http://%s:%d/search", args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if source.snapshot is not None:
+            source.snapshot.stop()
+    return 0
+
+def run_watch(args: argparse.Namespace) -> int:
+    """
+    Surveille des liaisons 'ORIGINE:DESTINATION' : la copie locale est
+    rafraîchie toutes les `interval` secondes et chaque nouveau train
+    est signalé par webhook ou en JSON (une ligne par alerte).
+    """
+    watcher = AvailabilityWatcher(WebhookNotifier(args.webhook) if args.webhook else FileNotifier(args.output))
+    for route in args.routes:
+        origin, _, destination = route.partition(':')
+        if not origin or not destination:
+            logger.error("Liaison invalide : %s (format ORIGINE:DESTINATION)", route)
+            return 2
+        watcher.subscribe(args.subscriber, origin, destination)
+    
+    snapshot = TrainSnapshot(SNAPSHOT_PATH)
+    snapshot.load()
+    watcher.attach(snapshot)
+    snapshot.start(args.interval)
+    logger.info("Surveillance de %d liaison(s), rafraîchissement toutes les %d s", len(args.routes), args.interval)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        snapshot.stop()
+    return 0
+
+def parse_args(argv=None) -> argparse.Namespace:
+    # Options communes, acceptées après le nom de la commande
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--no-snapshot', action='store_true',
+                        help="ignorer la copie locale du jeu de données")
+    common.add_argument('-v', '--verbose', action='store_true')
+    
+    parser = argparse.ArgumentParser(prog='tgvmax', description="Recherche de trajets TGV Max")
+    commands = parser.add_subparsers(dest='command', required=True)
+    
+    search = commands.add_parser('search', parents=[common], help="rechercher des trajets")
+    search.add_argument('--mode', choices=list(MODES),
+                        help="par défaut : range avec --range, round-trip avec --return-date, sinon single")
+    search.add_argument('--from', dest='origin', help="gare de départ (préfixe)")
+    search.add_argument('--to', dest='destination', help="gare d'arrivée (préfixe, modes range et connections)")
+    search.add_argument('--date', help="date de départ AAAA-MM-JJ (défaut : demain)")
+    search.add_argument('--return-date', help="date de retour AAAA-MM-JJ")
+    search.add_argument('--range', help="nombre de jours parcourus (modes range et flexible)")
+    search.add_argument('--depart', help="plage horaire de départ HH:MM-HH:MM")
+    search.add_argument('--return', help="plage horaire de retour HH:MM-HH:MM")
+    search.add_argument('--stay', help="durée de séjour en jours MIN-MAX (mode flexible)")
+    search.add_argument('--changes', help=f"correspondances maximum (mode connections, défaut : {MAX_CHANGES})")
+    search.add_argument('--transfer', help="temps de correspondance en minutes MIN-MAX (mode connections)")
+    search.add_argument('--format', choices=FORMATS, default='csv')
+    search.add_argument('-o', '--output', help="fichier de sortie (obligatoire en parquet)")
+    
+    serve = commands.add_parser('serve', parents=[common], help="servir les recherches en HTTP/JSON")
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8000)
+    
+    watch = commands.add_parser('watch', help="signaler les nouvelles places sur des liaisons")
+    watch.add_argument('routes', nargs='+', metavar='ORIGINE:DESTINATION', help="noms exacts des gares")
+    watch.add_argument('--webhook', help="URL recevant chaque alerte en POST JSON")
+    watch.add_argument('-o', '--output', default='-', help="fichier des alertes JSON (défaut : sortie standard)")
+    watch.add_argument('--subscriber', default='cli', help="abonné indiqué dans les alertes")
+    watch.add_argument('--interval', type=int, default=SNAPSHOT_REFRESH_INTERVAL,
+                       help="secondes entre deux rafraîchissements")
+    watch.add_argument('-v', '--verbose', action='store_true')
+    
+    args = parser.parse_args(argv)
+    if args.command == 'search' and args.format == 'parquet' and not args.output:
+        parser.error("--output est obligatoire avec --format parquet")
+    return args
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose or args.command != 'search' else logging.WARNING,
+                        format='%(levelname)s %(message)s', stream=sys.stderr)
+    if args.command == 'serve':
+        return run_server(args)
+    if args.command == 'watch':
+        return run_watch(args)
+    return run_search(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,228 @@
+"""
+Schéma typé des trajets et traitements vectorisés associés.
+Les trains de l'API sont normalisés une seule fois à l'ingestion : gares
+en catégories, heures en minutes depuis minuit (int16), date en datetime64.
+Les chaînes ('HH:MM', 'XhMM', 'JJ/MM/AAAA') ne sont produites qu'à l'affichage.
+"""
+from datetime import time
+from typing import Dict, Iterable, List, Union
+import pandas as pd
+from sncf_api import TRAIN_FIELDS
+
+MINUTES_PER_DAY = 24 * 60
+
+def parse_minutes(times: pd.Series) -> pd.Series:
+    """
+    Convertit des heures 'HH:MM' en minutes depuis minuit (vectorisé).
+    """
+    parsed = pd.to_datetime(times, format='%H:%M')
+    return parsed.dt.hour * 60 + parsed.dt.minute
+
+def compute_durations(departures: pd.Series, arrivals: pd.Series) -> pd.Series:
+    """
+    Durées en minutes entre deux séries de minutes depuis minuit.
+    Un train arrivant après minuit a une durée positive.
+    """
+    return (arrivals.astype('int32') - departures.astype('int32')) % MINUTES_PER_DAY
+
+def minute_of_day(value: time) -> int:
+    return value.hour * 60 + value.minute
+
+def normalize_trains(trains: Union[List[Dict], pd.DataFrame]) -> pd.DataFrame:
+    """
+    Construit la table typée des trajets à partir des enregistrements de l'API.
+    """
+    raw = trains if isinstance(trains, pd.DataFrame) else pd.DataFrame(trains, columns=TRAIN_FIELDS)
+    depart = parse_minutes(raw['heure_depart'])
+    arrivee = parse_minutes(raw['heure_arrivee'])
+    return pd.DataFrame({
+        # Précision à la seconde : la plus grossière que pandas sait représenter
+        'date': pd.to_datetime(raw['date'].str.slice(0, 10), format='%Y-%m-%d').astype('datetime64[s]'),
+        'train_no': raw['train_no'].astype(str),
+        'origine': raw['origine'].astype('category'),
+        'destination': raw['destination'].astype('category'),
+        'depart_min': depart.astype('int16'),
+        'arrivee_min': arrivee.astype('int16'),
+        'duree_min': compute_durations(depart, arrivee).astype('int16'),
+    })
+
+def concat_trips(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Concatène des tables typées en conservant des gares catégorielles.
+    """
+    if not frames:
+        return normalize_trains([])
+    df = pd.concat(frames, ignore_index=True)
+    # Des catégories différentes d'un jour à l'autre dégradent les colonnes en objets
+    for column in ['origine', 'destination']:
+        if not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype('category')
+    return df
+
+def trips_to_records(df: pd.DataFrame) -> List[Dict]:
+    """
+    Reconstruit les enregistrements au format de l'API à partir de la table typée.
+    """
+    return pd.DataFrame({
+        'date': df['date'].dt.strftime('%Y-%m-%d'),
+        'train_no': df['train_no'],
+        'origine': df['origine'].astype(str),
+        'destination': df['destination'].astype(str),
+        'heure_depart': format_clock(df['depart_min']),
+        'heure_arrivee': format_clock(df['arrivee_min']),
+    }).to_dict('records')
+
+def format_clock(minutes):
+    """
+    Formate des minutes depuis minuit (nombre ou Series) au format 'HH:MM'.
+    """
+    if isinstance(minutes, pd.Series):
+        minutes = minutes.astype(int)
+        return (minutes // 60).astype(str).str.zfill(2) + ':' + (minutes % 60).astype(str).str.zfill(2)
+    minutes = int(minutes)
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+def format_duration(minutes):
+    """
+    Formate une durée en minutes (nombre ou Series) au format 'XhMM'.
+    À n'appeler qu'au moment de l'affichage.
+    """
+    if isinstance(minutes, pd.Series):
+        minutes = minutes.round().astype(int)
+        return (minutes // 60).astype(str) + 'h' + (minutes % 60).astype(str).str.zfill(2)
+    minutes = int(round(minutes))
+    return f"{minutes // 60}h{minutes % 60:02d}"
+
+def format_trips_for_display(df: pd.DataFrame, is_round_trip: bool) -> pd.DataFrame:
+    """
+    Ajoute les colonnes texte affichées (dates, heures, durées) à une table typée.
+    """
+    if is_round_trip:
+        return df.assign(
+            Aller_Date=df['Aller_Date'].dt.strftime('%d/%m/%Y'),
+            Aller_Heure=format_clock(df['Aller_Depart_Min']),
+            Aller_Arrivee=format_clock(df['Aller_Arrivee_Min']),
+            Duree_Aller=format_duration(df['Duree_Aller_Min']),
+            Retour_Date=df['Retour_Date'].dt.strftime('%d/%m/%Y'),
+            Retour_Heure=format_clock(df['Retour_Depart_Min']),
+            Retour_Arrivee=format_clock(df['Retour_Arrivee_Min']),
+            Duree_Retour=format_duration(df['Duree_Retour_Min'])
+        )
+    return df.assign(
+        date=df['date'].dt.strftime('%d/%m/%Y'),
+        heure_depart=format_clock(df['depart_min']),
+        heure_arrivee=format_clock(df['arrivee_min']),
+        duree=format_duration(df['duree_min'])
+    )
+
+def aggregate_routes(df: pd.DataFrame, is_round_trip: bool) -> pd.DataFrame:
+    """
+    Regroupe les trajets par couple (origine, destination) : nombre de trains
+    et liste triée des heures de départ distinctes (en minutes).
+    """
+    if is_round_trip:
+        df = df.rename(columns={
+            'Aller_Origine': 'origine',
+            'Aller_Destination': 'destination',
+            'Aller_Depart_Min': 'depart_min'
+        })
+    keys = ['origine', 'destination']
+    grouped = df.groupby(keys, observed=True)
+    routes = grouped.size().rename('trains').to_frame()
+    routes['departs'] = (
+        df[keys + ['depart_min']].drop_duplicates()
+        .sort_values('depart_min')
+        .groupby(keys, observed=True)['depart_min'].agg(list)
+    )
+    return routes.reset_index()
+
+def filter_trains_by_time(df: pd.DataFrame, depart_start: time, depart_end: time,
+                          return_start: time = None, return_end: time = None,
+                          is_round_trip: bool = True) -> pd.DataFrame:
+    """
+    Filtre les trains selon les plages horaires spécifiées.
+    """
+    if df.empty:
+        return df
+    
+    if is_round_trip:
+        mask = df['Aller_Depart_Min'].between(minute_of_day(depart_start), minute_of_day(depart_end))
+        if return_start and return_end:
+            mask &= df['Retour_Depart_Min'].between(minute_of_day(return_start), minute_of_day(return_end))
+    else:
+        mask = df['depart_min'].between(minute_of_day(depart_start), minute_of_day(depart_end))
+    return df[mask]
+
+def _align_stations(outbound: pd.DataFrame, inbound: pd.DataFrame):
+    # Des catégories communes rendent la jointure sur les gares purement entière
+    stations = sorted(set().union(*(df[column].cat.categories
+                                    for df in (outbound, inbound)
+                                    for column in ('origine', 'destination'))))
+    return [
+        df.assign(**{column: df[column].cat.set_categories(stations) for column in ('origine', 'destination')})
+        for df in (outbound, inbound)
+    ]
+
+def _prefix_columns(df: pd.DataFrame, prefix: str) -> pd.DataFrame:
+    columns = {
+        'origine': f'{prefix}Origine',
+        'destination': f'{prefix}Destination',
+        'date': f'{prefix}Date',
+        'depart_min': f'{prefix}Depart_Min',
+        'arrivee_min': f'{prefix}Arrivee_Min',
+        'duree_min': f'Duree_{prefix}Min'
+    }
+    return df[list(columns)].rename(columns=columns)
+
+def match_round_trips(outbound: pd.DataFrame, inbound: pd.DataFrame,
+                      depart_start: time = None, depart_end: time = None,
+                      return_start: time = None, return_end: time = None,
+                      stay_days: Iterable[int] = None) -> pd.DataFrame:
+    """
+    Associe chaque train aller aux trains retour du trajet inverse.
+    Les plages horaires sont appliquées avant la jointure, qui se fait sur
+    la clé (origine, destination) inversée. Avec `stay_days`, seuls les
+    retours partant ce nombre de jours après l'aller sont retenus. Un retour
+    doit toujours partir après l'arrivée de l'aller, minuit passé compris.
+    """
+    if stay_days is not None:
+        stay_days = list(stay_days)
+    if outbound.empty or inbound.empty or stay_days == []:
+        return pd.DataFrame()
+    
+    if depart_start and depart_end:
+        outbound = filter_trains_by_time(outbound, depart_start, depart_end, is_round_trip=False)
+        if return_start and return_end:
+            inbound = filter_trains_by_time(inbound, return_start, return_end, is_round_trip=False)
+    
+    # Seuls les trajets présents dans les deux sens participent à la jointure
+    outbound = outbound[outbound['origine'].isin(inbound['destination'])]
+    if outbound.empty:
+        return pd.DataFrame()
+    
+    outbound, inbound = _align_stations(outbound, inbound)
+    outbound = _prefix_columns(outbound, 'Aller_')
+    inbound = _prefix_columns(inbound, 'Retour_')
+    left_on = ['Aller_Origine', 'Aller_Destination']
+    right_on = ['Retour_Destination', 'Retour_Origine']
+    
+    if stay_days is None:
+        df = outbound.merge(inbound, left_on=left_on, right_on=right_on)
+    else:
+        # Une jointure exacte par durée de séjour, sans produit cartésien entre jours
+        df = pd.concat([
+            outbound.merge(
+                inbound.assign(Jour_Aller=inbound['Retour_Date'] - pd.Timedelta(days=stay)),
+                left_on=left_on + ['Aller_Date'],
+                right_on=right_on + ['Jour_Aller']
+            ).drop(columns='Jour_Aller')
+            for stay in stay_days
+        ], ignore_index=True)
+    
+    # Minutes depuis le jour de l'aller : départ du retour et arrivée de l'aller
+    return_departure = (df['Retour_Date'] - df['Aller_Date']).dt.days * MINUTES_PER_DAY + df['Retour_Depart_Min']
+    outbound_arrival = df['Aller_Depart_Min'].astype('int32') + df['Duree_Aller_Min']
+    df = df[(return_departure > outbound_arrival).to_numpy()].reset_index(drop=True)
+    
+    df['Duree_Totale_Min'] = df['Duree_Aller_Min'].astype('int32') + df['Duree_Retour_Min']
+    return df
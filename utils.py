@@ -1,91 +1,180 @@
 import pandas as pd
-from datetime import datetime, time
-from typing import List, Dict
-import requests
+import threading
+from datetime import date
+from typing import Callable, List, Dict, Optional
 import streamlit as st
-from config import SNCF_API_URL, API_LIMIT, CACHE_TTL
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from config import (
+    CACHE_TTL, MAX_CONCURRENT_REQUESTS, SNAPSHOT_ENABLED, SNAPSHOT_PATH,
+    SNAPSHOT_REFRESH_INTERVAL, STATIONS_PATH, GEOCODE_TTL, GEOCODE_CACHE_PATH, NOMINATIM_USER_AGENT,
+    NOMINATIM_MIN_DELAY, METRICS_ENABLED, METRICS_HOST, METRICS_PORT, WATCH_ENABLED,
+    WATCH_NOTIFIER, WATCH_EVENTS_PATH, WATCH_WEBHOOK_URL, FAVORITES_DB_PATH, MIN_DATE, MAX_DATE,
+    PREWARM_ENABLED, PREWARM_LOG_PATH, PREWARM_LOG_DAYS, PREWARM_START_DELAY
+)
+from sncf_api import UpstreamError
+from snapshot import TrainSnapshot
+from cache_backends import CacheBackend, open_shared_cache
+from day_index import DayIndex
+from search import DayCache, LocalTripSource
+from geocode import GeocodeStore
+from watcher import AvailabilityWatcher, create_notifier
+from favorites import FavoritesStore
+from prewarm import Prewarmer, QueryLog
+from metrics import start_metrics_server
 
-@st.cache_data(ttl=CACHE_TTL)
-def get_tgvmax_trains(date: str, origin: str = None, destination: str = None) -> List[Dict]:
+@st.cache_resource
+def get_snapshot() -> Optional[TrainSnapshot]:
     """
-    Récupère les trains TGV Max disponibles pour une date donnée.
-    Utilise le cache Streamlit pour optimiser les performances.
+    Copie locale du jeu de données, partagée par tout le processus.
+    Le thread de rafraîchissement n'est lancé qu'une fois.
+    """
+    if not SNAPSHOT_ENABLED:
+        return None
+    snapshot = TrainSnapshot(SNAPSHOT_PATH)
+    try:
+        snapshot.load()
+    except Exception:
+        # Fichier illisible : il sera réécrit au premier rafraîchissement
+        pass
+    snapshot.start(SNAPSHOT_REFRESH_INTERVAL)
+    return snapshot
+
+@st.cache_resource
+def get_watcher() -> Optional[AvailabilityWatcher]:
+    """
+    Alertes de nouvelles places sur les favoris, calculées à chaque
+    rafraîchissement de la copie locale. None si l'une ou l'autre est désactivée.
+    """
+    snapshot = get_snapshot()
+    if not WATCH_ENABLED or snapshot is None:
+        return None
+    watcher = AvailabilityWatcher(create_notifier(WATCH_NOTIFIER, path=WATCH_EVENTS_PATH, url=WATCH_WEBHOOK_URL))
+    for user_id, origin, destination in get_favorites_store().subscriptions():
+        watcher.subscribe(user_id, origin, destination)
+    watcher.attach(snapshot)
+    return watcher
+
+@st.cache_resource
+def get_favorites_store() -> FavoritesStore:
+    """
+    Favoris de tous les utilisateurs, conservés sur disque ; leurs
+    disponibilités suivent les rafraîchissements de la copie locale.
+    """
+    store = FavoritesStore(FAVORITES_DB_PATH)
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        store.attach(snapshot)
+    return store
+
+@st.cache_resource
+def get_shared_cache() -> Optional[CacheBackend]:
+    """
+    Cache des réponses de l'API et des géocodages, partagé entre processus
+    (SQLite) ou entre réplicas (Redis). None si le cache est inaccessible.
+    """
+    return open_shared_cache()
+
+@st.cache_resource
+def get_geocoder() -> GeocodeStore:
+    """
+    Coordonnées des gares, partagées par toutes les sessions et conservées
+    sur disque entre les redémarrages.
     """
-    where_conditions = [f"date = date'{date}'", "od_happy_card = 'OUI'"]
+    return GeocodeStore(get_shared_cache(), STATIONS_PATH, NOMINATIM_USER_AGENT,
+                        min_delay=NOMINATIM_MIN_DELAY, ttl=GEOCODE_TTL, path=GEOCODE_CACHE_PATH)
+
+@st.cache_resource
+def get_metrics_server():
+    """
+    Serveur /metrics (format Prometheus), lancé une fois par processus.
+    """
+    if not METRICS_ENABLED:
+        return None
+    return start_metrics_server(METRICS_HOST, METRICS_PORT)
+
+@st.cache_resource
+def get_query_log() -> QueryLog:
+    """Journal des recherches de toutes les sessions, conservé sur disque."""
+    return QueryLog(PREWARM_LOG_PATH, PREWARM_LOG_DAYS)
+
+@st.cache_resource
+def get_prewarmer() -> Optional[Prewarmer]:
+    """
+    Préchauffage des journées recherchées depuis les origines populaires,
+    lancé une fois par processus. Les journées couvertes par la copie locale
+    sont ignorées.
+    """
+    if not PREWARM_ENABLED:
+        return None
+    snapshot = get_snapshot()
     
-    if origin:
-        where_conditions.append(f"origine LIKE '{origin}%'")
-    if destination:
-        where_conditions.append(f"destination LIKE '{destination}%'")
+    def window():
+        # Fenêtre glissante : le processus peut vivre plusieurs jours
+        today = date.today()
+        return today, today + (MAX_DATE - MIN_DATE)
     
-    params = {
-        'where': ' AND '.join(where_conditions),
-        'limit': API_LIMIT,
-        'order_by': 'heure_depart'
-    }
+    def covered(day: str) -> bool:
+        return snapshot is not None and snapshot.covers(day)
     
-    try:
-        response = requests.get(SNCF_API_URL, params=params, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        return data.get('results', [])
-    except requests.exceptions.RequestException as e:
-        st.error(f"Erreur lors de la requête API: {str(e)}")
-        return []
+    prewarmer = Prewarmer(get_day_cache(), get_query_log(), window, skip=covered)
+    prewarmer.start(delay=PREWARM_START_DELAY)
+    return prewarmer
 
-def calculate_duration(departure: str, arrival: str) -> str:
+def get_tgvmax_trains(date: str, origin: str = None, destination: str = None) -> List[Dict]:
     """
-    Calcule la durée entre deux heures au format HH:MM.
+    Récupère les trains TGV Max disponibles pour une date donnée.
+    La journée complète n'est récupérée qu'une fois ; les filtres d'origine
+    et de destination (préfixes) sont appliqués localement.
     """
-    dep = pd.to_datetime(departure, format='%H:%M')
-    arr = pd.to_datetime(arrival, format='%H:%M')
-    duration = arr - dep
-    hours = duration.components.hours
-    minutes = duration.components.minutes
-    return f"{hours}h{minutes:02d}"
+    return get_day_index(date).query(origin, destination)
 
-def filter_trains_by_time(df: pd.DataFrame, depart_start: time, depart_end: time, 
-                         return_start: time = None, return_end: time = None, 
-                         is_round_trip: bool = True) -> pd.DataFrame:
-    """
-    Filtre les trains selon les plages horaires spécifiées.
-    """
-    if df.empty:
-        return df
-        
-    # Conversion des heures en objets time pour la comparaison
-    if is_round_trip:
-        df['Aller_Time'] = pd.to_datetime(df['Aller_Heure'], format='%H:%M').dt.time
-        mask_aller = (df['Aller_Time'] >= depart_start) & (df['Aller_Time'] <= depart_end)
-        
-        if return_start and return_end:
-            df['Retour_Time'] = pd.to_datetime(df['Retour_Heure'], format='%H:%M').dt.time
-            mask_retour = (df['Retour_Time'] >= return_start) & (df['Retour_Time'] <= return_end)
-            mask = mask_aller & mask_retour
-        else:
-            mask = mask_aller
-    else:
-        df['Depart_Time'] = pd.to_datetime(df['heure_depart'], format='%H:%M').dt.time
-        mask = (df['Depart_Time'] >= depart_start) & (df['Depart_Time'] <= depart_end)
-    
-    filtered_df = df[mask].copy()
-    # Suppression des colonnes temporaires
-    cols_to_drop = ['Aller_Time', 'Retour_Time', 'Depart_Time']
-    filtered_df.drop([col for col in cols_to_drop if col in filtered_df.columns], axis=1, inplace=True)
-    return filtered_df
+def get_day_index(date: str) -> DayIndex:
+    """
+    Index des trains d'une journée : depuis la copie locale quand elle couvre
+    la date, sinon depuis l'API (voir search.LocalTripSource.day_index).
+    """
+    return StreamlitTripSource().day_index(date)
 
-def format_single_trips(trains: List[Dict]) -> pd.DataFrame:
+@st.cache_resource
+def get_day_cache() -> DayCache:
     """
-    Formate les trajets simples en DataFrame.
+    Index des journées récupérées auprès de l'API (cache partagé, sinon API),
+    partagés par toutes les sessions sans copie et expirant après CACHE_TTL.
+    Les sessions qui demandent la même journée au même moment partagent une
+    seule requête ; une erreur lève UpstreamError et n'est jamais mise en cache.
     """
-    if not trains:
-        return pd.DataFrame()
-    
-    df = pd.DataFrame(trains)
-    df['date'] = pd.to_datetime(df['date']).dt.strftime('%d/%m/%Y')
-    df['duree'] = df.apply(lambda x: calculate_duration(x['heure_depart'], x['heure_arrivee']), axis=1)
+    return DayCache(CACHE_TTL, get_shared_cache())
+
+def get_coalescing_stats() -> Dict[str, int]:
+    """
+    Requêtes de trains exécutées et requêtes identiques regroupées.
+    """
+    return get_day_cache().stats()
+
+class StreamlitTripSource(LocalTripSource):
+    """
+    Source de l'application : copie locale et cache des journées partagés
+    entre les sessions (st.cache_resource). À créer dans le thread du script,
+    dont le contexte est transmis aux threads de récupération.
+    """
+    def __init__(self, max_workers: int = MAX_CONCURRENT_REQUESTS):
+        super().__init__(get_snapshot(), max_workers=max_workers, days=get_day_cache())
+        # Les threads doivent partager le contexte Streamlit pour le cache et les messages
+        self._ctx = get_script_run_ctx()
     
-    return df[['origine', 'destination', 'date', 'heure_depart', 'heure_arrivee', 'duree']]
+    def init_worker(self):
+        super().init_worker()
+        if self._ctx is not None:
+            add_script_run_ctx(threading.current_thread(), self._ctx)
+
+def fetch_trips_for_dates(dates: List[date], origin: str = None, destination: str = None,
+                          max_workers: int = MAX_CONCURRENT_REQUESTS,
+                          on_progress: Optional[Callable[[int, int], None]] = None) -> pd.DataFrame:
+    """
+    Récupère en parallèle les trains TGV Max de plusieurs dates
+    (voir search.TripSource.trips_for_dates).
+    """
+    return StreamlitTripSource(max_workers).trips_for_dates(dates, origin, destination, on_progress)
 
 def handle_error(func):
     """
@@ -94,6 +183,9 @@ def handle_error(func):
     def wrapper(*args, **kwargs):
         try:
             return func(*args, **kwargs)
+        except UpstreamError as e:
+            st.error(str(e))
+            return pd.DataFrame()
         except Exception as e:
             st.error(f"Une erreur est survenue : {str(e)}")
             return pd.DataFrame()
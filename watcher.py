@@ -0,0 +1,163 @@
+"""
+Surveillance des places TGV Max sur les liaisons suivies.
+À chaque rafraîchissement de la copie locale (un seul téléchargement pour
+tous les utilisateurs), les jours modifiés sont comparés train par train à
+la version précédente ; les nouveaux trains des liaisons suivies sont
+envoyés à leurs abonnés par un notificateur (webhook, fichier ou file).
+"""
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import requests
+from sncf_api import TRAIN_FIELDS
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+Route = Tuple[str, str]
+# Un train est identifié par sa date, son numéro, son trajet et son heure de départ
+TRAIN_KEY = ['date', 'train_no', 'origine', 'destination', 'heure_depart']
+
+registry.describe('tgvmax_watch_alerts_total', "Alertes de nouvelles places envoyées aux abonnés")
+
+def route_key(origin: str, destination: str) -> Route:
+    return origin.strip().upper(), destination.strip().upper()
+
+def new_trains(previous: pa.Table, current: pa.Table, days: Iterable[str]) -> pd.DataFrame:
+    """
+    Trains des jours `days` présents dans `current` mais absents de `previous`.
+    """
+    days = pa.array(sorted(days), pa.string())
+    
+    def select(table: pa.Table) -> pd.DataFrame:
+        return table.filter(pc.is_in(table['date'], value_set=days)).to_pandas()
+    
+    before, after = select(previous), select(current)
+    merged = after.merge(before[TRAIN_KEY].drop_duplicates(), on=TRAIN_KEY, how='left', indicator=True)
+    return merged[merged['_merge'] == 'left_only'].drop(columns='_merge')
+
+class Notifier:
+    """Envoie une alerte (dictionnaire sérialisable en JSON) à son abonné."""
+    name = 'notifier'
+    
+    def notify(self, alert: Dict):
+        raise NotImplementedError
+
+class FileNotifier(Notifier):
+    """Une alerte JSON par ligne, ajoutée au fichier `path` ('-' : sortie standard)."""
+    name = 'file'
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        if path != '-':
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    
+    def notify(self, alert: Dict):
+        line = json.dumps(alert, ensure_ascii=False) + '\n'
+        with self._lock:
+            if self.path == '-':
+                sys.stdout.write(line)
+                sys.stdout.flush()
+                return
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+
+class WebhookNotifier(Notifier):
+    """Envoie chaque alerte en POST JSON à `url`."""
+    name = 'webhook'
+    
+    def __init__(self, url: str, timeout: float = 10):
+        self.url = url
+        self.timeout = timeout
+    
+    def notify(self, alert: Dict):
+        requests.post(self.url, json=alert, timeout=self.timeout).raise_for_status()
+
+class QueueNotifier(Notifier):
+    """Dépose les alertes dans une file, pour un consommateur du même processus."""
+    name = 'queue'
+    
+    def __init__(self, alerts: Optional[queue.Queue] = None):
+        self.alerts = alerts if alerts is not None else queue.Queue()
+    
+    def notify(self, alert: Dict):
+        self.alerts.put(alert)
+
+def create_notifier(kind: str, path: str = None, url: str = None) -> Notifier:
+    """Construit le notificateur configuré : 'file', 'webhook' ou 'queue'."""
+    if kind == 'file':
+        return FileNotifier(path)
+    if kind == 'webhook':
+        return WebhookNotifier(url)
+    if kind == 'queue':
+        return QueueNotifier()
+    raise ValueError(f"Notificateur inconnu : {kind}")
+
+class AvailabilityWatcher:
+    """
+    Abonnements (abonné, liaison) et comparaison des rafraîchissements.
+    Le coût d'un rafraîchissement dépend du nombre de jours modifiés et de
+    nouveaux trains, pas du nombre d'abonnés : chaque liaison ayant de
+    nouveaux trains est cherchée une fois dans les abonnements.
+    """
+    def __init__(self, notifier: Notifier):
+        self.notifier = notifier
+        self._lock = threading.Lock()
+        self._subscribers: Dict[Route, Set[str]] = {}
+    
+    def subscribe(self, subscriber: str, origin: str, destination: str):
+        with self._lock:
+            self._subscribers.setdefault(route_key(origin, destination), set()).add(subscriber)
+    
+    def unsubscribe(self, subscriber: str, origin: str, destination: str):
+        route = route_key(origin, destination)
+        with self._lock:
+            subscribers = self._subscribers.get(route, set())
+            subscribers.discard(subscriber)
+            if not subscribers:
+                self._subscribers.pop(route, None)
+    
+    def attach(self, snapshot):
+        """Compare chaque rafraîchissement de `snapshot` (voir TrainSnapshot)."""
+        snapshot.add_listener(self.on_refresh)
+    
+    def on_refresh(self, previous: pa.Table, current: pa.Table, days: List[str]) -> List[Dict]:
+        """
+        Envoie une alerte par abonné et par liaison ayant de nouveaux trains.
+        Le premier chargement ne sert que de référence.
+        """
+        with self._lock:
+            watched = {route: set(subscribers) for route, subscribers in self._subscribers.items()}
+        if previous.num_rows == 0 or not watched or not days:
+            return []
+        
+        fresh = new_trains(previous, current, days)
+        detected_at = datetime.now().isoformat(timespec='seconds')
+        alerts = []
+        for (origin, destination), trains in fresh.groupby(['origine', 'destination'], sort=True):
+            subscribers = watched.get(route_key(origin, destination))
+            if not subscribers:
+                continue
+            records = trains[TRAIN_FIELDS].sort_values(['date', 'heure_depart']).to_dict('records')
+            alerts.extend(
+                {'subscriber': subscriber, 'origine': origin, 'destination': destination,
+                 'trains': records, 'detected_at': detected_at}
+                for subscriber in sorted(subscribers)
+            )
+        
+        for alert in alerts:
+            try:
+                self.notifier.notify(alert)
+                registry.inc('tgvmax_watch_alerts_total', notifier=self.notifier.name)
+            except Exception as e:
+                logger.warning("Alerte non envoyée à %s : %s", alert['subscriber'], e)
+        return alerts